@@ -0,0 +1,109 @@
+"""Conditional GETs of the sensor and room lists, driven by a registry version.
+
+The version is kept in Django's cache and changes whenever a sensor or room is saved or deleted,
+or, at most once per ``SENSOR_LAST_SEEN_VERSION_INTERVAL``, when sensors' ``last_seen`` is flushed. Views using ``VersionedMixin`` send it as an ETag, answer
+a matching ``If-None-Match`` with 304 before touching the database, and otherwise serve the
+body they rendered for the version, if any. Only anonymous JSON bodies are cached, as the
+browsable API's pages carry the user's name and CSRF token. With several server processes use a shared cache
+backend, or each process will only see its own changes.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+
+VERSION_KEY = "homebase:registry-version"
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Nanoseconds rather than a counter from 1, so a lost version is never reused
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _set_version():
+    cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def bump_version():
+    """Mark the sensors and rooms as changed, now and when the current transaction commits.
+
+    Bumping again on commit keeps a body rendered by another request between the two from
+    being served with the new version.
+    """
+    _set_version()
+    transaction.on_commit(_set_version)
+
+
+def _etag_matches(header, etag):
+    if header is None:
+        return False
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+
+class VersionedMixin:
+    """Conditional and cached ``list`` and ``retrieve`` for viewsets over sensors or rooms."""
+
+    def list(self, request, *args, **kwargs):
+        return self.versioned(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.versioned(super().retrieve, request, *args, **kwargs)
+
+    def is_versioned(self, request):
+        """Whether the response only changes with the registry version."""
+        return True
+
+    def versioned(self, view, request, *args, **kwargs):
+        if not self.is_versioned(request):
+            return view(request, *args, **kwargs)
+        version = get_version()
+        etag = f'"{version}-{request.accepted_renderer.format}"'
+        headers = {"ETag": etag, "Vary": "Accept"}
+        # HTTP dates have one-second precision: the end of the version's second is sent, and only
+        # once it has passed, so that a later version can never fall before a date a client holds
+        last_modified = -(-version // 1_000_000_000)
+        if last_modified <= time.time():
+            headers["Last-Modified"] = http_date(last_modified)
+
+        if_none_match = request.headers.get("If-None-Match")
+        if_modified_since = parse_http_date_safe(request.headers.get("If-Modified-Since") or "")
+        if _etag_matches(if_none_match, etag) or (
+            if_none_match is None and if_modified_since is not None and version < if_modified_since * 1_000_000_000
+        ):
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if not isinstance(request.accepted_renderer, JSONRenderer) or request.user.is_authenticated:
+            response = view(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                for name, value in headers.items():
+                    response[name] = value
+            return response
+
+        key = f"homebase:rendered:{version}:{request.accepted_media_type}:{request.get_full_path()}"
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type, headers=headers)
+
+        response = view(request, *args, **kwargs)
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        # Render here rather than after the view returns, so the body can be cached
+        response.accepted_renderer = request.accepted_renderer
+        response.accepted_media_type = request.accepted_media_type
+        response.renderer_context = self.get_renderer_context()
+        response.render()
+        cache.set(key, (response.content, response["Content-Type"]), settings.REGISTRY_RENDER_CACHE_TIMEOUT)
+        for name, value in headers.items():
+            response[name] = value
+        return response
@@ -0,0 +1,64 @@
+"""SQLite tuning for the embedded production mode, ``HOMEBASE_DB_MODE=embedded``.
+
+Every SQLite connection gets ``SQLITE_PRAGMAS`` when it is opened, putting the database in WAL
+mode so readers and the writer no longer block each other. ``ReadReplicaRouter`` sends reads to
+the ``replica`` alias, a second, read-only connection to the same file, so a slow dashboard query
+never holds the connection ingest writes on.
+"""
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+READ_ALIAS = "replica"
+
+
+def apply_pragmas(connection):
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            if name == "journal_mode" and connection.alias == READ_ALIAS:
+                # Stored in the database file, set by the writer
+                continue
+            cursor.execute(f"PRAGMA {name} = {value}")
+        if connection.alias == READ_ALIAS:
+            cursor.execute("PRAGMA query_only = ON")
+
+
+@receiver(connection_created)
+def _tune_sqlite(sender, connection, **kwargs):
+    if connection.vendor == "sqlite" and settings.DATABASE_MODE == "embedded":
+        apply_pragmas(connection)
+
+
+class ReadReplicaRouter:
+    """Reads from ``replica``, writes to ``default``.
+
+    Reads made while ``default`` is in a transaction stay on it, so they see its uncommitted writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        if connections["default"].in_atomic_block:
+            return "default"
+        return READ_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
+
+
+def maintain(using="default"):
+    """Checkpoint the WAL into the database file, truncating it, and refresh query planner statistics.
+
+    Returns ``(busy, wal_pages, checkpointed_pages)`` as reported by ``wal_checkpoint``.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        result = cursor.fetchone()
+        cursor.execute("PRAGMA optimize")
+    return tuple(result)
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from common.db import maintain
+
+
+class Command(BaseCommand):
+    help = "Checkpoint the SQLite write-ahead log and run PRAGMA optimize"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Keep running and repeat every --interval")
+        parser.add_argument("--interval", type=float, default=300, help="Seconds between runs with --loop")
+
+    def handle(self, *args, loop, interval, **options):
+        while True:
+            busy, wal_pages, checkpointed = maintain()
+            self.stdout.write(f"Checkpointed {checkpointed} of {wal_pages} WAL pages" + (" (busy)" if busy else ""))
+            if not loop:
+                break
+            time.sleep(interval)
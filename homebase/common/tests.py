@@ -1,4 +1,5 @@
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from rest_framework.test import APITestCase, APIClient
 
 
@@ -6,6 +7,8 @@ class BaseTest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username="test_user")
         self.client = APIClient()
+        # Rendered bodies outlive the rolled back test data
+        cache.clear()
 
     def tearDown(self) -> None:
         return super().tearDown()
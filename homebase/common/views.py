@@ -1,3 +1,8 @@
-from django.shortcuts import render
+from django.http import HttpResponse
 
-# Create your views here.
+from .metrics import registry
+
+
+def metrics(request):
+    """Every metric of this process in the Prometheus text format."""
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'homebase.settings')
 
 application = get_asgi_application()
+
+from sensors.write_queue import start_ingest_queue  # noqa: E402
+
+start_ingest_queue()
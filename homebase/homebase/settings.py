@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so request metrics include the time spent in every other middleware
+    'common.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,6 +86,69 @@ REST_FRAMEWORK = {
 WSGI_APPLICATION = 'homebase.wsgi.application'
 
 
+# Sensor ingest
+
+SENSOR_DATA_MAX_BATCH_SIZE = 1000
+SENSOR_IDENTIFY_MAX_BATCH_SIZE = 1000  # sensors per POST /sensors/batch/
+
+# Rows fetched from the database per round trip when streaming /sensordata/export/
+SENSOR_DATA_EXPORT_CHUNK_SIZE = 2000
+
+# Identifier -> (id, status, sensor_type, room) lookups on the ingest path
+SENSOR_CACHE_MAX_SIZE = 10000
+SENSOR_CACHE_TTL = 300  # seconds
+
+# Sensor.last_seen is written behind the ingest path in one batched UPDATE
+SENSOR_LAST_SEEN_FLUSH_INTERVAL = 5  # seconds after the first pending reading
+SENSOR_LAST_SEEN_MAX_STALENESS = 30  # seconds before ingest forces an inline flush
+# Flushes change the sensor list's ETag at most this often, so polls still get 304s while sensors report
+SENSOR_LAST_SEEN_VERSION_INTERVAL = 60  # seconds
+
+# Queue single readings posted to /sensordata/ and write them from a background thread in batches.
+# Readings that overflow the queue are appended to the journal and replayed on startup.
+SENSOR_INGEST_QUEUE_ENABLED = False
+SENSOR_INGEST_QUEUE_MAX_SIZE = 10000
+SENSOR_INGEST_QUEUE_BATCH_SIZE = 500
+SENSOR_INGEST_QUEUE_FLUSH_INTERVAL = 0.05  # seconds to wait for a batch to fill
+SENSOR_INGEST_QUEUE_JOURNAL = BASE_DIR / 'ingest-journal.ndjson'
+
+# Checked by the fast ingest path at /sensordata/fast/, per sensor type: data key -> "number",
+# "integer", "boolean" or "string", with a trailing "?" for optional keys. Other keys are allowed and
+# readings of types without a schema only need to be an object, e.g. {"temperature": {"temperature": "number"}}
+SENSOR_DATA_SCHEMAS = {}
+
+# `manage.py rollup_sensordata` only folds in reading ids that existed this many seconds ago, so
+# transactions still holding lower ids have finished. Ignored on SQLite, where ids commit in order.
+SENSOR_ROLLUP_COMMIT_LAG = 60
+
+# Also store numeric values of readings in the typed SensorReading table and aggregate from it.
+# Run `manage.py backfill_sensorreadings` after turning it on for existing readings.
+SENSOR_DATA_TYPED_STORAGE = False
+
+# `manage.py compact_sensordata` packs raw readings older than SENSOR_DATA_COMPACT_AFTER days into
+# compressed chunks of SENSOR_DATA_CHUNK_WINDOW seconds per sensor. None leaves readings uncompacted.
+SENSOR_DATA_COMPACT_AFTER = None
+SENSOR_DATA_CHUNK_WINDOW = 24 * 60 * 60
+
+# Server-Sent Events at /live/readings/ (ASGI only)
+SENSOR_LIVE_REPLAY_SIZE = 500  # recent readings sent to new subscribers
+SENSOR_LIVE_QUEUE_SIZE = 1000  # readings buffered per subscriber before the oldest are dropped
+SENSOR_LIVE_KEEPALIVE = 15  # seconds
+SENSOR_LIVE_MAX_DURATION = 300  # seconds before a stream is closed and the client reconnects
+
+# Days to keep raw readings and each rollup resolution, applied by `manage.py prune_sensordata`.
+# None keeps data forever. Keys are sensor types, "default" covers all other types, e.g.
+# {"default": {"raw": 7, "minute": 30}, "door": {"raw": 90}}
+SENSOR_DATA_RETENTION = {
+    "default": {"raw": None, "minute": None, "hour": None, "day": None},
+}
+
+
+# Sensor and room lists and details are rendered once per registry version and served from
+# Django's cache for this many seconds. Use a shared cache backend with several server processes.
+REGISTRY_RENDER_CACHE_TIMEOUT = 300
+
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
@@ -93,6 +159,24 @@ DATABASES = {
     }
 }
 
+# "embedded" is the single node production mode: SQLite in WAL mode with SQLITE_PRAGMAS applied to
+# every connection, and reads on a second, read-only connection so dashboard queries don't hold up
+# ingest. Run `manage.py sqlite_maintenance --loop` alongside it.
+DATABASE_MODE = os.environ.get('HOMEBASE_DB_MODE', 'default')
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # durable at checkpoints, never corrupt, in WAL mode
+    'busy_timeout': 5000,  # milliseconds to wait for a lock
+    'cache_size': -64000,  # KiB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+if DATABASE_MODE == 'embedded':
+    DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    DATABASE_ROUTERS = ['common.db.ReadReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
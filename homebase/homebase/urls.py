@@ -17,9 +17,15 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 
+from common.views import metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('rooms/', include('rooms.urls')),
     path('sensors/', include('sensors.urls.sensors')),
     path('sensordata/', include('sensors.urls.sensordata')),
+    path('ingest/', include('sensors.urls.ingest')),
+    path('live/', include('sensors.urls.live')),
+    path('dashboard/', include('sensors.urls.dashboard')),
+    path('metrics', metrics, name='metrics'),
 ]
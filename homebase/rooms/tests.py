@@ -1,3 +1,5 @@
+from django.contrib.auth.models import User
+
 from common.tests import BaseTest
 from rooms.models import Room
 
@@ -14,3 +16,19 @@ class RoomTestCase(BaseTest):
         self.assertEqual(response.status_code, 201)
         self.assertEqual(response.data["name"], "Test Room")
         self.assertEqual(response.data["id"], 1)
+
+    def test_rooms_rendered_body_cache(self):
+        Room.objects.create(name="Test Room")
+        # No browsable API page, which would carry the user's name and CSRF token
+        response = self.client.get("/rooms/", HTTP_ACCEPT="text/html")
+        self.assertEqual(response.status_code, 406)
+
+        self.client.get("/rooms/")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/rooms/").status_code, 200)
+
+        self.client.force_authenticate(User.objects.create_user("resident"))
+        with self.assertNumQueries(2):
+            response = self.client.get("/rooms/")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertIn("ETag", response)
@@ -1,10 +1,13 @@
 from rest_framework import viewsets
+from rest_framework.renderers import JSONRenderer
 
+from common.conditional import VersionedMixin
 from .models import Room
 from .serializers import RoomSerializer
 
 
-class RoomViewSet(viewsets.ModelViewSet):
+class RoomViewSet(VersionedMixin, viewsets.ModelViewSet):
+    renderer_classes = [JSONRenderer]
     serializer_class = RoomSerializer
     queryset = Room.objects.all()
     
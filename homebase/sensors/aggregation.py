@@ -0,0 +1,318 @@
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Func, IntegerField, Max, Min, Q, Sum, Window
+from django.db.models.fields.json import KeyTextTransform, compile_json_path
+from django.db.models.functions import Cast, RowNumber
+
+from .chunks import chunk_readings, decode_chunk
+from .models import DataKey, RollupWatermark, SensorChunk, SensorData, SensorReading, SensorRollup
+
+
+BUCKETS = {
+    "1m": 60,
+    "5m": 5 * 60,
+    "1h": 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+
+AGGREGATES = ["avg", "min", "max", "last", "count"]
+
+# Sensors per query in ``compare``, under SQLite's historical limit of 999 parameters
+COMPARE_CHUNK_SIZE = 500
+
+RESOLUTION_SECONDS = {
+    SensorRollup.Resolution.MINUTE: 60,
+    SensorRollup.Resolution.HOUR: 60 * 60,
+    SensorRollup.Resolution.DAY: 24 * 60 * 60,
+}
+
+
+class EpochBucket(Func):
+    """Start of the ``seconds`` wide bucket containing a datetime, as a unix timestamp."""
+    output_field = IntegerField()
+
+    def __init__(self, expression, seconds):
+        self.seconds = int(seconds)
+        super().__init__(expression)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return f"((CAST(strftime('%%s', {sql}) AS INTEGER) / {self.seconds}) * {self.seconds})", params
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return f"(FLOOR(EXTRACT(EPOCH FROM {sql}) / {self.seconds}) * {self.seconds})::bigint", params
+
+
+class NumericKey(Func):
+    """``data[key]`` as a float, or NULL when the key is missing or not a number."""
+    output_field = FloatField()
+
+    def __init__(self, key, field="data"):
+        self.key = key
+        super().__init__(F(field))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return compiler.compile(Cast(KeyTextTransform(self.key, self.source_expressions[0]), FloatField()))
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        path = compile_json_path([self.key])
+        return (
+            f"(CASE WHEN json_type({sql}, %s) IN ('integer', 'real') THEN json_extract({sql}, %s) END)",
+            (*params, path, *params, path),
+        )
+
+
+def bucket_start(epoch):
+    return datetime.datetime.fromtimestamp(epoch, tz=datetime.timezone.utc)
+
+
+def numeric_keys(data):
+    return [k for k, v in data.items() if isinstance(v, (int, float)) and not isinstance(v, bool)]
+
+
+def downsample(sensor, bucket, agg, keys=None, start=None, end=None):
+    """Aggregate the numeric keys of a sensor's readings into fixed time buckets.
+
+    Buckets are computed in the database. When the bucket and the ``start``/``end`` range
+    line up with a rollup resolution, rolled up buckets are read from ``SensorRollup`` and
+    only readings past the rollup watermark are aggregated from the raw table, or from
+    ``SensorReading`` with ``SENSOR_DATA_TYPED_STORAGE``. If ``keys``
+    is not given they are taken from the most recent reading, or from the rollups if no
+    readings are left in the range. Returns a list of ``{"timestamp", "data"}`` points.
+    """
+    seconds = BUCKETS[bucket]
+    raw = sensor.data.all()
+    if start is not None:
+        raw = raw.filter(timestamp__gte=start)
+    if end is not None:
+        raw = raw.filter(timestamp__lte=end)
+
+    if agg == "last":
+        return _last_per_bucket(raw, seconds, chunk_readings(sensor.chunks.all(), start=start, end=end))
+
+    resolution = rollup_resolution(seconds, start, end)
+    with transaction.atomic():
+        if keys is None:
+            latest = raw.order_by("-timestamp", "-id").values_list("data", flat=True).first()
+            if latest is None:
+                latest = _latest_compacted(sensor.chunks.all(), start, end)
+            if latest is not None:
+                keys = numeric_keys(latest) if isinstance(latest, dict) else []
+            elif resolution:
+                # The readings may have been pruned while their rollups are kept
+                keys = _rollup_keys(sensor.id, resolution, start, end)
+        if not keys:
+            return []
+
+        partials = {}
+        watermark = RollupWatermark.objects.values_list("last_id", flat=True).first() if resolution else None
+        _series_partials(partials, [sensor.id], keys, seconds, start, end, resolution, watermark, lambda sensor_id, key: key)
+
+    points = {}
+    for (epoch, key), (min_, max_, sum_, count) in sorted(partials.items()):
+        if not count:
+            continue
+        value = {"avg": sum_ / count, "min": min_, "max": max_, "count": count}[agg]
+        points.setdefault(epoch, {})[key] = value
+    return [{"timestamp": bucket_start(epoch), "data": data} for epoch, data in points.items()]
+
+
+def rollup_resolution(seconds, start=None, end=None):
+    """The coarsest rollup resolution that can serve ``seconds`` buckets over the range, if any."""
+    for resolution, res_seconds in sorted(RESOLUTION_SECONDS.items(), key=lambda item: -item[1]):
+        if seconds % res_seconds:
+            continue
+        if all(t is None or (t.microsecond == 0 and int(t.timestamp()) % res_seconds == 0) for t in (start, end)):
+            return resolution
+    return None
+
+
+def _past_watermark(watermark, end, id_field="id"):
+    """Readings not folded into the rollups yet.
+
+    A reading exactly at ``end`` is in the raw range but not in a rollup bucket before it.
+    """
+    tail = Q(**{f"{id_field}__gt": watermark})
+    if end is not None:
+        tail |= Q(timestamp=end)
+    return tail
+
+
+def _merge_partial(partials, group, min_, max_, sum_, count):
+    if not count:
+        return
+    current = partials.get(group)
+    if current is None:
+        partials[group] = [min_, max_, sum_, count]
+    else:
+        current[0] = min(current[0], min_)
+        current[1] = max(current[1], max_)
+        current[2] += sum_
+        current[3] += count
+
+
+def _series_partials(partials, sensor_ids, keys, seconds, start, end, resolution, watermark, label):
+    """Fold the ``keys`` of ``sensor_ids`` into ``partials``, grouped by bucket and ``label(sensor_id, key)``.
+
+    Rollups serve the readings up to the watermark, raw readings (or their typed values) and
+    compacted ones the rest.
+    """
+    if watermark:
+        _rollup_partials(partials, sensor_ids, resolution, seconds, keys, start, end, label)
+    if settings.SENSOR_DATA_TYPED_STORAGE:
+        _typed_partials(partials, sensor_ids, keys, seconds, start, end, watermark, label)
+    else:
+        raw = SensorData.objects.filter(sensor_id__in=sensor_ids)
+        if start is not None:
+            raw = raw.filter(timestamp__gte=start)
+        if end is not None:
+            raw = raw.filter(timestamp__lte=end)
+        if watermark:
+            raw = raw.filter(_past_watermark(watermark, end))
+        _raw_partials(partials, raw, seconds, keys, label)
+    chunks = SensorChunk.objects.filter(sensor_id__in=sensor_ids)
+    _chunk_partials(partials, chunks, keys, seconds, start, end, watermark, label)
+
+
+def _rollup_partials(partials, sensor_ids, resolution, seconds, keys, start, end, label):
+    rollups = SensorRollup.objects.filter(sensor_id__in=sensor_ids, resolution=resolution, key__in=keys)
+    if start is not None:
+        rollups = rollups.filter(bucket__gte=start)
+    if end is not None:
+        rollups = rollups.filter(bucket__lt=end)
+    rows = (
+        rollups.annotate(epoch=EpochBucket("bucket", seconds))
+        .values("epoch", "sensor_id", "key")
+        .annotate(min_=Min("min"), max_=Max("max"), sum_=Sum("sum"), count_=Sum("count"))
+        .order_by()
+    )
+    for row in rows:
+        group = (row["epoch"], label(row["sensor_id"], row["key"]))
+        _merge_partial(partials, group, row["min_"], row["max_"], row["sum_"], row["count_"])
+
+
+def _rollup_keys(sensor_id, resolution, start, end):
+    rollups = SensorRollup.objects.filter(sensor_id=sensor_id, resolution=resolution)
+    if start is not None:
+        rollups = rollups.filter(bucket__gte=start)
+    if end is not None:
+        rollups = rollups.filter(bucket__lt=end)
+    return sorted(rollups.values_list("key", flat=True).distinct().order_by())
+
+
+def _raw_partials(partials, queryset, seconds, keys, label):
+    aggregates = {}
+    # Keys are arbitrary strings, so alias them positionally
+    for i, key in enumerate(keys):
+        value = NumericKey(key)
+        aggregates.update({f"min{i}": Min(value), f"max{i}": Max(value), f"sum{i}": Sum(value), f"count{i}": Count(value)})
+    rows = (
+        queryset.order_by()
+        .annotate(epoch=EpochBucket("timestamp", seconds))
+        .values("epoch", "sensor_id")
+        .annotate(**aggregates)
+    )
+    for row in rows:
+        for i, key in enumerate(keys):
+            group = (row["epoch"], label(row["sensor_id"], key))
+            _merge_partial(partials, group, row[f"min{i}"], row[f"max{i}"], row[f"sum{i}"], row[f"count{i}"])
+
+
+def _typed_partials(partials, sensor_ids, keys, seconds, start, end, watermark, label):
+    """Like ``_raw_partials`` but over ``SensorReading``, grouping by ``label(sensor_id, key)``."""
+    key_names = dict(DataKey.objects.filter(name__in=keys).values_list("id", "name"))
+    values = SensorReading.objects.filter(sensor_id__in=sensor_ids, key_id__in=key_names)
+    if start is not None:
+        values = values.filter(timestamp__gte=start)
+    if end is not None:
+        values = values.filter(timestamp__lte=end)
+    if watermark:
+        values = values.filter(_past_watermark(watermark, end, id_field="reading_id"))
+    rows = (
+        values.order_by()
+        .annotate(epoch=EpochBucket("timestamp", seconds))
+        .values("epoch", "sensor_id", "key_id")
+        .annotate(min_=Min("value"), max_=Max("value"), sum_=Sum("value"), count_=Count("value"))
+    )
+    for row in rows:
+        group = (row["epoch"], label(row["sensor_id"], key_names[row["key_id"]]))
+        _merge_partial(partials, group, row["min_"], row["max_"], row["sum_"], row["count_"])
+
+
+def _latest_compacted(chunks, start, end):
+    if start is not None:
+        chunks = chunks.filter(end__gt=start)
+    if end is not None:
+        chunks = chunks.filter(start__lte=end)
+    for payload in chunks.order_by("-start").values_list("payload", flat=True):
+        for _, timestamp, data in reversed(decode_chunk(payload)):
+            if (start is None or timestamp >= start) and (end is None or timestamp <= end):
+                return data
+    return None
+
+
+def _chunk_partials(partials, chunks, keys, seconds, start, end, watermark, label):
+    """Like ``_raw_partials`` but over compacted readings, decoded and aggregated in Python."""
+    keys = set(keys)
+    for id_, sensor_id, timestamp, data in chunk_readings(chunks, start=start, end=end):
+        # Compacted readings are normally all rolled up already
+        if watermark and id_ <= watermark and timestamp != end:
+            continue
+        epoch = int(timestamp.timestamp()) // seconds * seconds
+        for key in keys.intersection(numeric_keys(data) if isinstance(data, dict) else ()):
+            value = float(data[key])
+            _merge_partial(partials, (epoch, label(sensor_id, key)), value, value, value, 1)
+
+
+def _last_per_bucket(queryset, seconds, compacted=()):
+    bucket = EpochBucket("timestamp", seconds)
+    rows = (
+        queryset.order_by()
+        .annotate(
+            bucket=bucket,
+            rank=Window(RowNumber(), partition_by=[bucket], order_by=[F("timestamp").desc(), F("id").desc()]),
+        )
+        .filter(rank=1)
+        .values_list("bucket", "timestamp", "id", "data")
+    )
+    last = {epoch: (timestamp, id_, data) for epoch, timestamp, id_, data in rows}
+    for id_, _, timestamp, data in compacted:
+        epoch = int(timestamp.timestamp()) // seconds * seconds
+        if epoch not in last or (timestamp, id_) > last[epoch][:2]:
+            last[epoch] = (timestamp, id_, data)
+    return [{"timestamp": bucket_start(epoch), "data": last[epoch][2]} for epoch in sorted(last)]
+
+
+def compare(groups, bucket, agg, key, start=None, end=None):
+    """Aggregate ``key`` over several sensors into series aligned on the same buckets.
+
+    ``groups`` maps sensor ids to the label of the series they count towards: their own id
+    for one series per sensor, or e.g. their room to aggregate a room's sensors together.
+    Readings of up to ``COMPARE_CHUNK_SIZE`` sensors are aggregated by one GROUP BY query (plus
+    one over the rollups when they can serve the range), the same way as in ``downsample``.
+    Returns a list of ``{"timestamp", "data": {label: value}}`` points.
+    """
+    seconds = BUCKETS[bucket]
+    if not groups:
+        return []
+    sensor_ids = list(groups)
+
+    partials = {}
+    with transaction.atomic():
+        resolution = rollup_resolution(seconds, start, end)
+        watermark = RollupWatermark.objects.values_list("last_id", flat=True).first() if resolution else None
+        # Partials merge across queries, so large fleets are split to stay under parameter limits
+        for i in range(0, len(sensor_ids), COMPARE_CHUNK_SIZE):
+            _series_partials(
+                partials, sensor_ids[i:i + COMPARE_CHUNK_SIZE], [key], seconds, start, end, resolution, watermark,
+                lambda sensor_id, _: groups[sensor_id],
+            )
+
+    points = {}
+    for (epoch, label), (min_, max_, sum_, count) in sorted(partials.items(), key=lambda item: item[0][0]):
+        points.setdefault(epoch, {})[label] = {"avg": sum_ / count, "min": min_, "max": max_, "count": count}[agg]
+    return [{"timestamp": bucket_start(epoch), "data": data} for epoch, data in points.items()]
@@ -1,6 +1,14 @@
+import atexit
+
 from django.apps import AppConfig
 
 
 class SensorsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sensors'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .last_seen import last_seen_tracker
+
+        atexit.register(last_seen_tracker.flush)
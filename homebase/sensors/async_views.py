@@ -0,0 +1,239 @@
+"""Async endpoints for running under ASGI (``homebase.asgi``).
+
+The ingest views mirror ``POST /sensors/``, ``POST /sensors/batch/``, ``POST /sensordata/`` and
+``POST /sensordata/batch/`` but never hold a worker thread while a request waits on the database:
+lookups use the async ORM and readings are handed to ``reading_writer``, which folds everything
+posted concurrently into a single INSERT. ``stream_readings`` pushes new readings to dashboards as Server-Sent Events.
+"""
+import asyncio, json, logging, time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+
+from .cache import sensor_cache
+from .identify import identify_batch, identify_sensors, parse_device
+from .ingest import BatchError, IngestStatus, ingest_batch
+from .last_seen import last_seen_tracker
+from .live import live_broker
+from .metrics import record_ingested, record_rejected
+from .models import Sensor, SensorData
+from .serializers import SensorDataSerializer, SensorSerializer
+from .typed import save_readings
+
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingWriter:
+    """Writes readings posted concurrently on the event loop with one ``bulk_create``.
+
+    Readings queue up while the previous INSERT is in flight and are written together
+    by the next one, so under a burst the number of INSERTs tracks database latency,
+    not request rate.
+    """
+
+    def __init__(self, max_batch=None):
+        self._max_batch = max_batch
+        self._loop = None
+        self._pending = []
+        self._task = None
+
+    @property
+    def max_batch(self):
+        return self._max_batch if self._max_batch is not None else settings.SENSOR_DATA_MAX_BATCH_SIZE
+
+    async def write(self, reading):
+        """Save ``reading`` and return it once it is committed."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._pending, self._task = loop, [], None
+        future = loop.create_future()
+        self._pending.append((reading, future))
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._drain())
+        return await future
+
+    async def _drain(self):
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            readings = [reading for reading, _ in batch]
+            try:
+                await sync_to_async(save_readings)(readings)
+            except Exception as e:
+                if len(batch) == 1:
+                    self._resolve(batch[0], error=e)
+                    continue
+                # One bad reading must not fail the others posted with it, write them one by one
+                logger.warning("Coalesced insert of %d readings failed, writing them one by one", len(batch))
+                errors = await sync_to_async(self._write_each)(readings)
+                for item, error in zip(batch, errors):
+                    self._resolve(item, error)
+                readings = [reading for reading, error in zip(readings, errors) if error is None]
+            else:
+                for item in batch:
+                    self._resolve(item)
+            if not readings:
+                continue
+            try:
+                # A stale tracker flushes inline with the sync ORM, which must not run on the loop
+                await sync_to_async(last_seen_tracker.touch_many)([(r.sensor_id, r.timestamp) for r in readings])
+            except Exception:
+                logger.exception("Failed to record last_seen of %d written readings", len(readings))
+
+
+    @staticmethod
+    def _write_each(readings):
+        """Save each of ``readings`` on its own. Returns the error of each, None if it was written."""
+        errors = []
+        for reading in readings:
+            # Ids set by the failed bulk INSERT were rolled back with it
+            reading.id = None
+            try:
+                save_readings([reading])
+            except Exception as e:
+                errors.append(e)
+            else:
+                errors.append(None)
+        return errors
+
+    @staticmethod
+    def _resolve(item, error=None):
+        reading, future = item
+        if future.done():
+            return
+        if error is None:
+            future.set_result(reading)
+        else:
+            future.set_exception(error)
+
+
+reading_writer = CoalescingWriter()
+
+
+def post_endpoint(view):
+    """``csrf_exempt`` plus ``require_POST`` for async views.
+
+    Django 4.2's own decorators wrap views in sync functions, which would make Django
+    run these views in a thread.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != "POST":
+            return HttpResponseNotAllowed(["POST"])
+        return await view(request, *args, **kwargs)
+
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+def _json_response(data, status):
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+def _parse_body(request):
+    try:
+        return json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+@post_endpoint
+async def identify(request):
+    device = parse_device(_parse_body(request))
+    if device is None:
+        return _json_response({"error": "identifier and sensor_type are required"}, status.HTTP_400_BAD_REQUEST)
+    results = await sync_to_async(identify_sensors)([device])
+    sensor, created = results[device[0]]
+    return _json_response(
+        SensorSerializer(sensor).data,
+        status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+    )
+
+
+@post_endpoint
+async def identify_sensor_batch(request):
+    try:
+        body = await sync_to_async(identify_batch)(_parse_body(request))
+    except BatchError as e:
+        return _json_response({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
+    return _json_response(body, status.HTTP_200_OK)
+
+
+@post_endpoint
+async def create_sensor_data(request):
+    payload = _parse_body(request)
+    if not isinstance(payload, dict) or "data" not in payload:
+        return _json_response({"error": "identifier and data are required"}, status.HTTP_400_BAD_REQUEST)
+    if not isinstance(payload["data"], dict):
+        return _json_response({"error": "data must be an object"}, status.HTTP_400_BAD_REQUEST)
+    sensor = await sensor_cache.aget(payload.get("identifier"))
+    if sensor is None:
+        record_rejected(IngestStatus.UNKNOWN)
+        return _json_response({"error": "Sensor does not exist"}, status.HTTP_404_NOT_FOUND)
+    if sensor.status != Sensor.SensorStatus.ACTIVE:
+        record_rejected(IngestStatus.INACTIVE, sensor.id)
+        return _json_response({"error": "Sensor is not active"}, status.HTTP_403_FORBIDDEN)
+    reading = await reading_writer.write(SensorData(sensor_id=sensor.id, data=payload["data"]))
+    record_ingested([sensor.id])
+    live_broker.publish(sensor, [reading])
+    return _json_response(SensorDataSerializer(reading).data, status.HTTP_201_CREATED)
+
+
+@post_endpoint
+async def create_sensor_data_batch(request):
+    try:
+        body = await sync_to_async(ingest_batch)(_parse_body(request))
+    except BatchError as e:
+        return _json_response({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
+    return _json_response(body, status.HTTP_200_OK)
+
+
+def _int_list(values):
+    return [int(value) for value in values]
+
+
+async def stream_readings(request):
+    """Server-Sent Events of new readings, filtered by ``sensor``, ``room`` and ``sensor_type``.
+
+    Each filter can be repeated. Recent readings are replayed first unless ``replay=0``.
+    The stream ends after ``SENSOR_LIVE_MAX_DURATION`` seconds and browsers' EventSource
+    reconnects on its own.
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    try:
+        filters = {
+            "sensors": _int_list(request.GET.getlist("sensor")),
+            "rooms": _int_list(request.GET.getlist("room")),
+            "sensor_types": request.GET.getlist("sensor_type"),
+        }
+    except ValueError as e:
+        return _json_response({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
+    subscription = live_broker.subscribe(replay=request.GET.get("replay") != "0", **filters)
+
+    async def events():
+        deadline = time.monotonic() + settings.SENSOR_LIVE_MAX_DURATION
+        try:
+            yield "retry: 1000\n\n"
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    event = await subscription.get(timeout=min(settings.SENSOR_LIVE_KEEPALIVE, remaining))
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                lines = f"event: reading\ndata: {json.dumps(event, cls=JSONEncoder)}\n\n"
+                if event["id"] is not None:
+                    lines = f"id: {event['id']}\n" + lines
+                yield lines
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,124 @@
+import threading, time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Sensor
+
+
+CachedSensor = namedtuple("CachedSensor", ["id", "status", "sensor_type", "room_id"])
+
+
+class SensorCache:
+    """In-process LRU cache mapping sensor identifiers to their id, status, type and room.
+
+    Entries expire after ``ttl`` seconds and are invalidated whenever a sensor is saved
+    or deleted, and again once the change commits (see ``sensors.signals``), so a status
+    change is visible immediately in this process and within ``ttl`` everywhere else.
+    """
+    FIELDS = ("identifier", "id", "status", "sensor_type", "room_id")
+
+    def __init__(self, max_size=None, ttl=None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_size(self):
+        return self._max_size if self._max_size is not None else settings.SENSOR_CACHE_MAX_SIZE
+
+    @property
+    def ttl(self):
+        return self._ttl if self._ttl is not None else settings.SENSOR_CACHE_TTL
+
+    def get(self, identifier):
+        """Return the ``CachedSensor`` for ``identifier`` or None if no such sensor exists."""
+        return self.get_many([identifier]).get(identifier)
+
+    def get_many(self, identifiers):
+        """Resolve several identifiers, querying the database once for all misses."""
+        found, missing, generation = self._lookup(identifiers)
+        if missing:
+            rows = Sensor.objects.filter(identifier__in=missing).values_list(*self.FIELDS)
+            for ident, *fields in rows:
+                found[ident] = CachedSensor(*fields)
+                self._store(ident, found[ident], generation)
+        return found
+
+    async def aget(self, identifier):
+        """``get`` for async views, a miss is loaded with the async ORM."""
+        found, missing, generation = self._lookup([identifier])
+        if missing:
+            row = await Sensor.objects.filter(identifier=identifier).values_list(*self.FIELDS).afirst()
+            if row is not None:
+                found[identifier] = CachedSensor(*row[1:])
+                self._store(identifier, found[identifier], generation)
+        return found.get(identifier)
+
+    def put(self, sensor):
+        with self._lock:
+            generation = self._generation
+        self._store(sensor.identifier, CachedSensor(sensor.id, sensor.status, sensor.sensor_type, sensor.room_id), generation)
+
+    def invalidate(self, identifier):
+        with self._lock:
+            self._entries.pop(identifier, None)
+            self._generation += 1
+
+    def invalidate_on_commit(self, identifier):
+        """Invalidate now and when the current transaction commits.
+
+        A lookup from another thread before the commit reads the old row and caches it again.
+        """
+        self.invalidate(identifier)
+        transaction.on_commit(lambda: self.invalidate(identifier))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _lookup(self, identifiers):
+        found, missing = {}, set()
+        now = time.monotonic()
+        with self._lock:
+            for ident in identifiers:
+                entry = self._entries.get(ident)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(ident)
+                    found[ident] = entry[0]
+                    self.hits += 1
+                else:
+                    missing.add(ident)
+                    self.misses += 1
+            return found, missing, self._generation
+
+    def _store(self, identifier, entry, generation):
+        with self._lock:
+            # Drop results that were read before an invalidation landed
+            if generation != self._generation:
+                return
+            self._entries[identifier] = (entry, time.monotonic() + self.ttl)
+            self._entries.move_to_end(identifier)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+sensor_cache = SensorCache()
@@ -0,0 +1,322 @@
+"""Compressed storage of old readings.
+
+``compaction.compact_readings`` packs the readings of a sensor that fall in one
+``SENSOR_DATA_CHUNK_WINDOW`` into a single ``SensorChunk`` and deletes the raw rows.
+A chunk holds, for n readings in ``(timestamp, id)`` order::
+
+    b"HBCK1\\0"                magic
+    varint                    length of the JSON header
+    header                    {"n", "ids", "timestamps", "columns": [{"key", "kind", "mask", "length"}], "extra"}
+    ids                       first id, then zigzag varint deltas
+    timestamps                microseconds: first value, first delta, then zigzag varint delta-of-deltas
+    columns                   one per numeric key: an n bit presence mask if not every reading has
+                              the key, then the values. Integer keys ("i") are zigzag varint deltas,
+                              float keys ("f") are XOR compressed as in Facebook's Gorilla.
+    extra                     zlib compressed JSON list of whatever else was in each reading's data
+
+so a reading decodes to exactly the ``data`` it was posted with.
+"""
+import datetime, json, math, struct, zlib
+from heapq import merge
+
+
+MAGIC = b"HBCK1\0"
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+INT_LIMIT = 2 ** 63
+
+
+def _zigzag(n):
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+
+def _unzigzag(n):
+    return n // 2 if not n & 1 else -(n + 1) // 2
+
+
+def _write_varint(out, n):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(payload, pos):
+    n = shift = 0
+    while True:
+        byte = payload[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+class _BitWriter:
+    def __init__(self):
+        self.out = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value, bits):
+        self._acc = (self._acc << bits) | value
+        self._bits += bits
+        while self._bits >= 8:
+            self._bits -= 8
+            self.out.append((self._acc >> self._bits) & 0xFF)
+        self._acc &= (1 << self._bits) - 1
+
+    def getvalue(self):
+        if self._bits:
+            return bytes(self.out) + bytes([(self._acc << (8 - self._bits)) & 0xFF])
+        return bytes(self.out)
+
+
+class _BitReader:
+    def __init__(self, payload):
+        self._payload = payload
+        self._pos = 0
+        self._acc = 0
+        self._bits = 0
+
+    def read(self, bits):
+        while self._bits < bits:
+            self._acc = (self._acc << 8) | self._payload[self._pos]
+            self._pos += 1
+            self._bits += 8
+        self._bits -= bits
+        value = self._acc >> self._bits
+        self._acc &= (1 << self._bits) - 1
+        return value
+
+
+def _float_bits(value):
+    return struct.unpack("<Q", struct.pack("<d", value))[0]
+
+
+def _bits_float(bits):
+    return struct.unpack("<d", struct.pack("<Q", bits))[0]
+
+
+def _encode_deltas(values):
+    out, previous = bytearray(), 0
+    for value in values:
+        _write_varint(out, _zigzag(value - previous))
+        previous = value
+    return out
+
+
+def _decode_deltas(payload, n):
+    values, previous, pos = [], 0, 0
+    for _ in range(n):
+        delta, pos = _read_varint(payload, pos)
+        previous += _unzigzag(delta)
+        values.append(previous)
+    return values
+
+
+def _encode_timestamps(micros):
+    out = bytearray()
+    previous = delta = 0
+    for i, value in enumerate(micros):
+        if i < 2:
+            _write_varint(out, _zigzag(value - previous))
+            delta = value - previous
+        else:
+            _write_varint(out, _zigzag(value - previous - delta))
+            delta = value - previous
+        previous = value
+    return out
+
+
+def _decode_timestamps(payload, n):
+    values, previous, delta, pos = [], 0, 0, 0
+    for i in range(n):
+        encoded, pos = _read_varint(payload, pos)
+        delta = _unzigzag(encoded) if i < 2 else delta + _unzigzag(encoded)
+        previous += delta
+        values.append(previous)
+    return values
+
+
+def _encode_floats(values):
+    writer = _BitWriter()
+    previous = lead = trail = None
+    for value in values:
+        bits = _float_bits(value)
+        if previous is None:
+            writer.write(bits, 64)
+        elif bits == previous:
+            writer.write(0, 1)
+        else:
+            xor = bits ^ previous
+            new_lead = min(64 - xor.bit_length(), 31)
+            new_trail = (xor & -xor).bit_length() - 1
+            if lead is not None and new_lead >= lead and new_trail >= trail:
+                # Fits in the previous window of meaningful bits
+                writer.write(0b10, 2)
+                writer.write(xor >> trail, 64 - lead - trail)
+            else:
+                lead, trail = new_lead, new_trail
+                length = 64 - lead - trail
+                writer.write(0b11, 2)
+                writer.write(lead, 5)
+                writer.write(length - 1, 6)
+                writer.write(xor >> trail, length)
+        previous = bits
+    return writer.getvalue()
+
+
+def _decode_floats(payload, n):
+    reader = _BitReader(payload)
+    values = []
+    previous = lead = trail = None
+    for _ in range(n):
+        if previous is None:
+            bits = reader.read(64)
+        elif not reader.read(1):
+            bits = previous
+        else:
+            if reader.read(1):
+                lead = reader.read(5)
+                trail = 64 - lead - (reader.read(6) + 1)
+            bits = previous ^ (reader.read(64 - lead - trail) << trail)
+        values.append(_bits_float(bits))
+        previous = bits
+    return values
+
+
+def _kind(values):
+    if all(isinstance(v, int) and not isinstance(v, bool) and -INT_LIMIT < v < INT_LIMIT for v in values):
+        return "i"
+    if all(isinstance(v, float) and math.isfinite(v) for v in values):
+        return "f"
+    return None
+
+
+def _to_micros(timestamp):
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def encode_chunk(rows):
+    """Compress ``(id, timestamp, data)`` rows, which must be in ``(timestamp, id)`` order."""
+    n = len(rows)
+    columns = {}
+    for i, (_, _, data) in enumerate(rows):
+        for key, value in (data.items() if isinstance(data, dict) else ()):
+            columns.setdefault(key, {})[i] = value
+
+    header_columns, sections = [], []
+    packed = set()
+    for key, values in columns.items():
+        kind = _kind(values.values())
+        if kind is None:
+            continue
+        packed.add(key)
+        section = bytearray()
+        mask = len(values) < n
+        if mask:
+            bitmap = bytearray((n + 7) // 8)
+            for i in values:
+                bitmap[i // 8] |= 0x80 >> (i % 8)
+            section += bitmap
+        ordered = [values[i] for i in sorted(values)]
+        section += _encode_deltas(ordered) if kind == "i" else _encode_floats(ordered)
+        header_columns.append({"key": key, "kind": kind, "mask": mask, "length": len(section)})
+        sections.append(section)
+
+    extra = [
+        {k: v for k, v in data.items() if k not in packed} if isinstance(data, dict) else data
+        for _, _, data in rows
+    ]
+    extra = zlib.compress(json.dumps(extra).encode()) if any(e != {} for e in extra) else b""
+    ids = _encode_deltas([row[0] for row in rows])
+    timestamps = _encode_timestamps([_to_micros(row[1]) for row in rows])
+
+    header = json.dumps({
+        "n": n,
+        "ids": len(ids),
+        "timestamps": len(timestamps),
+        "columns": header_columns,
+        "extra": len(extra),
+    }).encode()
+    out = bytearray(MAGIC)
+    _write_varint(out, len(header))
+    return bytes(out + header + ids + timestamps + b"".join(sections) + extra)
+
+
+def decode_chunk(payload):
+    """Decompress a chunk into ``(id, timestamp, data)`` rows in ``(timestamp, id)`` order."""
+    payload = bytes(payload)
+    if payload[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a sensor chunk")
+    header_size, pos = _read_varint(payload, len(MAGIC))
+    header = json.loads(payload[pos:pos + header_size])
+    pos += header_size
+    n = header["n"]
+
+    ids = _decode_deltas(payload[pos:pos + header["ids"]], n)
+    pos += header["ids"]
+    micros = _decode_timestamps(payload[pos:pos + header["timestamps"]], n)
+    pos += header["timestamps"]
+
+    data = [{} for _ in range(n)]
+    for column in header["columns"]:
+        section = payload[pos:pos + column["length"]]
+        pos += column["length"]
+        if column["mask"]:
+            bitmap, section = section[:(n + 7) // 8], section[(n + 7) // 8:]
+            rows = [i for i in range(n) if bitmap[i // 8] & (0x80 >> (i % 8))]
+        else:
+            rows = range(n)
+        values = (_decode_deltas if column["kind"] == "i" else _decode_floats)(section, len(rows))
+        for i, value in zip(rows, values):
+            data[i][column["key"]] = value
+
+    if header["extra"]:
+        for i, extra in enumerate(json.loads(zlib.decompress(payload[pos:pos + header["extra"]]))):
+            if isinstance(extra, dict):
+                data[i].update(extra)
+            else:
+                data[i] = extra
+
+    return [
+        (id_, EPOCH + datetime.timedelta(microseconds=us), values)
+        for id_, us, values in zip(ids, micros, data)
+    ]
+
+
+def chunk_readings(chunks, start=None, end=None, since=None, after_id=None, after=None):
+    """Yield the compressed readings in ``chunks`` as ``(id, sensor_id, timestamp, data)``.
+
+    Readings come in ``(sensor, timestamp, id)`` order and are filtered like raw readings:
+    ``start``/``end`` inclusive, ``since`` and ``after_id`` exclusive, and ``after`` a
+    ``(timestamp, id)`` keyset position. Chunks are only decoded as they are consumed.
+    """
+    if start is not None:
+        chunks = chunks.filter(end__gt=start)
+    if end is not None:
+        chunks = chunks.filter(start__lte=end)
+    if since is not None:
+        chunks = chunks.filter(end__gt=since)
+    if after_id is not None:
+        chunks = chunks.filter(max_id__gt=after_id)
+    if after is not None:
+        chunks = chunks.filter(end__gt=after[0])
+
+    for sensor_id, payload in chunks.order_by("sensor_id", "start").values_list("sensor_id", "payload").iterator():
+        for id_, timestamp, data in decode_chunk(payload):
+            if (
+                (start is not None and timestamp < start)
+                or (end is not None and timestamp > end)
+                or (since is not None and timestamp <= since)
+                or (after_id is not None and id_ <= after_id)
+                or (after is not None and (timestamp, id_) <= after)
+            ):
+                continue
+            yield id_, sensor_id, timestamp, data
+
+
+def merge_readings(rows, chunks, **filters):
+    """Merge ``(id, sensor_id, timestamp, data)`` rows in (sensor, timestamp, id) order with chunked ones."""
+    return merge(rows, chunk_readings(chunks, **filters), key=lambda row: (row[1], row[2], row[0]))
@@ -0,0 +1,108 @@
+"""A small columnar binary format for reading series.
+
+Layout (little endian)::
+
+    b"HBCOL1\\0\\0"           8 byte magic
+    uint64                    length of the JSON header, a multiple of 8
+    header                    JSON, space padded
+    buffers                   one per column, each starting on an 8 byte boundary
+
+The header is ``{"rows": n, "columns": [{"name", "dtype", "offset", "length"}], "meta": {...}}``
+where ``dtype`` is a NumPy dtype string and ``offset`` is relative to the start of the payload,
+so a column loads without copying with ``np.frombuffer(payload, dtype, count=rows, offset=offset)``.
+The ``timestamp`` column is ``<M8[ns]`` (nanoseconds since the epoch, UTC), points that carry
+their reading ``id`` get an ``<i8`` ``id`` column, and every numeric data key is a ``<f8``
+column with NaN where a reading does not have the key.
+"""
+import json, math, struct, sys
+from array import array
+from datetime import datetime, timezone
+
+from django.utils.dateparse import parse_datetime
+
+
+MAGIC = b"HBCOL1\0\0"
+TIMESTAMP_DTYPE = "<M8[ns]"
+ID_DTYPE = "<i8"
+VALUE_DTYPE = "<f8"
+
+
+def _to_nanoseconds(timestamp):
+    if isinstance(timestamp, str):
+        timestamp = parse_datetime(timestamp)
+    delta = timestamp - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+
+def _little_endian(values):
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _pad(payload):
+    return payload + b"\0" * (-len(payload) % 8)
+
+
+def encode(points, meta=None):
+    """Encode ``{"timestamp", "data"}`` points. Non-numeric values are left out."""
+    timestamps = array("q")
+    ids = array("q")
+    columns = {}
+    for i, point in enumerate(points):
+        timestamps.append(_to_nanoseconds(point["timestamp"]))
+        if point.get("id") is not None:
+            ids.append(point["id"])
+        for key, value in (point.get("data") or {}).items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = array("d", [math.nan] * i)
+            column.append(value)
+        for column in columns.values():
+            if len(column) <= i:
+                column.append(math.nan)
+
+    buffers = [("timestamp", TIMESTAMP_DTYPE, _little_endian(timestamps))]
+    if ids and len(ids) == len(timestamps):
+        buffers.append(("id", ID_DTYPE, _little_endian(ids)))
+    buffers += [(key, VALUE_DTYPE, _little_endian(column)) for key, column in columns.items()]
+
+    # The header's size depends on the offsets, which depend on the header's size
+    header_size = 0
+    while True:
+        offset = len(MAGIC) + 8 + header_size
+        descriptions = []
+        for name, dtype, buffer in buffers:
+            descriptions.append({"name": name, "dtype": dtype, "offset": offset, "length": len(buffer)})
+            offset += len(buffer) + (-len(buffer) % 8)
+        header = json.dumps({"rows": len(timestamps), "columns": descriptions, "meta": meta or {}}).encode()
+        header += b" " * (-len(header) % 8)
+        if len(header) == header_size:
+            break
+        header_size = len(header)
+
+    return b"".join([MAGIC, struct.pack("<Q", len(header)), header] + [_pad(buffer) for _, _, buffer in buffers])
+
+
+def decode(payload):
+    """Decode a payload into ``(meta, {column: list})`` without NumPy. Timestamps are datetimes."""
+    if payload[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a columnar payload")
+    (header_size,) = struct.unpack_from("<Q", payload, len(MAGIC))
+    header = json.loads(payload[len(MAGIC) + 8:len(MAGIC) + 8 + header_size])
+    columns = {}
+    for column in header["columns"]:
+        values = array("q" if column["dtype"] in (TIMESTAMP_DTYPE, ID_DTYPE) else "d")
+        values.frombytes(payload[column["offset"]:column["offset"] + column["length"]])
+        if sys.byteorder != "little":
+            values.byteswap()
+        if column["dtype"] == TIMESTAMP_DTYPE:
+            columns[column["name"]] = [
+                datetime.fromtimestamp(ns // 1_000_000_000, tz=timezone.utc).replace(microsecond=ns % 1_000_000_000 // 1000)
+                for ns in values
+            ]
+        else:
+            columns[column["name"]] = list(values)
+    return header["meta"], columns
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.db import transaction
+
+from .aggregation import EpochBucket, bucket_start
+from .chunks import decode_chunk, encode_chunk
+from .models import RollupWatermark, SensorChunk, SensorData
+
+
+def compact_readings(before, window=None, require_rollups=True):
+    """Pack raw readings older than ``before`` into one ``SensorChunk`` per sensor and window.
+
+    Only whole windows are compacted. Readings that arrive late for a window that is already
+    compacted are merged into its chunk by the next run. With ``require_rollups`` only
+    readings folded into the rollups are compacted. Each chunk is written, and its raw
+    readings deleted, in its own transaction. Returns ``(readings, chunks)`` written.
+    """
+    window = int(window or settings.SENSOR_DATA_CHUNK_WINDOW)
+    cutoff = int(before.timestamp()) // window * window
+    raw = SensorData.objects.filter(timestamp__lt=bucket_start(cutoff))
+    if require_rollups:
+        watermark = RollupWatermark.objects.values_list("last_id", flat=True).first() or 0
+        raw = raw.filter(id__lte=watermark)
+
+    windows = (
+        raw.order_by()
+        .annotate(epoch=EpochBucket("timestamp", window))
+        .values_list("sensor_id", "epoch")
+        .distinct()
+    )
+    readings = chunks = 0
+    for sensor_id, epoch in list(windows):
+        start, end = bucket_start(epoch), bucket_start(epoch + window)
+        with transaction.atomic():
+            rows = list(
+                raw.filter(sensor_id=sensor_id, timestamp__gte=start, timestamp__lt=end)
+                .order_by("timestamp", "id")
+                .values_list("id", "timestamp", "data")
+            )
+            if not rows:
+                continue
+            ids = [row[0] for row in rows]
+            chunk = SensorChunk.objects.select_for_update().filter(sensor_id=sensor_id, start=start).first()
+            if chunk is None:
+                chunk = SensorChunk(sensor_id=sensor_id, start=start, end=end)
+            else:
+                rows = sorted(decode_chunk(chunk.payload) + rows, key=lambda row: (row[1], row[0]))
+            chunk.payload = encode_chunk(rows)
+            chunk.count = len(rows)
+            chunk.max_id = max(row[0] for row in rows)
+            chunk.save()
+
+            for i in range(0, len(ids), 500):
+                SensorData.objects.filter(id__in=ids[i:i + 500]).delete()
+        readings += len(ids)
+        chunks += 1
+    return readings, chunks
@@ -0,0 +1,153 @@
+"""Minimal ingest of single readings at ``POST /sensordata/fast/``.
+
+Takes the same body as ``POST /sensordata/`` but skips DRF: the body is parsed with orjson
+when it is installed, ``data`` is checked against the compiled ``SENSOR_DATA_SCHEMAS`` entry
+for the sensor's type, the row is written with one plain INSERT (and the upsert of its latest
+values) and the response is an empty 204.
+"""
+import json
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+
+from .cache import sensor_cache
+from .ingest import IngestStatus
+from .last_seen import last_seen_tracker
+from .latest import update_latest
+from .live import live_broker
+from .metrics import record_ingested, record_rejected
+from .models import Sensor, SensorData
+from .typed import save_readings
+from .write_queue import get_ingest_queue
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(body):
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+TYPE_CHECKS = {
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "string": lambda v: isinstance(v, str),
+}
+
+
+def compile_schema(schema):
+    """Build a validator for ``{key: type}``, returning an error message or None.
+
+    Types are the keys of ``TYPE_CHECKS``, with a trailing ``?`` for optional keys.
+    Keys not in the schema are allowed.
+    """
+    fields = []
+    for key, type_name in schema.items():
+        optional = type_name.endswith("?")
+        type_name = type_name.rstrip("?")
+        if type_name not in TYPE_CHECKS:
+            raise ValueError(f"Unknown type {type_name!r} for {key!r}")
+        fields.append((key, TYPE_CHECKS[type_name], optional, f"{key} must be a {type_name}"))
+
+    def validate(data):
+        if not isinstance(data, dict):
+            return "data must be an object"
+        for key, check, optional, error in fields:
+            if key in data:
+                if not check(data[key]):
+                    return error
+            elif not optional:
+                return f"{key} is required"
+        return None
+
+    return validate
+
+
+_validators = {}
+
+
+def get_validator(sensor_type):
+    validator = _validators.get(sensor_type)
+    if validator is None:
+        validator = _validators[sensor_type] = compile_schema(settings.SENSOR_DATA_SCHEMAS.get(sensor_type, {}))
+    return validator
+
+
+@receiver(setting_changed)
+def _schemas_changed(setting, **kwargs):
+    if setting == "SENSOR_DATA_SCHEMAS":
+        _validators.clear()
+
+
+_insert = None
+
+
+def _insert_reading(reading):
+    """INSERT ``reading`` without building a query through the ORM. Its id is not fetched."""
+    global _insert
+    if _insert is None:
+        fields = [SensorData._meta.get_field(name) for name in ("sensor", "data", "timestamp")]
+        qn = connection.ops.quote_name
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            qn(SensorData._meta.db_table),
+            ", ".join(qn(field.column) for field in fields),
+            ", ".join(["%s"] * len(fields)),
+        )
+        _insert = (sql, fields)
+    sql, fields = _insert
+    params = [field.get_db_prep_save(getattr(reading, field.attname), connection) for field in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _error(message, status):
+    return JsonResponse({"error": message}, status=status)
+
+
+@csrf_exempt
+def create(request):
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    try:
+        payload = loads(request.body)
+    except ValueError:
+        return _error("Invalid JSON", status.HTTP_400_BAD_REQUEST)
+    if not isinstance(payload, dict) or "data" not in payload:
+        return _error("identifier and data are required", status.HTTP_400_BAD_REQUEST)
+
+    sensor = sensor_cache.get(payload.get("identifier"))
+    if sensor is None:
+        record_rejected(IngestStatus.UNKNOWN)
+        return _error("Sensor does not exist", status.HTTP_404_NOT_FOUND)
+    if sensor.status != Sensor.SensorStatus.ACTIVE:
+        record_rejected(IngestStatus.INACTIVE, sensor.id)
+        return _error("Sensor is not active", status.HTTP_403_FORBIDDEN)
+    error = get_validator(sensor.sensor_type)(payload["data"])
+    if error is not None:
+        record_rejected(IngestStatus.INVALID)
+        return _error(error, status.HTTP_400_BAD_REQUEST)
+
+    reading = SensorData(sensor_id=sensor.id, data=payload["data"], timestamp=timezone.now())
+    if settings.SENSOR_INGEST_QUEUE_ENABLED:
+        get_ingest_queue().put(reading)
+    elif settings.SENSOR_DATA_TYPED_STORAGE:
+        # Typed values reference the reading's id
+        save_readings([reading])
+    else:
+        with transaction.atomic():
+            _insert_reading(reading)
+            update_latest([reading])
+    record_ingested([sensor.id])
+    if not settings.SENSOR_INGEST_QUEUE_ENABLED:
+        last_seen_tracker.touch(sensor.id, reading.timestamp)
+    live_broker.publish(sensor, [reading])
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
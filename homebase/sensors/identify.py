@@ -0,0 +1,124 @@
+"""Sensor identify, ``POST /sensors/`` and ``POST /sensors/batch/``, keyed on ``identifier`` alone.
+
+New sensors are written with ``INSERT ... ON CONFLICT (identifier) DO NOTHING RETURNING``, so
+devices identifying concurrently (the whole house powering on at once) never race into an
+IntegrityError: each identifier is inserted exactly once and the statement tells which rows it
+created. The others are read back in one query and only written when the device now reports a
+different ``sensor_type``, so a plain reconnect writes nothing.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, Value, When
+
+from common.conditional import bump_version
+from .cache import sensor_cache
+from .ingest import BatchError
+from .models import Sensor
+from .serializers import SensorSerializer
+
+
+# Three parameters per row, under SQLite's historical limit of 999
+IDENTIFY_BATCH_SIZE = 300
+
+_insert = {}
+
+
+def _insert_sql(rows):
+    if rows not in _insert:
+        qn = connection.ops.quote_name
+        fields = [Sensor._meta.get_field(name) for name in ("identifier", "sensor_type", "status")]
+        identifier = qn(fields[0].column)
+        placeholders = "(" + ", ".join(["%s"] * len(fields)) + ")"
+        _insert[rows] = (
+            f"INSERT INTO {qn(Sensor._meta.db_table)} ({', '.join(qn(field.column) for field in fields)}) "
+            f"VALUES {', '.join([placeholders] * rows)} "
+            f"ON CONFLICT ({identifier}) DO NOTHING RETURNING {qn(Sensor._meta.pk.column)}, {identifier}"
+        )
+    return _insert[rows]
+
+
+def _identify_batch(types):
+    with connection.cursor() as cursor:
+        params = []
+        for identifier, sensor_type in types.items():
+            params += [identifier, sensor_type, Sensor.SensorStatus.UNREGISTERED]
+        cursor.execute(_insert_sql(len(types)), params)
+        created = {
+            identifier: Sensor(id=id_, identifier=identifier, sensor_type=types[identifier])
+            for id_, identifier in cursor.fetchall()
+        }
+
+    existing = {
+        sensor.identifier: sensor
+        for sensor in Sensor.objects.filter(identifier__in=[i for i in types if i not in created])
+    }
+    changed = [sensor for sensor in existing.values() if sensor.sensor_type != types[sensor.identifier]]
+    if changed:
+        Sensor.objects.filter(id__in=[sensor.id for sensor in changed]).update(
+            sensor_type=Case(*[When(id=sensor.id, then=Value(types[sensor.identifier])) for sensor in changed])
+        )
+        for sensor in changed:
+            sensor.sensor_type = types[sensor.identifier]
+
+    results = {identifier: (sensor, True) for identifier, sensor in created.items()}
+    results.update((identifier, (sensor, False)) for identifier, sensor in existing.items())
+    return results, list(created) + [sensor.identifier for sensor in changed]
+
+
+def identify_sensors(devices):
+    """Create or update the sensors of ``(identifier, sensor_type)`` pairs.
+
+    Returns ``{identifier: (sensor, created)}``. Identifiers listed twice take the last type.
+    """
+    types = dict(devices)
+    items = list(types.items())
+    results, written = {}, []
+    with transaction.atomic():
+        for i in range(0, len(items), IDENTIFY_BATCH_SIZE):
+            batch_results, batch_written = _identify_batch(dict(items[i:i + IDENTIFY_BATCH_SIZE]))
+            results.update(batch_results)
+            written += batch_written
+
+    # The raw INSERT and the bulk UPDATE send no signals, see ``sensors.signals``
+    for identifier in written:
+        sensor_cache.invalidate_on_commit(identifier)
+    if written:
+        bump_version()
+    # Data posts follow an identify, so warm the cache they read from
+    for sensor, _ in results.values():
+        sensor_cache.put(sensor)
+    return results
+
+
+def parse_device(item):
+    """Return ``(identifier, sensor_type)`` of an identify payload, or None if either is missing."""
+    if not isinstance(item, dict):
+        return None
+    identifier, sensor_type = item.get("identifier"), item.get("sensor_type")
+    if not isinstance(identifier, str) or not isinstance(sensor_type, str) or not identifier or not sensor_type:
+        return None
+    return identifier, sensor_type
+
+
+def identify_batch(items):
+    """Identify the devices posted to ``/sensors/batch/``, for gateways reconnecting many at once.
+
+    Returns the response body with each sensor, in order. Raises ``BatchError`` if ``items`` is
+    not a list, is too large or has an item without an identifier or type.
+    """
+    if not isinstance(items, list):
+        raise BatchError("Expected a list of sensors")
+    if len(items) > settings.SENSOR_IDENTIFY_MAX_BATCH_SIZE:
+        raise BatchError(f"Batch exceeds {settings.SENSOR_IDENTIFY_MAX_BATCH_SIZE} sensors")
+    devices = []
+    for i, item in enumerate(items):
+        device = parse_device(item)
+        if device is None:
+            raise BatchError(f"Item {i} needs an identifier and a sensor_type")
+        devices.append(device)
+    results = identify_sensors(devices)
+    body = []
+    for identifier, _ in devices:
+        sensor, created = results[identifier]
+        body.append({**SensorSerializer(sensor).data, "created": created})
+    return {"created": sum(1 for _, created in results.values() if created), "results": body}
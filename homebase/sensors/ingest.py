@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import sensor_cache
+from .last_seen import last_seen_tracker
+from .live import live_broker
+from .metrics import record_ingested, record_rejected
+from .models import Sensor, SensorData
+from .serializers import SensorDataBatchItemSerializer
+from .typed import save_readings
+
+
+class BatchError(ValueError):
+    pass
+
+
+class IngestStatus:
+    CREATED = "created"
+    INACTIVE = "inactive"
+    UNKNOWN = "unknown"
+    INVALID = "invalid"
+
+
+def bulk_ingest(records):
+    """Write a batch of validated readings with a single lookup and a single INSERT.
+
+    ``records`` is a list of dicts with ``identifier``, ``data`` and an optional
+    ``timestamp``. Returns one result dict per record, in order.
+    """
+    sensors = sensor_cache.get_many({record["identifier"] for record in records})
+
+    now = timezone.now()
+    results = []
+    to_create = []
+    for record in records:
+        ident = record["identifier"]
+        if ident not in sensors:
+            record_rejected(IngestStatus.UNKNOWN)
+            results.append({"identifier": ident, "status": IngestStatus.UNKNOWN, "error": "Sensor does not exist"})
+            continue
+        sensor = sensors[ident]
+        if sensor.status != Sensor.SensorStatus.ACTIVE:
+            record_rejected(IngestStatus.INACTIVE, sensor.id)
+            results.append({"identifier": ident, "status": IngestStatus.INACTIVE, "error": "Sensor is not active"})
+            continue
+        obj = SensorData(sensor_id=sensor.id, data=record["data"], timestamp=record.get("timestamp") or now)
+        to_create.append((sensor, obj))
+        results.append({"identifier": ident, "status": IngestStatus.CREATED, "obj": obj})
+
+    save_readings([obj for _, obj in to_create])
+    record_ingested(obj.sensor_id for _, obj in to_create)
+    last_seen_tracker.touch_many((obj.sensor_id, obj.timestamp) for _, obj in to_create)
+    by_sensor = {}
+    for sensor, obj in to_create:
+        by_sensor.setdefault(sensor, []).append(obj)
+    for sensor, objs in by_sensor.items():
+        live_broker.publish(sensor, objs)
+
+    for result in results:
+        obj = result.pop("obj", None)
+        if obj is not None:
+            result["id"] = obj.id
+    return results
+
+
+def ingest_batch(items):
+    """Validate and write a batch posted to ``/sensordata/batch/``.
+
+    Returns the response body with a result per item, in order. Raises ``BatchError``
+    if ``items`` is not a list or is too large.
+    """
+    if not isinstance(items, list):
+        raise BatchError("Expected a list of readings")
+    if len(items) > settings.SENSOR_DATA_MAX_BATCH_SIZE:
+        raise BatchError(f"Batch exceeds {settings.SENSOR_DATA_MAX_BATCH_SIZE} readings")
+
+    results = [None] * len(items)
+    records, positions = [], []
+    for i, item in enumerate(items):
+        serializer = SensorDataBatchItemSerializer(data=item)
+        if serializer.is_valid():
+            records.append(serializer.validated_data)
+            positions.append(i)
+        else:
+            record_rejected(IngestStatus.INVALID)
+            ident = item.get("identifier") if isinstance(item, dict) else None
+            results[i] = {"identifier": ident, "status": IngestStatus.INVALID, "error": serializer.errors}
+    for i, result in zip(positions, bulk_ingest(records)):
+        results[i] = result
+
+    created = sum(1 for r in results if r["status"] == IngestStatus.CREATED)
+    return {"created": created, "rejected": len(results) - created, "results": results}
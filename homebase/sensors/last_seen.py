@@ -0,0 +1,149 @@
+import logging, threading, time
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from common.conditional import bump_version
+from .models import Sensor
+
+
+logger = logging.getLogger(__name__)
+
+
+class LastSeenTracker:
+    """Write-behind buffer for ``Sensor.last_seen``.
+
+    Ingest records the newest timestamp per sensor in memory and a timer flushes them
+    all with a single ``UPDATE ... CASE`` ``flush_interval`` seconds after the first
+    pending reading. If a flush is still outstanding after ``max_staleness`` seconds
+    (e.g. the previous one failed), the next ``touch`` flushes inline.
+
+    Flushes change the registry version (see ``common.conditional``) at most once per
+    ``SENSOR_LAST_SEEN_VERSION_INTERVAL`` seconds, otherwise the sensor list's ETag would change
+    every flush while any sensor reports. Conditional and cached lists may therefore show
+    ``last_seen`` up to that long behind.
+    """
+    FLUSH_CHUNK_SIZE = 500
+
+    def __init__(self, flush_interval=None, max_staleness=None):
+        self._flush_interval = flush_interval
+        self._max_staleness = max_staleness
+        self._pending = {}
+        self._oldest = None
+        self._timer = None
+        self._last_bump = None
+        self._bump_timer = None
+        self._lock = threading.Lock()
+
+    @property
+    def flush_interval(self):
+        return self._flush_interval if self._flush_interval is not None else settings.SENSOR_LAST_SEEN_FLUSH_INTERVAL
+
+    @property
+    def max_staleness(self):
+        return self._max_staleness if self._max_staleness is not None else settings.SENSOR_LAST_SEEN_MAX_STALENESS
+
+    def touch(self, sensor_id, timestamp):
+        self.touch_many([(sensor_id, timestamp)])
+
+    def touch_many(self, seen):
+        """Record ``(sensor_id, timestamp)`` pairs, keeping the newest per sensor."""
+        with self._lock:
+            for sensor_id, timestamp in seen:
+                current = self._pending.get(sensor_id)
+                if current is None or timestamp > current:
+                    self._pending[sensor_id] = timestamp
+            if not self._pending:
+                return
+            now = time.monotonic()
+            if self._oldest is None:
+                self._oldest = now
+            stale = now - self._oldest >= self.max_staleness
+            if not stale and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if stale:
+            self.flush()
+
+    def pending(self):
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        """Apply all pending timestamps in one UPDATE. Returns the number of sensors written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._oldest = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+        items = list(pending.items())
+        try:
+            # Chunked to stay under the database's query parameter limit
+            for i in range(0, len(items), self.FLUSH_CHUNK_SIZE):
+                self._write(items[i:i + self.FLUSH_CHUNK_SIZE])
+        except Exception:
+            # Put the timestamps back so the next flush retries them
+            self.touch_many(pending.items())
+            raise
+        # last_seen is part of the sensor list, and UPDATEs don't send post_save
+        self._bump_version()
+        return len(pending)
+
+    def _bump_version(self):
+        with self._lock:
+            if self._bump_timer is not None:
+                return
+            now = time.monotonic()
+            wait = 0 if self._last_bump is None else self._last_bump + settings.SENSOR_LAST_SEEN_VERSION_INTERVAL - now
+            if wait > 0:
+                # Bump once the interval is over, so the last flush of a burst is not left out
+                self._bump_timer = threading.Timer(wait, self._bump_from_timer)
+                self._bump_timer.daemon = True
+                self._bump_timer.start()
+                return
+            self._last_bump = now
+        bump_version()
+
+    def _bump_from_timer(self):
+        with self._lock:
+            self._bump_timer = None
+        self._bump_version()
+
+    def _write(self, items):
+        # Never move last_seen backwards, e.g. if another process flushed newer readings
+        whens = []
+        for pk, ts in items:
+            ts = Value(ts, output_field=DateTimeField())
+            whens.append(When(pk=pk, then=Greatest(Coalesce(F("last_seen"), ts), ts)))
+        Sensor.objects.filter(pk__in=[pk for pk, _ in items]).update(
+            last_seen=Case(*whens, default=F("last_seen"), output_field=DateTimeField())
+        )
+
+    def clear(self):
+        with self._lock:
+            self._pending = {}
+            self._oldest = None
+            self._last_bump = None
+            for timer in (self._timer, self._bump_timer):
+                if timer is not None:
+                    timer.cancel()
+            self._timer = self._bump_timer = None
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to flush sensor last_seen timestamps")
+        finally:
+            connections.close_all()
+
+
+last_seen_tracker = LastSeenTracker()
@@ -0,0 +1,95 @@
+"""The newest value of each data key of each sensor, kept in ``SensorLatest``.
+
+Ingest calls ``update_latest`` in the transaction that writes the readings. It upserts a row
+per (sensor, key) with ``INSERT ... ON CONFLICT DO UPDATE ... WHERE``, where the guard only lets
+newer readings through, so readings arriving out of order or from several processes never move
+a value backwards. Current state is then one indexed lookup per sensor, however long the history.
+"""
+from django.db import connection
+
+from .chunks import chunk_readings
+from .models import SensorChunk, SensorData, SensorLatest
+
+
+UPSERT_BATCH_SIZE = 500
+
+_upsert = {}
+
+
+def _upsert_sql(rows):
+    if rows not in _upsert:
+        fields = [SensorLatest._meta.get_field(name) for name in ("sensor", "key", "value", "timestamp", "reading_id")]
+        qn = connection.ops.quote_name
+        table = qn(SensorLatest._meta.db_table)
+        columns = [qn(field.column) for field in fields]
+        sensor, key, value, timestamp, reading = columns
+        placeholders = "(" + ", ".join(["%s"] * len(fields)) + ")"
+        _upsert[rows] = (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([placeholders] * rows)} "
+            f"ON CONFLICT ({sensor}, {key}) DO UPDATE SET "
+            f"{value} = excluded.{value}, {timestamp} = excluded.{timestamp}, {reading} = excluded.{reading} "
+            f"WHERE excluded.{timestamp} > {table}.{timestamp} "
+            f"OR (excluded.{timestamp} = {table}.{timestamp} AND excluded.{reading} > {table}.{reading})",
+            fields,
+        )
+    return _upsert[rows]
+
+
+def _values(data):
+    return data.items() if isinstance(data, dict) else [("", data)]
+
+
+def update_latest(readings):
+    """Upsert the values of saved (or, without an id, just inserted) ``SensorData``."""
+    newest = {}
+    for reading in readings:
+        order = (reading.timestamp, reading.id or 0)
+        for key, value in _values(reading.data):
+            current = newest.get((reading.sensor_id, key))
+            if current is None or order > current[0]:
+                newest[(reading.sensor_id, key)] = (order, value, reading)
+
+    rows = [
+        (sensor_id, key, value, reading.timestamp, reading.id)
+        for (sensor_id, key), (_, value, reading) in newest.items()
+    ]
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[i:i + UPSERT_BATCH_SIZE]
+            sql, fields = _upsert_sql(len(batch))
+            params = []
+            for row in batch:
+                params += [field.get_db_prep_save(v, connection) for field, v in zip(fields, row)]
+            cursor.execute(sql, params)
+
+
+def latest_data(rows):
+    """Combine the ``SensorLatest`` rows of one sensor into ``{"timestamp", "data"}``, or None."""
+    rows = list(rows)
+    if not rows:
+        return None
+    timestamp = max(row.timestamp for row in rows)
+    if len(rows) == 1 and rows[0].key == "":
+        return {"timestamp": timestamp, "data": rows[0].value}
+    return {"timestamp": timestamp, "data": {row.key: row.value for row in sorted(rows, key=lambda row: row.key)}}
+
+
+def rebuild_latest(batch_size=5000):
+    """Upsert the latest values from every stored reading, raw and compacted. Returns the readings read."""
+    total, last_id = 0, 0
+    while True:
+        readings = list(SensorData.objects.filter(id__gt=last_id).order_by("id")[:batch_size])
+        if not readings:
+            break
+        update_latest(readings)
+        total += len(readings)
+        last_id = readings[-1].id
+
+    readings = []
+    for id_, sensor_id, timestamp, data in chunk_readings(SensorChunk.objects.all()):
+        readings.append(SensorData(id=id_, sensor_id=sensor_id, timestamp=timestamp, data=data))
+        if len(readings) == batch_size:
+            update_latest(readings)
+            total, readings = total + len(readings), []
+    update_latest(readings)
+    return total + len(readings)
@@ -0,0 +1,116 @@
+import asyncio, threading
+from collections import deque
+
+from django.conf import settings
+
+
+class Subscription:
+    """Readings matching a filter, delivered to one consumer on its event loop.
+
+    A consumer that falls more than ``queue_size`` readings behind loses the oldest
+    ones rather than slowing down ingest; ``dropped`` counts them.
+    """
+
+    def __init__(self, broker, loop, sensors=None, rooms=None, sensor_types=None, queue_size=1000):
+        self._broker = broker
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self.sensors = set(sensors or ())
+        self.rooms = set(rooms or ())
+        self.sensor_types = set(sensor_types or ())
+        self.dropped = 0
+
+    def matches(self, event):
+        return (
+            (not self.sensors or event["sensor"] in self.sensors)
+            and (not self.rooms or event["room"] in self.rooms)
+            and (not self.sensor_types or event["sensor_type"] in self.sensor_types)
+        )
+
+    def offer(self, events):
+        """Thread safe: hand matching events to the subscriber's loop."""
+        events = [event for event in events if self.matches(event)]
+        if events:
+            try:
+                self._loop.call_soon_threadsafe(self._enqueue, events)
+            except RuntimeError:
+                # The subscriber's loop is closed
+                self.close()
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+    def close(self):
+        self._broker.unsubscribe(self)
+
+    def _enqueue(self, events):
+        for event in events:
+            if self._queue.full():
+                self._queue.get_nowait()
+                self.dropped += 1
+            self._queue.put_nowait(event)
+
+
+class LiveBroker:
+    """In-process fan out of newly ingested readings to live subscribers.
+
+    The last ``replay_size`` readings are kept so a new subscriber starts with some
+    context. Only readings ingested by this process are seen.
+    """
+
+    def __init__(self, replay_size=None):
+        self._replay_size = replay_size
+        self._recent = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    @property
+    def replay_size(self):
+        return self._replay_size if self._replay_size is not None else settings.SENSOR_LIVE_REPLAY_SIZE
+
+    def publish(self, sensor, readings):
+        """Publish saved (or queued) ``SensorData`` of the ``CachedSensor`` ``sensor``."""
+        events = [
+            {
+                "id": reading.id,
+                "sensor": sensor.id,
+                "room": sensor.room_id,
+                "sensor_type": sensor.sensor_type,
+                "timestamp": reading.timestamp,
+                "data": reading.data,
+            }
+            for reading in readings
+        ]
+        with self._lock:
+            if self._recent is None:
+                self._recent = deque(maxlen=self.replay_size)
+            self._recent.extend(events)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(events)
+
+    def subscribe(self, replay=True, **filters):
+        """Subscribe from a coroutine. Matching buffered readings are delivered first if ``replay``."""
+        subscription = Subscription(self, asyncio.get_running_loop(), queue_size=settings.SENSOR_LIVE_QUEUE_SIZE, **filters)
+        with self._lock:
+            self._subscribers.add(subscription)
+            recent = list(self._recent or ()) if replay else []
+        subscription._enqueue([event for event in recent if subscription.matches(event)])
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def clear(self):
+        with self._lock:
+            self._recent = None
+            self._subscribers.clear()
+
+
+live_broker = LiveBroker()
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from sensors.typed import backfill_typed
+
+
+class Command(BaseCommand):
+    help = "Write the typed SensorReading values of existing readings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000, help="Readings processed per transaction")
+        parser.add_argument("--after-id", type=int, default=0, help="Resume after this reading id")
+
+    def handle(self, *args, batch_size, after_id, **options):
+        total = 0
+        while True:
+            processed, after_id = backfill_typed(after_id, batch_size)
+            if not processed:
+                break
+            total += processed
+            self.stdout.write(f"Backfilled {total} readings, up to id {after_id}")
+        self.stdout.write(f"Backfilled {total} readings")
@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from sensors.compaction import compact_readings
+
+
+class Command(BaseCommand):
+    help = "Pack old raw sensor readings into compressed per-sensor chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=float,
+            default=settings.SENSOR_DATA_COMPACT_AFTER,
+            help="Compact readings older than this many days (default SENSOR_DATA_COMPACT_AFTER)",
+        )
+        parser.add_argument("--window", type=int, help="Seconds per chunk (default SENSOR_DATA_CHUNK_WINDOW)")
+        parser.add_argument(
+            "--ignore-rollups",
+            action="store_true",
+            help="Also compact readings that have not been rolled up yet, they are then never rolled up",
+        )
+
+    def handle(self, *args, older_than, window, ignore_rollups, **options):
+        if older_than is None:
+            raise CommandError("Pass --older-than or set SENSOR_DATA_COMPACT_AFTER")
+        readings, chunks = compact_readings(
+            timezone.now() - timedelta(days=older_than),
+            window=window,
+            require_rollups=not ignore_rollups,
+        )
+        self.stdout.write(f"Compacted {readings} readings into {chunks} chunks")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from sensors.retention import apply_retention
+
+
+class Command(BaseCommand):
+    help = "Delete sensor readings and rollups older than SENSOR_DATA_RETENTION"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Rows deleted per transaction")
+        parser.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between chunks")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the rows that would be deleted")
+        parser.add_argument(
+            "--ignore-rollups",
+            action="store_true",
+            help="Also delete raw readings that have not been rolled up yet",
+        )
+
+    def handle(self, *args, chunk_size, pause, dry_run, ignore_rollups, **options):
+        report = apply_retention(
+            chunk_size=chunk_size,
+            pause=pause,
+            require_rollups=not ignore_rollups,
+            dry_run=dry_run,
+        )
+        verb = "Would delete" if dry_run else "Deleted"
+        for tier, count in report.deleted.items():
+            self.stdout.write(f"{verb} {count} {tier} rows")
+        self.stdout.write(f"{verb} {report.total} rows in {report.elapsed:.2f}s")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from sensors.latest import rebuild_latest
+
+
+class Command(BaseCommand):
+    help = "Rebuild the latest value of each sensor and data key from the stored readings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000, help="Readings upserted per batch")
+
+    def handle(self, *args, batch_size, **options):
+        total = rebuild_latest(batch_size)
+        self.stdout.write(f"Rebuilt latest values from {total} readings")
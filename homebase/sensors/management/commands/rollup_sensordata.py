@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sensors.rollups import update_rollups
+
+
+class Command(BaseCommand):
+    help = "Fold new sensor readings into the minute/hour/day rollup tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000, help="Readings processed per transaction")
+        parser.add_argument("--loop", action="store_true", help="Keep running and poll for new readings")
+        parser.add_argument("--interval", type=float, default=60, help="Seconds between polls with --loop")
+
+    def handle(self, *args, batch_size, loop, interval, **options):
+        while True:
+            total = 0
+            while processed := update_rollups(batch_size):
+                total += processed
+            self.stdout.write(f"Rolled up {total} readings")
+            if not loop:
+                break
+            time.sleep(interval)
@@ -0,0 +1,53 @@
+"""Sensor metrics, served at ``/metrics`` with the request metrics of ``common.metrics``."""
+from django.conf import settings
+
+from common.metrics import registry
+from .cache import sensor_cache
+from . import write_queue
+
+
+readings_ingested = registry.counter(
+    "homebase_sensor_readings_total", "Readings accepted, per sensor", ["sensor"]
+)
+readings_rejected = registry.counter(
+    "homebase_readings_rejected_total", "Readings rejected, by reason", ["reason"]
+)
+rejected_inactive = registry.counter(
+    "homebase_sensor_rejected_inactive_total", "Readings rejected because the sensor is not active, per sensor", ["sensor"]
+)
+
+
+def record_ingested(sensor_ids):
+    """Count accepted readings, given the sensor id of each."""
+    counts = {}
+    for sensor_id in sensor_ids:
+        counts[sensor_id] = counts.get(sensor_id, 0) + 1
+    for sensor_id, n in counts.items():
+        readings_ingested.inc(n, sensor=sensor_id)
+
+
+def record_rejected(reason, sensor_id=None):
+    # Only known sensors get a series of their own, identifiers of unknown ones are arbitrary
+    readings_rejected.inc(reason=reason)
+    if reason == "inactive" and sensor_id is not None:
+        rejected_inactive.inc(sensor=sensor_id)
+
+
+def _cache_stats():
+    stats = sensor_cache.stats()
+    return {(name,): stats[name] for name in ("size", "hits", "misses")}
+
+
+def _queue_stats():
+    if not settings.SENSOR_INGEST_QUEUE_ENABLED:
+        return {}
+    stats = write_queue.get_ingest_queue().stats()
+    names = (
+        "depth", "enqueued", "spilled", "replayed", "written", "failed_batches", "dead_lettered", "errors",
+        "last_batch_size", "last_flush_ms", "max_flush_ms",
+    )
+    return {(name,): stats[name] for name in names}
+
+
+registry.gauge("homebase_sensor_cache", "Sensor cache size and lookups", ["stat"], _cache_stats)
+registry.gauge("homebase_ingest_queue", "Ingest queue depth and writes", ["stat"], _queue_stats)
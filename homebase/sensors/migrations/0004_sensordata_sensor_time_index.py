@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0003_sensor_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sensordata',
+            index=models.Index(fields=['sensor', 'timestamp', 'id'], name='sensordata_sensor_time_idx'),
+        ),
+    ]
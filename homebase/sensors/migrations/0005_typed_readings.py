@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0004_sensordata_sensor_time_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SensorReading',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('value', models.FloatField()),
+                ('key', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='readings', to='sensors.datakey')),
+                ('reading', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='values', to='sensors.sensordata')),
+                ('sensor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='readings', to='sensors.sensor')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['sensor', 'key', 'timestamp'], name='sensorreading_series_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='sensorreading',
+            constraint=models.UniqueConstraint(fields=('reading', 'key'), name='unique_reading_key'),
+        ),
+    ]
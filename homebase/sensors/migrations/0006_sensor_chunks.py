@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0005_typed_readings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('count', models.PositiveIntegerField()),
+                ('max_id', models.BigIntegerField()),
+                ('payload', models.BinaryField()),
+                ('sensor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='sensors.sensor')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='sensorchunk',
+            constraint=models.UniqueConstraint(fields=('sensor', 'start'), name='unique_sensor_chunk'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0006_sensor_chunks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorLatest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100)),
+                ('value', models.JSONField()),
+                ('timestamp', models.DateTimeField()),
+                ('reading_id', models.BigIntegerField(null=True)),
+                ('sensor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='latest', to='sensors.sensor')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='sensorlatest',
+            constraint=models.UniqueConstraint(fields=('sensor', 'key'), name='unique_sensor_latest'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 from rooms.models import Room
 
@@ -17,9 +18,12 @@ class Sensor(models.Model):
     last_seen = models.DateTimeField(null=True, blank=True)
 
     def register(self, name):
+        from .cache import sensor_cache
+
         self.name = name
         self.status = self.SensorStatus.ACTIVE
         self.save()
+        sensor_cache.invalidate(self.identifier)
 
     def add_to_room(self, room):
         self.room = room
@@ -32,4 +36,103 @@ class Sensor(models.Model):
 class SensorData(models.Model):
     sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='data')
     data = models.JSONField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["sensor", "timestamp", "id"], name="sensordata_sensor_time_idx"),
+        ]
+
+
+class SensorRollup(models.Model):
+    """Min/max/sum/count of one numeric data key of a sensor over a minute, hour or day."""
+    class Resolution(models.TextChoices):
+        MINUTE = 'm', 'Minute'
+        HOUR = 'h', 'Hour'
+        DAY = 'd', 'Day'
+
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='rollups')
+    key = models.CharField(max_length=100)
+    resolution = models.CharField(max_length=1, choices=Resolution.choices)
+    bucket = models.DateTimeField()
+    min = models.FloatField()
+    max = models.FloatField()
+    sum = models.FloatField()
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["sensor", "resolution", "key", "bucket"], name="unique_sensor_rollup"),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """Highest ``SensorData.id`` already folded into ``SensorRollup``. There is a single row.
+
+    ``horizon_id`` is the newest reading id at ``horizon_at``, see ``sensors.rollups``.
+    """
+    last_id = models.BigIntegerField(default=0)
+    horizon_id = models.BigIntegerField(default=0)
+    horizon_at = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def current(cls):
+        return cls.objects.get_or_create(pk=1)[0]
+
+
+class DataKey(models.Model):
+    """An interned data key name, e.g. ``temperature``."""
+    name = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class SensorReading(models.Model):
+    """One numeric value of a ``SensorData``, stored typed when ``SENSOR_DATA_TYPED_STORAGE`` is on."""
+    reading = models.ForeignKey(SensorData, on_delete=models.CASCADE, related_name='values')
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='readings')
+    key = models.ForeignKey(DataKey, on_delete=models.CASCADE, related_name='readings')
+    timestamp = models.DateTimeField()
+    value = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["reading", "key"], name="unique_reading_key"),
+        ]
+        indexes = [
+            models.Index(fields=["sensor", "key", "timestamp"], name="sensorreading_series_idx"),
+        ]
+
+
+class SensorChunk(models.Model):
+    """The readings of a sensor in ``[start, end)``, compressed by ``sensors.chunks``."""
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='chunks')
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    count = models.PositiveIntegerField()
+    max_id = models.BigIntegerField()
+    payload = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["sensor", "start"], name="unique_sensor_chunk"),
+        ]
+
+
+class SensorLatest(models.Model):
+    """The newest value of each data key of a sensor, upserted by ingest.
+
+    A reading whose ``data`` is not an object is stored whole under the key ``""``.
+    ``reading_id`` is not a foreign key since old readings are compacted or pruned.
+    """
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='latest')
+    key = models.CharField(max_length=100)
+    value = models.JSONField()
+    timestamp = models.DateTimeField()
+    reading_id = models.BigIntegerField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["sensor", "key"], name="unique_sensor_latest"),
+        ]
@@ -0,0 +1,81 @@
+import base64
+from heapq import merge
+from itertools import islice
+from urllib.parse import urlencode
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+class SensorDataCursorPagination(BasePagination):
+    """Keyset pagination of readings over ``(timestamp, id)``.
+
+    The cursor is the position of the last row of the previous page, so every page is an
+    index range scan on ``(sensor, timestamp, id)`` no matter how deep it is, and rows
+    inserted while a client is paging never shift rows between pages. Pages have no ``count``,
+    which would scan every reading, and no ``previous`` link, pages are walked forwards.
+    """
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 10000
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None, extra=None):
+        """``extra(position)``, if given, yields more rows after ``position`` in ``(timestamp, id)`` order
+        to merge into the page, e.g. readings that have been compacted into chunks."""
+        self.request = request
+        self.limit = self.get_limit(request)
+        queryset = queryset.order_by("timestamp", "id")
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            timestamp, pk = position
+            # The leading ``timestamp >= ...`` keeps this an index range scan
+            queryset = queryset.filter(Q(timestamp__gte=timestamp), Q(timestamp__gt=timestamp) | Q(id__gt=pk))
+
+        rows = list(queryset[:self.limit + 1])
+        if extra is not None:
+            rows = list(islice(merge(rows, extra(position), key=lambda row: (row.timestamp, row.id)), self.limit + 1))
+        self.has_next = len(rows) > self.limit
+        rows = rows[:self.limit]
+        self.last = (rows[-1].timestamp, rows[-1].id) if rows else None
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(limit, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        params = self.request.query_params.copy()
+        params[self.cursor_query_param] = self.encode_cursor(*self.last)
+        return self.request.build_absolute_uri(f"{self.request.path}?{urlencode(params)}")
+
+    def encode_cursor(self, timestamp, pk):
+        return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{pk}".encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            timestamp, pk = base64.urlsafe_b64decode(encoded.encode()).decode().split("|")
+            timestamp = parse_datetime(timestamp)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise ValidationError({self.cursor_query_param: [self.invalid_cursor_message]})
+        if timestamp is None:
+            raise ValidationError({self.cursor_query_param: [self.invalid_cursor_message]})
+        return timestamp, pk
@@ -0,0 +1,74 @@
+import csv, io, json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import columnar
+
+
+EXPORT_FIELDS = ["id", "sensor", "timestamp", "data"]
+
+
+class NDJSONRenderer(BaseRenderer):
+    """One JSON object per line. ``stream`` renders an iterable of rows lazily."""
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = [data]
+        return "".join(self.stream(data)).encode(self.charset)
+
+    def stream(self, rows, chunk_size=500):
+        lines = []
+        for row in rows:
+            lines.append(json.dumps(row, cls=JSONEncoder, separators=(",", ":")) + "\n")
+            if len(lines) >= chunk_size:
+                yield "".join(lines)
+                lines = []
+        if lines:
+            yield "".join(lines)
+
+
+class CSVRenderer(BaseRenderer):
+    """Readings as CSV, with ``data`` JSON encoded in its own column."""
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = [data]
+        return "".join(self.stream(data)).encode(self.charset)
+
+    def stream(self, rows, chunk_size=500):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for i, row in enumerate(rows, 1):
+            if "data" in row:
+                row = {**row, "data": json.dumps(row["data"], cls=JSONEncoder, separators=(",", ":"))}
+            writer.writerow(row)
+            if i % chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+
+class ColumnarRenderer(BaseRenderer):
+    """Series of readings in the binary format described in ``sensors.columnar``.
+
+    Expects ``{"results": [{"timestamp", "data"}], ...}``. The other top level keys
+    (e.g. ``next``) are carried in the header's ``meta``.
+    """
+    media_type = "application/vnd.homebase.columnar"
+    format = "columnar"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        data = dict(data)
+        points = data.pop("results", [])
+        return columnar.encode(points, meta=json.loads(json.dumps(data, cls=JSONEncoder)))
@@ -0,0 +1,101 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .models import RollupWatermark, SensorChunk, SensorData, SensorRollup
+
+
+TIERS = {
+    "raw": None,
+    "minute": SensorRollup.Resolution.MINUTE,
+    "hour": SensorRollup.Resolution.HOUR,
+    "day": SensorRollup.Resolution.DAY,
+}
+
+
+def get_policies(retention=None):
+    """Resolve ``SENSOR_DATA_RETENTION`` into ``{sensor_type: {tier: days}}``.
+
+    Each sensor_type entry falls back to ``"default"`` for the tiers it leaves out.
+    """
+    retention = settings.SENSOR_DATA_RETENTION if retention is None else retention
+    default = {tier: None for tier in TIERS}
+    default.update(retention.get("default", {}))
+    policies = {"default": default}
+    for sensor_type, tiers in retention.items():
+        if sensor_type != "default":
+            policies[sensor_type] = {**default, **tiers}
+    return policies
+
+
+class RetentionReport:
+    def __init__(self):
+        self.deleted = {tier: 0 for tier in TIERS}
+        self.elapsed = 0.0
+
+    @property
+    def total(self):
+        return sum(self.deleted.values())
+
+
+def apply_retention(retention=None, chunk_size=1000, pause=0.0, require_rollups=True, dry_run=False, now=None):
+    """Delete readings and rollups older than their retention period.
+
+    Rows are deleted ``chunk_size`` at a time, each chunk in its own short transaction, and
+    ``pause`` seconds are slept between chunks so that ingest can take the write lock.
+    With ``require_rollups`` raw readings that have not been folded into the rollups yet are
+    kept regardless of age.
+    """
+    started = time.monotonic()
+    now = now or timezone.now()
+    policies = get_policies(retention)
+    explicit_types = [t for t in policies if t != "default"]
+    watermark = RollupWatermark.objects.values_list("last_id", flat=True).first() or 0
+
+    report = RetentionReport()
+    for sensor_type, tiers in policies.items():
+        if sensor_type == "default":
+            scope = ~Q(sensor__sensor_type__in=explicit_types)
+        else:
+            scope = Q(sensor__sensor_type=sensor_type)
+
+        for tier, resolution in TIERS.items():
+            days = tiers[tier]
+            if days is None:
+                continue
+            cutoff = now - timedelta(days=days)
+            if resolution is None:
+                queryset = SensorData.objects.filter(scope, timestamp__lt=cutoff)
+                if require_rollups:
+                    queryset = queryset.filter(id__lte=watermark)
+                # Compacted readings go a whole chunk at a time, once all of it has expired
+                chunks = SensorChunk.objects.filter(scope, end__lte=cutoff)
+                report.deleted[tier] += chunks.aggregate(readings=Sum("count"))["readings"] or 0
+                if not dry_run:
+                    _delete_in_chunks(chunks, chunk_size, pause)
+            else:
+                queryset = SensorRollup.objects.filter(scope, resolution=resolution, bucket__lt=cutoff)
+
+            if dry_run:
+                report.deleted[tier] += queryset.count()
+            else:
+                report.deleted[tier] += _delete_in_chunks(queryset, chunk_size, pause)
+
+    report.elapsed = time.monotonic() - started
+    return report
+
+
+def _delete_in_chunks(queryset, chunk_size, pause):
+    deleted = 0
+    ids = queryset.order_by("id").values_list("id", flat=True)
+    while True:
+        chunk = list(ids[:chunk_size])
+        if not chunk:
+            return deleted
+        # Count only the model's own rows, not the typed values deleted with them
+        deleted += queryset.model.objects.filter(id__in=chunk).delete()[1].get(queryset.model._meta.label, 0)
+        if pause:
+            time.sleep(pause)
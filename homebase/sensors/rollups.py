@@ -0,0 +1,140 @@
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .aggregation import RESOLUTION_SECONDS, bucket_start, numeric_keys
+from .models import RollupWatermark, SensorData, SensorRollup
+
+
+# Buckets looked up per query of existing rollups, under SQLite's historical limit of 999 parameters
+ROLLUP_LOOKUP_SIZE = 500
+
+
+def update_rollups(batch_size=10000):
+    """Fold the next ``batch_size`` readings past the watermark into the rollup tables.
+
+    Returns the number of readings processed, 0 once the rollups are caught up. Readings
+    are read in id order, so one arriving late with an old timestamp is still merged into
+    the right bucket.
+    """
+    with transaction.atomic():
+        watermark = RollupWatermark.objects.select_for_update().get_or_create(pk=1)[0]
+        pending = SensorData.objects.filter(id__gt=watermark.last_id)
+        if not ids_commit_in_order():
+            pending = pending.filter(id__lte=_commit_horizon(watermark))
+        rows = list(
+            pending
+            .order_by("id")
+            .values_list("id", "sensor_id", "timestamp", "data")[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        partials = {}
+        for _, sensor_id, timestamp, data in rows:
+            if not isinstance(data, dict):
+                continue
+            epoch = int(timestamp.timestamp())
+            for key in numeric_keys(data):
+                value = float(data[key])
+                for resolution, seconds in RESOLUTION_SECONDS.items():
+                    _merge(partials, (sensor_id, resolution, key, epoch - epoch % seconds), (value, value, value, 1))
+
+        _write_partials(partials)
+        watermark.last_id = rows[-1][0]
+        watermark.save(update_fields=["last_id"])
+    return len(rows)
+
+
+def ids_commit_in_order():
+    """Whether a reading id is only visible once every lower id is committed or rolled back.
+
+    SQLite runs one write transaction at a time. Elsewhere a transaction holding a lower id
+    can commit after a higher one is visible, and the watermark would skip its readings.
+    """
+    return connection.vendor == "sqlite"
+
+
+def _commit_horizon(watermark):
+    """The highest reading id that is safe to roll up when ids may commit out of order.
+
+    Only ids that already existed ``SENSOR_ROLLUP_COMMIT_LAG`` seconds ago are folded in, by
+    then the transactions that allocated lower ids have finished. The horizon moves forward
+    once the rollups have caught up with it, so readings are rolled up one to two lags late.
+    """
+    now = timezone.now()
+    lag = datetime.timedelta(seconds=settings.SENSOR_ROLLUP_COMMIT_LAG)
+    if watermark.horizon_at is None or (now - watermark.horizon_at >= lag and watermark.last_id >= watermark.horizon_id):
+        watermark.horizon_id = SensorData.objects.aggregate(newest=Max("id"))["newest"] or 0
+        watermark.horizon_at = now
+        watermark.save(update_fields=["horizon_id", "horizon_at"])
+    return watermark.horizon_id if now - watermark.horizon_at >= lag else watermark.last_id
+
+
+def _merge(partials, group, partial):
+    current = partials.get(group)
+    if current is None:
+        partials[group] = list(partial)
+    else:
+        current[0] = min(current[0], partial[0])
+        current[1] = max(current[1], partial[1])
+        current[2] += partial[2]
+        current[3] += partial[3]
+
+
+def _existing_rollups(partials):
+    """The rollups of the ``(sensor, resolution, bucket)`` groups in ``partials``, whatever their key."""
+    buckets = {}
+    for sensor_id, resolution, _, bucket in partials:
+        buckets.setdefault((sensor_id, resolution), set()).add(bucket_start(bucket))
+    query, size = Q(), 0
+    for (sensor_id, resolution), group in buckets.items():
+        group = sorted(group)
+        for i in range(0, len(group), ROLLUP_LOOKUP_SIZE):
+            chunk = group[i:i + ROLLUP_LOOKUP_SIZE]
+            if size and size + len(chunk) > ROLLUP_LOOKUP_SIZE:
+                yield from SensorRollup.objects.filter(query)
+                query, size = Q(), 0
+            query |= Q(sensor_id=sensor_id, resolution=resolution, bucket__in=chunk)
+            size += len(chunk) + 2
+    if size:
+        yield from SensorRollup.objects.filter(query)
+
+
+def _write_partials(partials):
+    if not partials:
+        return
+    existing = _existing_rollups(partials)
+
+    to_update = []
+    for rollup in existing:
+        group = (rollup.sensor_id, rollup.resolution, rollup.key, int(rollup.bucket.timestamp()))
+        partial = partials.pop(group, None)
+        if partial is None:
+            continue
+        rollup.min = min(rollup.min, partial[0])
+        rollup.max = max(rollup.max, partial[1])
+        rollup.sum += partial[2]
+        rollup.count += partial[3]
+        to_update.append(rollup)
+
+    SensorRollup.objects.bulk_update(to_update, ["min", "max", "sum", "count"], batch_size=500)
+    SensorRollup.objects.bulk_create(
+        [
+            SensorRollup(
+                sensor_id=sensor_id,
+                resolution=resolution,
+                key=key,
+                bucket=bucket_start(bucket),
+                min=partial[0],
+                max=partial[1],
+                sum=partial[2],
+                count=partial[3],
+            )
+            for (sensor_id, resolution, key, bucket), partial in partials.items()
+        ],
+        batch_size=500,
+    )
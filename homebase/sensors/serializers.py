@@ -1,21 +1,48 @@
 from django.db import models
 from rest_framework import serializers
 
+from .latest import latest_data
 from .models import Sensor, SensorData
 
 
 class SensorSerializer(serializers.ModelSerializer):
+    """``latest`` is only included with ``context={"latest": True}``, prefetch ``latest`` for it."""
     identifier = serializers.CharField(write_only=True)
     status = serializers.CharField(source='get_status_display')
+    latest = serializers.SerializerMethodField()
 
     class Meta:
         model = Sensor
-        fields = ["id", "name", "room", "sensor_type", "identifier", "status", "last_seen"]
+        fields = ["id", "name", "room", "sensor_type", "identifier", "status", "last_seen", "latest"]
         read_only_fields = ["id"]
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.context.get("latest"):
+            self.fields.pop("latest")
+
+    def get_latest(self, obj):
+        return latest_data(obj.latest.all())
+
 
 class SensorDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = SensorData
         fields = ["id", "sensor", "data", "timestamp"]
-        read_only_fields = ["id", "timestamp"]
\ No newline at end of file
+        read_only_fields = ["id", "timestamp"]
+
+
+class SensorDataIngestSerializer(SensorDataSerializer):
+    """Used when the sensor has already been resolved, so it is passed to ``save()``."""
+    sensor = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
+class SensorDataBatchItemSerializer(serializers.Serializer):
+    identifier = serializers.CharField()
+    data = serializers.JSONField()
+    timestamp = serializers.DateTimeField(required=False)
+
+    def validate_data(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Expected an object")
+        return value
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from common.conditional import bump_version
+from .cache import sensor_cache
+from .models import Sensor
+
+
+@receiver(post_save, sender=Sensor)
+@receiver(post_delete, sender=Sensor)
+def invalidate_sensor_cache(sender, instance, **kwargs):
+    sensor_cache.invalidate_on_commit(instance.identifier)
+    bump_version()
@@ -1,14 +1,47 @@
-import math, uuid
+import asyncio, csv, datetime, io, json, math, os, tempfile, time, uuid
+from unittest import mock
 
+from asgiref.sync import sync_to_async
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import override_settings
+from django.utils import timezone
+from django.utils.http import parse_http_date
+
+from common.conditional import VERSION_KEY
+from common.db import READ_ALIAS, ReadReplicaRouter
+from common.metrics import registry, request_queries, request_seconds, rows_returned
 from common.tests import BaseTest
 from rooms.models import Room
-from sensors.models import Sensor, SensorData
+from sensors import chunks, columnar, rollups, write_queue
+from sensors.async_views import CoalescingWriter
+from sensors.cache import SensorCache, sensor_cache
+from sensors.compaction import compact_readings
+from sensors.last_seen import last_seen_tracker
+from sensors.live import live_broker
+from sensors.models import DataKey, RollupWatermark, Sensor, SensorChunk, SensorData, SensorReading, SensorRollup
+from sensors.retention import apply_retention
+from sensors.rollups import update_rollups
+from sensors.typed import key_registry, save_readings
+from sensors.write_queue import IngestQueue
 
 
 class SensorTestCase(BaseTest):
     def setUp(self):
         super().setUp()
         self.room = Room.objects.create(name="Test Room")
+        sensor_cache.clear()
+        last_seen_tracker.clear()
+        live_broker.clear()
+        key_registry.clear()
+        registry.clear()
+
+    def tearDown(self):
+        last_seen_tracker.clear()
+        return super().tearDown()
 
     def create_sensor(self, sensor_type="Test Type"):
         ident = str(uuid.uuid4())
@@ -47,6 +80,59 @@ class SensorTestCase(BaseTest):
         self.assertEqual(response.data["results"][0]["id"], sensor.id)
         self.assertEqual(response.data["results"][0]["status"], Sensor.SensorStatus.ACTIVE.label)
     
+    def test_api_sensors_conditional_get(self):
+        sensor = self.create_sensor()
+        # A version from a second that has already passed, so Last-Modified is sent
+        cache.set(VERSION_KEY, time.time_ns() - 2_000_000_000)
+        response = self.client.get("/sensors/")
+        etag = response["ETag"]
+        self.assertEqual(response.data["results"][0]["name"], None)
+
+        # Unchanged: 304 without a query, or the cached body without one either
+        with self.assertNumQueries(0):
+            response = self.client.get("/sensors/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(0):
+            response = self.client.get("/sensors/", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(0):
+            response = self.client.get("/sensors/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["results"][0]["id"], sensor.id)
+        # A change within the second named by Last-Modified is not hidden by it
+        last_modified = response["Last-Modified"]
+        cache.set(VERSION_KEY, parse_http_date(last_modified) * 1_000_000_000)
+        response = self.client.get("/sensors/", HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Last-Modified"], last_modified)
+        etag = response["ETag"]
+
+        # Saving a sensor or a room, or flushing last_seen, changes the version
+        sensor.register("Test Sensor")
+        response = self.client.get("/sensors/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"][0]["name"], "Test Sensor")
+        etag = response["ETag"]
+        last_seen_tracker.touch(sensor.id, timezone.now())
+        last_seen_tracker.flush()
+        response = self.client.get("/sensors/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.data["results"][0]["last_seen"])
+        etag = response["ETag"]
+        # but only once per SENSOR_LAST_SEEN_VERSION_INTERVAL
+        last_seen_tracker.touch(sensor.id, timezone.now())
+        with mock.patch("sensors.last_seen.bump_version") as bump_version:
+            with override_settings(SENSOR_LAST_SEEN_VERSION_INTERVAL=0.1):
+                last_seen_tracker.flush()
+                self.assertEqual(self.client.get("/sensors/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                bump_version.assert_not_called()
+                time.sleep(0.2)
+        bump_version.assert_called_once()
+        Room.objects.create(name="Other Room")
+        self.assertEqual(self.client.get(f"/sensors/{sensor.id}/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get("/rooms/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
     def test_api_create_sensor(self):
         UUID = str(uuid.uuid4())
         response = self.client.post("/sensors/", {"identifier": UUID, "sensor_type": "Test Type"})
@@ -72,6 +158,50 @@ class SensorTestCase(BaseTest):
         self.assertEqual(Sensor.objects.first().sensor_type, "Test Type")
         self.assertEqual(r4.data["status"], Sensor.SensorStatus.ACTIVE.label)
     
+    def test_api_identify_sensors(self):
+        sensor = self.create_sensor("Old Type")
+        sensor.register("Test Sensor")
+        etag = self.client.get("/sensors/")["ETag"]
+        self.assertEqual(sensor_cache.get(sensor.identifier).sensor_type, "Old Type")
+        # A device rebooting with another type keeps its sensor
+        response = self.client.post("/sensors/", {"identifier": sensor.identifier, "sensor_type": "New Type"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["id"], sensor.id)
+        self.assertEqual(response.data["status"], Sensor.SensorStatus.ACTIVE.label)
+        self.assertEqual(Sensor.objects.get().sensor_type, "New Type")
+        self.assertEqual(sensor_cache.get(sensor.identifier).sensor_type, "New Type")
+        self.assertEqual(self.client.get("/sensors/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.post("/sensors/", {"identifier": sensor.identifier}).status_code, 400)
+
+        devices = [{"identifier": f"device-{i}", "sensor_type": "door"} for i in range(1000)]
+        # Four INSERTs of 300, 300, 300 and 100 rows, inside a transaction
+        with self.assertNumQueries(6):
+            response = self.client.post("/sensors/batch/", devices, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["created"], 1000)
+        self.assertEqual(Sensor.objects.count(), 1001)
+        self.assertEqual(response.data["results"][999]["id"], Sensor.objects.get(identifier="device-999").id)
+
+        # A mass reconnect reads the sensors back and writes nothing, except for changed types
+        devices[0] = {"identifier": "device-0", "sensor_type": "window"}
+        devices[999] = {"identifier": sensor.identifier, "sensor_type": "New Type"}
+        etag = self.client.get("/sensors/")["ETag"]
+        with self.assertNumQueries(11):
+            response = self.client.post("/sensors/batch/", devices, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["created"], 0)
+        self.assertEqual(Sensor.objects.count(), 1001)
+        self.assertEqual(response.data["results"][0]["sensor_type"], "window")
+        self.assertFalse(response.data["results"][999]["created"])
+        self.assertEqual(Sensor.objects.get(identifier="device-0").sensor_type, "window")
+        self.assertEqual(self.client.get("/sensors/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        response = self.client.post("/sensors/batch/", [{"identifier": "device-0"}], format="json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/ingest/sensors/batch/", [{"identifier": "gateway-device", "sensor_type": "door"}], content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["results"][0]["created"])
+
     def test_api_create_sensor_data(self):
         sensor = self.create_sensor()
         response = self.client.post("/sensordata/", {"identifier": sensor.identifier, "data": {"temperature": 25}}, format="json")
@@ -85,6 +215,31 @@ class SensorTestCase(BaseTest):
         self.assertEqual(SensorData.objects.count(), 1)
         self.assertEqual(SensorData.objects.first().data, {"temperature": 25})
 
+    def test_metrics(self):
+        sensor = self.create_sensor()
+        self.client.post("/sensordata/", {"identifier": sensor.identifier, "data": {"temperature": 25}}, format="json")
+        self.client.post("/sensordata/", {"identifier": "does-not-exist", "data": {"temperature": 25}}, format="json")
+        sensor.register("Test Sensor")
+        for _ in range(2):
+            self.client.post("/sensordata/", {"identifier": sensor.identifier, "data": {"temperature": 25}}, format="json")
+        self.client.get(f"/sensors/{sensor.id}/data/")
+
+        self.assertEqual(request_seconds.count(view="sensordata-list", method="POST", status=201), 2)
+        self.assertEqual(request_seconds.count(view="sensordata-list", method="POST", status=403), 1)
+        self.assertEqual(request_queries.count(view="sensors-get-data", method="GET"), 1)
+        self.assertEqual(rows_returned.count(view="sensors-get-data"), 1)
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn(f'homebase_sensor_readings_total{{sensor="{sensor.id}"}} 2', body)
+        self.assertIn(f'homebase_sensor_rejected_inactive_total{{sensor="{sensor.id}"}} 1', body)
+        self.assertIn('homebase_readings_rejected_total{reason="unknown"} 1', body)
+        self.assertIn('homebase_stage_duration_seconds_count{view="sensordata-list",stage="write"} 2', body)
+        self.assertIn('homebase_rows_returned_bucket{view="sensors-get-data",le="2.0"} 1', body)
+        self.assertIn('homebase_request_duration_seconds_bucket{view="sensordata-list",method="POST",status="201",le="+Inf"} 2', body)
+
     def test_api_get_data_for_sensor(self):
         sensor = self.create_sensor()
         sensor.register("Test Sensor")
@@ -109,3 +264,897 @@ class SensorTestCase(BaseTest):
         self.assertEqual(response.data["status"], Sensor.SensorStatus.ACTIVE.label)
         self.assertEqual(response.data["name"], "Test Sensor")
         self.assertEqual(response.data["room"], self.room.id)
+
+    def test_api_batch_sensor_data(self):
+        active = self.create_sensor()
+        active.register("Active Sensor")
+        other = self.create_sensor()
+        other.register("Other Sensor")
+        inactive = self.create_sensor()
+        payload = [
+            {"identifier": active.identifier, "data": {"temperature": 25}},
+            {"identifier": other.identifier, "data": {"temperature": 20}, "timestamp": "2024-06-01T12:00:00Z"},
+            {"identifier": inactive.identifier, "data": {"temperature": 30}},
+            {"identifier": "does-not-exist", "data": {"temperature": 30}},
+            {"identifier": active.identifier, "data": "not an object"},
+        ]
+        # The lookup, then the INSERT and the latest values upsert in a savepoint
+        with self.assertNumQueries(5):
+            response = self.client.post("/sensordata/batch/", payload, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["created"], 2)
+        self.assertEqual(response.data["rejected"], 3)
+        statuses = [r["status"] for r in response.data["results"]]
+        self.assertEqual(statuses, ["created", "created", "inactive", "unknown", "invalid"])
+        self.assertEqual(SensorData.objects.count(), 2)
+        self.assertEqual(active.data.get().data, {"temperature": 25})
+        self.assertEqual(other.data.get().timestamp.isoformat(), "2024-06-01T12:00:00+00:00")
+        self.assertEqual(response.data["results"][1]["id"], other.data.get().id)
+
+    def test_api_batch_sensor_data_rejects_non_list(self):
+        response = self.client.post("/sensordata/batch/", {"identifier": "x"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_api_create_sensor_data_unknown_sensor(self):
+        response = self.client.post("/sensordata/", {"identifier": "does-not-exist", "data": {"temperature": 25}}, format="json")
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(SENSOR_DATA_SCHEMAS={"temperature": {"temperature": "number", "humidity": "number?"}})
+    def test_api_fast_ingest(self):
+        sensor = self.create_sensor("temperature")
+        post = lambda body: self.client.post("/sensordata/fast/", body, content_type="application/json")
+        self.assertEqual(post({"identifier": sensor.identifier, "data": {"temperature": 25}}).status_code, 403)
+        self.assertEqual(post({"identifier": "does-not-exist", "data": {"temperature": 25}}).status_code, 404)
+        self.assertEqual(post("not json").status_code, 400)
+
+        sensor.register("Test Sensor")
+        for data in ({"humidity": 40}, {"temperature": "warm"}, {"temperature": 25, "humidity": True}, [25]):
+            response = post({"identifier": sensor.identifier, "data": data})
+            self.assertEqual(response.status_code, 400, data)
+        self.assertEqual(SensorData.objects.count(), 0)
+
+        # The INSERT and the latest values upsert, in a savepoint
+        with self.assertNumQueries(4):
+            response = post({"identifier": sensor.identifier, "data": {"temperature": 25.5, "battery": "ok"}})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response.content, b"")
+        reading = SensorData.objects.get()
+        self.assertEqual((reading.sensor_id, reading.data), (sensor.id, {"temperature": 25.5, "battery": "ok"}))
+        self.assertIsNotNone(reading.timestamp)
+        self.assertEqual(self.client.get("/sensordata/fast/").status_code, 405)
+
+    @override_settings(DATABASE_MODE="embedded")
+    def test_embedded_database_mode(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "embedded.sqlite3")
+            writer = DatabaseWrapper({**connection.settings_dict, "NAME": path}, alias="default")
+            reader = DatabaseWrapper({**connection.settings_dict, "NAME": path}, alias=READ_ALIAS)
+            try:
+                with writer.cursor() as cursor:
+                    self.assertEqual(cursor.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+                    self.assertEqual(cursor.execute("PRAGMA busy_timeout").fetchone()[0], 5000)
+                    cursor.execute("CREATE TABLE t (x integer)")
+                with reader.cursor() as cursor:
+                    self.assertEqual(cursor.execute("PRAGMA query_only").fetchone()[0], 1)
+                    self.assertEqual(cursor.execute("SELECT count(*) FROM t").fetchone()[0], 0)
+            finally:
+                writer.close()
+                reader.close()
+
+        router = ReadReplicaRouter()
+        self.assertEqual(router.db_for_write(Sensor), "default")
+        # Tests run in a transaction, where reads must see its writes
+        self.assertEqual(router.db_for_read(Sensor), "default")
+        with mock.patch.object(connection, "in_atomic_block", False):
+            self.assertEqual(router.db_for_read(Sensor), READ_ALIAS)
+        self.assertFalse(router.allow_migrate(READ_ALIAS, "sensors"))
+
+    def test_sensor_cache(self):
+        sensor = self.create_sensor()
+        self.client.post("/sensordata/", {"identifier": sensor.identifier, "data": {"temperature": 25}}, format="json")
+        self.assertEqual(sensor_cache.get(sensor.identifier).status, Sensor.SensorStatus.UNREGISTERED)
+
+        # Registering invalidates the cached status
+        sensor.register("Test Sensor")
+        response = self.client.post("/sensordata/", {"identifier": sensor.identifier, "data": {"temperature": 25}}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["sensor"], sensor.id)
+
+        # Steady state ingest only writes: the INSERT and the latest values upsert, in a savepoint here
+        with self.assertNumQueries(4):
+            response = self.client.post("/sensordata/", {"identifier": sensor.identifier, "data": {"temperature": 26}}, format="json")
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get("/sensors/cache/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["hits"], 2)
+        self.assertEqual(response.data["misses"], 2)
+
+        # A lookup between a save and its commit reads the old row, it is dropped on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            stale = Sensor.objects.get(id=sensor.id)
+            sensor.status = Sensor.SensorStatus.INACTIVE
+            sensor.save()
+            sensor_cache.put(stale)
+        self.assertEqual(sensor_cache.get(sensor.identifier).status, Sensor.SensorStatus.INACTIVE)
+
+        sensor.delete()
+        self.assertIsNone(sensor_cache.get(sensor.identifier))
+
+    def test_sensor_cache_eviction(self):
+        cache = SensorCache(max_size=2, ttl=60)
+        sensors = [self.create_sensor() for _ in range(3)]
+        cache.get_many([s.identifier for s in sensors[:2]])
+        cache.get(sensors[0].identifier)  # most recently used
+        cache.get(sensors[2].identifier)
+        self.assertEqual(cache.stats()["size"], 2)
+        with self.assertNumQueries(0):
+            cache.get(sensors[0].identifier)
+        with self.assertNumQueries(1):
+            cache.get(sensors[1].identifier)
+
+    def test_last_seen_write_behind(self):
+        first, second = self.create_sensor(), self.create_sensor()
+        first.register("First")
+        second.register("Second")
+        self.client.post("/sensordata/", {"identifier": first.identifier, "data": {"temperature": 25}}, format="json")
+        self.client.post("/sensordata/batch/", [
+            {"identifier": second.identifier, "data": {"temperature": 20}, "timestamp": "2024-06-01T12:00:00Z"},
+            {"identifier": second.identifier, "data": {"temperature": 21}, "timestamp": "2024-06-01T12:05:00Z"},
+            {"identifier": second.identifier, "data": {"temperature": 19}, "timestamp": "2024-06-01T11:55:00Z"},
+        ], format="json")
+
+        # Nothing is written until the flush
+        first.refresh_from_db()
+        self.assertIsNone(first.last_seen)
+        self.assertEqual(len(last_seen_tracker.pending()), 2)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(last_seen_tracker.flush(), 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.last_seen, first.data.get().timestamp)
+        self.assertEqual(second.last_seen.isoformat(), "2024-06-01T12:05:00+00:00")
+
+        # Older readings never move last_seen backwards
+        last_seen_tracker.touch(second.id, second.last_seen - datetime.timedelta(hours=1))
+        last_seen_tracker.flush()
+        second.refresh_from_db()
+        self.assertEqual(second.last_seen.isoformat(), "2024-06-01T12:05:00+00:00")
+
+        response = self.client.get(f"/sensors/{second.id}/")
+        self.assertIsNotNone(response.data["last_seen"])
+
+    def create_readings(self, sensor, readings):
+        start = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+        SensorData.objects.bulk_create([
+            SensorData(sensor=sensor, data=data, timestamp=start + datetime.timedelta(seconds=offset))
+            for offset, data in readings
+        ])
+
+    def test_api_get_data_bucketed(self):
+        sensor = self.create_sensor()
+        sensor.register("Test Sensor")
+        self.create_readings(sensor, [
+            (0, {"temperature": 20, "label": "a"}),
+            (30, {"temperature": 22, "label": "b"}),
+            (90, {"temperature": 30, "label": "c"}),
+            (400, {"temperature": 10, "label": "d"}),
+        ])
+
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {"bucket": "1m"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["agg"], "avg")
+        self.assertEqual(
+            [(p["timestamp"].isoformat(), p["data"]) for p in response.data["results"]],
+            [
+                ("2024-06-01T00:00:00+00:00", {"temperature": 21}),
+                ("2024-06-01T00:01:00+00:00", {"temperature": 30}),
+                ("2024-06-01T00:06:00+00:00", {"temperature": 10}),
+            ],
+        )
+
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {"bucket": "5m", "agg": "max"})
+        self.assertEqual([p["data"]["temperature"] for p in response.data["results"]], [30, 10])
+
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {"bucket": "5m", "agg": "count", "end": "2024-06-01T00:05:00Z"})
+        self.assertEqual([p["data"]["temperature"] for p in response.data["results"]], [3])
+
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {"bucket": "5m", "agg": "last"})
+        self.assertEqual([p["data"]["label"] for p in response.data["results"]], ["c", "d"])
+
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {"bucket": "2m"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rollups(self):
+        sensor = self.create_sensor()
+        sensor.register("Test Sensor")
+        self.create_readings(sensor, [
+            (0, {"temperature": 20, "label": "a"}),
+            (30, {"temperature": 22}),
+            (90, {"temperature": 30}),
+            (3700, {"temperature": 10}),
+        ])
+        out = io.StringIO()
+        call_command("rollup_sensordata", stdout=out)
+        self.assertIn("Rolled up 4 readings", out.getvalue())
+        self.assertEqual(RollupWatermark.current().last_id, SensorData.objects.latest("id").id)
+
+        minute = SensorRollup.objects.get(sensor=sensor, resolution=SensorRollup.Resolution.MINUTE, key="temperature", bucket="2024-06-01T00:00:00Z")
+        self.assertEqual((minute.min, minute.max, minute.sum, minute.count), (20, 22, 42, 2))
+        day = SensorRollup.objects.get(sensor=sensor, resolution=SensorRollup.Resolution.DAY, key="temperature")
+        self.assertEqual((day.min, day.max, day.sum, day.count), (10, 30, 82, 4))
+        self.assertFalse(SensorRollup.objects.filter(key="label").exists())
+
+        # Only the buckets written to are looked up, not the ones between them
+        minutes = SensorRollup.objects.filter(sensor=sensor, resolution=SensorRollup.Resolution.MINUTE).order_by("bucket")
+        first, last = minutes[0], minutes.last()
+        groups = {(sensor.id, r.resolution, r.key, int(r.bucket.timestamp())): None for r in (first, last)}
+        with mock.patch("sensors.rollups.ROLLUP_LOOKUP_SIZE", 1), self.assertNumQueries(2):
+            self.assertEqual({r.id for r in rollups._existing_rollups(groups)}, {first.id, last.id})
+
+        # New readings are merged into the existing buckets
+        self.create_readings(sensor, [(10, {"temperature": 40})])
+        self.assertEqual(update_rollups(), 1)
+        self.assertEqual(update_rollups(), 0)
+        day.refresh_from_db()
+        self.assertEqual((day.min, day.max, day.sum, day.count), (10, 40, 122, 5))
+
+        # Where ids can commit out of order, only ids that existed a commit lag ago are rolled up
+        self.create_readings(sensor, [(20, {"temperature": 50})])
+        now = timezone.now()
+        with mock.patch("sensors.rollups.ids_commit_in_order", return_value=False), mock.patch("sensors.rollups.timezone.now") as clock:
+            clock.return_value = now
+            self.assertEqual(update_rollups(), 0)
+            self.create_readings(sensor, [(25, {"temperature": 60})])
+            clock.return_value = now + datetime.timedelta(seconds=61)
+            self.assertEqual(update_rollups(), 1)
+            # Caught up with the horizon, which moves on and has to age again
+            self.assertEqual(update_rollups(), 0)
+            clock.return_value = now + datetime.timedelta(seconds=122)
+            self.assertEqual(update_rollups(), 1)
+        day.refresh_from_db()
+        self.assertEqual((day.max, day.count), (60, 7))
+
+    def test_api_get_data_bucketed_uses_rollups(self):
+        sensor = self.create_sensor()
+        sensor.register("Test Sensor")
+        self.create_readings(sensor, [(0, {"temperature": 20}), (30, {"temperature": 22}), (3700, {"temperature": 10})])
+        update_rollups()
+        # Not rolled up yet, served from the raw table
+        self.create_readings(sensor, [(3750, {"temperature": 14})])
+        # Proves the rollups are read: raw rows behind the watermark are gone
+        SensorData.objects.filter(id__lte=RollupWatermark.current().last_id).delete()
+
+        params = {"bucket": "1h", "start": "2024-06-01T00:00:00Z", "end": "2024-06-02T00:00:00Z"}
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {**params, "keys": "temperature"})
+        self.assertEqual(
+            [(p["timestamp"].isoformat(), p["data"]) for p in response.data["results"]],
+            [("2024-06-01T00:00:00+00:00", {"temperature": 21}), ("2024-06-01T01:00:00+00:00", {"temperature": 12})],
+        )
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {**params, "bucket": "1d", "agg": "count"})
+        self.assertEqual([p["data"] for p in response.data["results"]], [{"temperature": 4}])
+        # No readings left in the range to take the keys from
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {**params, "end": "2024-06-01T01:00:00Z"})
+        self.assertEqual([p["data"] for p in response.data["results"]], [{"temperature": 21}])
+
+        # An unaligned range falls back to the raw table
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {**params, "start": "2024-06-01T00:00:30Z"})
+        self.assertEqual([p["data"] for p in response.data["results"]], [{"temperature": 14}])
+
+    def test_api_dashboard_summary(self):
+        kitchen = self.create_sensor("temperature")
+        kitchen.register("Kitchen")
+        kitchen.add_to_room(self.room)
+        self.create_readings(kitchen, [(90000, {"temperature": 20}), (90060, {"temperature": 22})])
+        old = self.create_sensor("temperature")
+        old.register("Old")
+        self.create_readings(old, [(0, {"temperature": 10}), (30, {"temperature": 11})])
+        retired = self.create_sensor("temperature")
+        self.create_readings(retired, [(90000, {"temperature": 5})])
+        compact_readings(datetime.datetime(2024, 6, 2, tzinfo=datetime.timezone.utc), require_rollups=False)
+        # Readings written outside ingest, and compacted ones, are picked up by a rebuild
+        call_command("rebuild_sensorlatest", stdout=io.StringIO())
+        quiet = self.create_sensor("door")
+        quiet.register("Quiet")
+        new = self.create_sensor("door")
+        retired.status = Sensor.SensorStatus.INACTIVE
+        retired.save()
+
+        with self.assertNumQueries(3):
+            response = self.client.get("/dashboard/summary/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["rooms"], [{"id": self.room.id, "name": "Test Room"}])
+        groups = [(g["room"], g["status"], [s["id"] for s in g["sensors"]]) for g in response.data["groups"]]
+        self.assertEqual(groups, [
+            (self.room.id, "Active", [kitchen.id]),
+            (None, "Active", [old.id, quiet.id]),
+            (None, "Inactive", [retired.id]),
+            (None, "Unregistered", [new.id]),
+        ])
+        latest = {s["id"]: s["latest"] for g in response.data["groups"] for s in g["sensors"]}
+        self.assertEqual(latest[kitchen.id]["data"], {"temperature": 22})
+        self.assertEqual(latest[old.id]["data"], {"temperature": 11})
+        self.assertEqual(latest[old.id]["timestamp"].isoformat(), "2024-06-01T00:00:30+00:00")
+        self.assertIsNone(latest[quiet.id])
+        self.assertIsNone(latest[new.id])
+        # Has values, but only active sensors' are embedded
+        self.assertIsNone(latest[retired.id])
+
+    def test_sensor_latest(self):
+        sensor = self.create_sensor("climate")
+        sensor.register("Climate")
+        sensor.add_to_room(self.room)
+        other = self.create_sensor()
+        other.register("Other")
+        post = lambda sensor, data, timestamp: self.client.post(
+            "/sensordata/batch/", [{"identifier": sensor.identifier, "data": data, "timestamp": timestamp}], format="json"
+        )
+        post(sensor, {"temperature": 21, "humidity": 40}, "2024-06-01T12:00:00Z")
+        post(sensor, {"temperature": 22}, "2024-06-01T12:05:00Z")
+        # Late readings never move a value backwards
+        post(sensor, {"temperature": 15, "humidity": 50}, "2024-06-01T11:00:00Z")
+        self.client.post("/sensordata/", {"identifier": other.identifier, "data": {"temperature": 19}}, format="json")
+
+        response = self.client.get("/sensors/latest/", {"room": self.room.id})
+        self.assertEqual(response.status_code, 200)
+        results = [(r["key"], r["value"], r["timestamp"].isoformat()) for r in response.data["results"]]
+        self.assertEqual(results, [("humidity", 40, "2024-06-01T12:00:00+00:00"), ("temperature", 22, "2024-06-01T12:05:00+00:00")])
+        response = self.client.get("/sensors/latest/", {"key": "temperature"})
+        self.assertEqual([(r["sensor"], r["value"]) for r in response.data["results"]], [(sensor.id, 22), (other.id, 19)])
+        self.assertEqual(self.client.get("/sensors/latest/", {"room": "x"}).status_code, 400)
+
+        # Embedded on request only, and then not served from the versioned cache
+        response = self.client.get("/sensors/")
+        self.assertNotIn("latest", response.data["results"][0])
+        self.assertIn("ETag", response)
+        with self.assertNumQueries(3):
+            response = self.client.get("/sensors/?latest")
+        self.assertNotIn("ETag", response)
+        self.assertEqual(response.data["results"][0]["latest"]["data"], {"humidity": 40, "temperature": 22})
+        self.assertEqual(response.data["results"][1]["latest"]["data"], {"temperature": 19})
+        response = self.client.get(f"/sensors/{sensor.id}/?latest")
+        self.assertEqual(response.data["latest"]["timestamp"].isoformat(), "2024-06-01T12:05:00+00:00")
+
+    def test_api_query(self):
+        kitchen, hall = self.room, Room.objects.create(name="Hall")
+        first, second, third = self.create_sensor(), self.create_sensor(), self.create_sensor("door")
+        first.add_to_room(kitchen)
+        second.add_to_room(kitchen)
+        third.add_to_room(hall)
+        self.create_readings(first, [(0, {"temperature": 20}), (60, {"temperature": 22})])
+        self.create_readings(second, [(0, {"temperature": 24}), (30, {"temperature": 26, "label": "x"})])
+        self.create_readings(third, [(60, {"temperature": 10})])
+
+        response = self.client.get("/sensordata/query/", {"key": "temperature", "bucket": "1m", "room": kitchen.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(p["timestamp"].isoformat(), p["data"]) for p in response.data["results"]],
+            [
+                ("2024-06-01T00:00:00+00:00", {str(first.id): 20, str(second.id): 25}),
+                ("2024-06-01T00:01:00+00:00", {str(first.id): 22}),
+            ],
+        )
+
+        response = self.client.get("/sensordata/query/", {"key": "temperature", "bucket": "1h", "group": "room", "agg": "max"})
+        self.assertEqual(response.data["names"], {str(kitchen.id): "Test Room", str(hall.id): "Hall"})
+        self.assertEqual(response.data["results"][0]["data"], {str(kitchen.id): 26, str(hall.id): 10})
+        # Sensors of a group queried in separate chunks still make one series
+        with mock.patch("sensors.aggregation.COMPARE_CHUNK_SIZE", 1):
+            response = self.client.get("/sensordata/query/", {"key": "temperature", "bucket": "1h", "group": "room"})
+        self.assertEqual(response.data["results"][0]["data"], {str(kitchen.id): 23, str(hall.id): 10})
+
+        # Rolled up readings are read from the rollups
+        update_rollups()
+        SensorData.objects.all().delete()
+        response = self.client.get(
+            "/sensordata/query/",
+            {"key": "temperature", "bucket": "1m", "group": "all", "sensor_type": "Test Type", "format": "columnar"},
+        )
+        meta, columns = columnar.decode(response.content)
+        self.assertEqual(meta["group"], "all")
+        self.assertEqual(columns["all"], [70 / 3, 22])
+
+        response = self.client.get("/sensordata/query/", {"key": "temperature", "bucket": "1m", "agg": "last"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_typed_storage(self):
+        sensor = self.create_sensor()
+        sensor.register("Test Sensor")
+        self.create_readings(sensor, [(0, {"temperature": 20, "label": "a"}), (30, {"temperature": 22, "open": True})])
+        self.assertEqual(SensorReading.objects.count(), 0)
+
+        with override_settings(SENSOR_DATA_TYPED_STORAGE=True):
+            out = io.StringIO()
+            call_command("backfill_sensorreadings", stdout=out)
+            self.assertIn("Backfilled 2 readings", out.getvalue())
+            self.client.post("/sensordata/", {"identifier": sensor.identifier, "data": {"temperature": 30}}, format="json")
+            self.client.post(
+                "/sensordata/batch/",
+                [{"identifier": sensor.identifier, "data": {"temperature": 10, "humidity": 40}, "timestamp": "2024-06-01T00:01:00Z"}],
+                format="json",
+            )
+            call_command("backfill_sensorreadings", stdout=io.StringIO())
+            self.assertEqual(
+                sorted(SensorReading.objects.values_list("key__name", "value")),
+                [("humidity", 40), ("temperature", 10), ("temperature", 20), ("temperature", 22), ("temperature", 30)],
+            )
+
+            # Proves aggregates read the typed values
+            SensorData.objects.update(data={})
+            response = self.client.get(
+                f"/sensors/{sensor.id}/data/", {"bucket": "1m", "keys": "temperature,humidity", "end": "2024-06-01T00:05:00Z"}
+            )
+            self.assertEqual(
+                [p["data"] for p in response.data["results"]],
+                [{"temperature": 21}, {"temperature": 10, "humidity": 40}],
+            )
+
+        SensorData.objects.all().delete()
+        self.assertEqual(SensorReading.objects.count(), 0)
+
+    @override_settings(SENSOR_DATA_TYPED_STORAGE=True)
+    def test_typed_storage_rollback(self):
+        sensor = self.create_sensor()
+        sensor.register("Test Sensor")
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            save_readings([SensorData(sensor_id=sensor.id, data={"temperature": 20})])
+            raise RuntimeError
+        self.assertFalse(DataKey.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            save_readings([SensorData(sensor_id=sensor.id, data={"temperature": 21})])
+        self.assertEqual(list(SensorReading.objects.values_list("key__name", "value")), [("temperature", 21)])
+        # Committed keys are cached
+        with self.assertNumQueries(0):
+            key_registry.intern({"temperature"})
+
+    def test_chunk_encoding(self):
+        start = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+        rows = [
+            (i * 3 + 7, start + datetime.timedelta(seconds=i * 2, microseconds=i * i % 997), data)
+            for i, data in enumerate([
+                {"temperature": 20.5, "count": 1, "label": "a"},
+                {"temperature": 20.5, "count": -3},
+                {"temperature": 20.25, "count": 2 ** 40, "open": True},
+                {"count": 0, "temperature": 1e-300, "nested": {"a": [1, 2]}},
+                {"temperature": -7.125, "mixed": 1.5},
+                {"mixed": 2, "temperature": float(2 ** 60)},
+                ["not", "a", "dict"],
+                {},
+            ])
+        ]
+        self.assertEqual(chunks.decode_chunk(chunks.encode_chunk(rows)), rows)
+        self.assertEqual(chunks.decode_chunk(chunks.encode_chunk([])), [])
+
+    def test_compaction(self):
+        sensor = self.create_sensor()
+        sensor.register("Test Sensor")
+        day = 24 * 60 * 60
+        self.create_readings(sensor, [
+            (offset, {"temperature": 20 + offset % 7, "label": str(offset)}) for offset in range(0, 2 * day, 3600)
+        ])
+        update_rollups()
+        self.create_readings(sensor, [(2 * day + 60, {"temperature": 30})])
+
+        def snapshot():
+            url = f"/sensors/{sensor.id}/data/"
+            pages, response = [], self.client.get(url, {"limit": 7})
+            while True:
+                pages += response.data["results"]
+                if not response.data["next"]:
+                    break
+                response = self.client.get(response.data["next"])
+            export = self.client.get("/sensordata/export/", {"sensor": sensor.id})
+            return (
+                [(r["id"], r["timestamp"], r["data"]) for r in pages],
+                b"".join(export.streaming_content),
+                self.client.get(url, {"bucket": "5m", "start": "2024-06-01T00:00:30Z"}).data["results"],
+                self.client.get(url, {"bucket": "1h", "agg": "last"}).data["results"],
+                self.client.get(url, {"after_id": pages[20]["id"], "end": "2024-06-02T12:00:00Z"}).data["results"],
+            )
+
+        before = snapshot()
+        compacted = compact_readings(datetime.datetime(2024, 6, 3, tzinfo=datetime.timezone.utc), window=day)
+        self.assertEqual(compacted, (48, 2))
+        self.assertEqual(SensorData.objects.count(), 1)
+        self.assertEqual(SensorChunk.objects.count(), 2)
+        self.assertEqual(snapshot(), before)
+
+        # A late reading is merged into its chunk by the next run
+        self.create_readings(sensor, [(120, {"temperature": 25})])
+        update_rollups()
+        self.assertEqual(compact_readings(datetime.datetime(2024, 6, 3, tzinfo=datetime.timezone.utc), window=day), (1, 1))
+        self.assertEqual(SensorChunk.objects.get(start="2024-06-01T00:00:00Z").count, 25)
+
+        report = apply_retention({"default": {"raw": 1}}, now=datetime.datetime(2024, 6, 3, tzinfo=datetime.timezone.utc))
+        self.assertEqual(report.deleted["raw"], 25)
+        self.assertEqual(SensorChunk.objects.count(), 1)
+
+    @override_settings(SENSOR_DATA_TYPED_STORAGE=True)
+    def test_retention(self):
+        temp, door = self.create_sensor("temperature"), self.create_sensor("door")
+        now = timezone.now()
+        for sensor in (temp, door):
+            # With typed values, which are deleted along but not counted
+            save_readings([
+                SensorData(sensor=sensor, data={"value": 1}, timestamp=now - datetime.timedelta(days=days))
+                for days in (1, 10, 40)
+            ])
+        update_rollups()
+        # Not rolled up yet, so kept despite its age
+        SensorData.objects.create(sensor=temp, data={"value": 1}, timestamp=now - datetime.timedelta(days=50))
+
+        retention = {"default": {"raw": 7, "minute": 30}, "door": {"raw": 30}}
+        report = apply_retention(retention, dry_run=True, now=now)
+        self.assertEqual(report.deleted["raw"], 3)
+        self.assertEqual(SensorData.objects.count(), 7)
+
+        report = apply_retention(retention, chunk_size=1, now=now)
+        self.assertEqual(report.deleted, {"raw": 3, "minute": 2, "hour": 0, "day": 0})
+        self.assertEqual(temp.data.count(), 2)
+        self.assertEqual(door.data.count(), 2)
+        self.assertFalse(SensorRollup.objects.filter(resolution=SensorRollup.Resolution.MINUTE, bucket__lt=now - datetime.timedelta(days=30)).exists())
+        self.assertEqual(SensorRollup.objects.filter(resolution=SensorRollup.Resolution.HOUR).count(), 6)
+
+        report = apply_retention(retention, require_rollups=False, now=now)
+        self.assertEqual(report.deleted["raw"], 1)
+
+    def test_prune_command(self):
+        out = io.StringIO()
+        call_command("prune_sensordata", "--dry-run", stdout=out)
+        self.assertIn("Would delete 0 rows", out.getvalue())
+
+    def test_api_get_data_cursor_pagination(self):
+        sensor = self.create_sensor()
+        sensor.register("Test Sensor")
+        # Same timestamp for several rows, so ties are broken on id
+        self.create_readings(sensor, [(offset // 2, {"temperature": offset}) for offset in range(10)])
+
+        seen = []
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {"limit": 3})
+        seen += [r["data"]["temperature"] for r in response.data["results"]]
+        # A reading inserted before the cursor does not shift later pages
+        self.create_readings(sensor, [(0, {"temperature": -1})])
+        while response.data["next"]:
+            response = self.client.get(response.data["next"])
+            self.assertEqual(response.status_code, 200)
+            seen += [r["data"]["temperature"] for r in response.data["results"]]
+        self.assertEqual(seen, list(range(10)))
+
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"cursor": ["Invalid cursor"]})
+
+    def test_api_export(self):
+        first, second, other = self.create_sensor(), self.create_sensor(), self.create_sensor()
+        first.add_to_room(self.room)
+        second.add_to_room(self.room)
+        for sensor in (first, second, other):
+            self.create_readings(sensor, [(0, {"temperature": sensor.id}), (60, {"temperature": sensor.id})])
+
+        response = self.client.get("/sensordata/export/", {"room": self.room.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line["sensor"] for line in lines], [first.id, first.id, second.id, second.id])
+        self.assertEqual(lines[0]["data"], {"temperature": first.id})
+        self.assertEqual(lines[0]["timestamp"], "2024-06-01T00:00:00+00:00")
+
+        response = self.client.get("/sensordata/export/", {"sensor": [first.id, other.id], "start": "2024-06-01T00:00:30Z", "format": "csv"})
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual([int(r["sensor"]) for r in rows], [first.id, other.id])
+        self.assertEqual(json.loads(rows[1]["data"]), {"temperature": other.id})
+
+        response = self.client.get("/sensordata/export/", {"room": "kitchen"})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_api_export_asgi(self):
+        sensor = await sync_to_async(self.create_sensor)()
+        await sync_to_async(self.create_readings)(sensor, [(offset, {"temperature": offset}) for offset in range(1200)])
+        response = await self.async_client.get("/sensordata/export/", {"sensor": sensor.id})
+        self.assertEqual(response.status_code, 200)
+        # Streamed chunk by chunk rather than read in full first
+        self.assertTrue(hasattr(response.streaming_content, "__anext__"))
+        parts = [part async for part in response.streaming_content]
+        self.assertEqual(len(parts), 3)
+        lines = b"".join(parts).decode().splitlines()
+        self.assertEqual([json.loads(line)["data"]["temperature"] for line in lines], list(range(1200)))
+
+    def test_api_get_data_columnar(self):
+        sensor = self.create_sensor()
+        sensor.register("Test Sensor")
+        self.create_readings(sensor, [
+            (0, {"temperature": 20.5, "label": "a"}),
+            (1.5, {"temperature": 21, "humidity": 40}),
+            (60, {"temperature": 22}),
+        ])
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {"format": "columnar", "limit": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/vnd.homebase.columnar")
+        meta, columns = columnar.decode(response.content)
+        self.assertIsNotNone(meta["next"])
+        self.assertEqual(columns["timestamp"][1].isoformat(), "2024-06-01T00:00:01.500000+00:00")
+        self.assertEqual(columns["temperature"], [20.5, 21])
+        self.assertTrue(math.isnan(columns["humidity"][0]))
+        self.assertEqual(columns["humidity"][1], 40)
+        self.assertNotIn("label", columns)
+
+        response = self.client.get(
+            f"/sensors/{sensor.id}/data/", {"bucket": "1m"}, HTTP_ACCEPT="application/vnd.homebase.columnar"
+        )
+        meta, columns = columnar.decode(response.content)
+        self.assertEqual(meta, {"bucket": "1m", "agg": "avg"})
+        self.assertEqual(columns["temperature"], [20.75, 22])
+
+    def test_api_get_data_incremental(self):
+        sensor = self.create_sensor()
+        sensor.register("Test Sensor")
+        self.create_readings(sensor, [(0, {"temperature": 1}), (60, {"temperature": 2})])
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {"format": "columnar"})
+        _, columns = columnar.decode(response.content)
+        self.assertEqual(len(columns["id"]), 2)
+        last_id = columns["id"][-1]
+
+        # A reading with the same timestamp as the last one held is still picked up
+        self.create_readings(sensor, [(60, {"temperature": 3}), (120, {"temperature": 4})])
+        response = self.client.get(
+            f"/sensors/{sensor.id}/data/", {"start": "2024-06-01T00:01:00Z", "after_id": last_id}
+        )
+        self.assertEqual([r["data"]["temperature"] for r in response.data["results"]], [3, 4])
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {"since": "2024-06-01T00:01:00Z"})
+        self.assertEqual([r["data"]["temperature"] for r in response.data["results"]], [4])
+
+        response = self.client.get(f"/sensors/{sensor.id}/data/", {"after_id": "latest"})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_async_ingest(self):
+        response = await self.async_client.post("/ingest/sensors/", {"identifier": "async-sensor", "sensor_type": "temperature"}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        sensor = await Sensor.objects.aget(identifier="async-sensor")
+        self.assertEqual(response.json()["id"], sensor.id)
+
+        response = await self.async_client.post("/ingest/sensordata/", {"identifier": "async-sensor", "data": {"temperature": 25}}, content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+        await sync_to_async(sensor.register)("Async Sensor")
+        response = await self.async_client.post("/ingest/sensordata/", {"identifier": "async-sensor", "data": {"temperature": 25}}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["data"], {"temperature": 25})
+        response = await self.async_client.post("/ingest/sensordata/", {"identifier": "unknown", "data": {}}, content_type="application/json")
+        self.assertEqual(response.status_code, 404)
+        for data in (None, [25], 25):
+            response = await self.async_client.post("/ingest/sensordata/", {"identifier": "async-sensor", "data": data}, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+
+        response = await self.async_client.post("/ingest/sensordata/batch/", [{"identifier": "async-sensor", "data": {"temperature": 26}}], content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["created"], 1)
+        self.assertEqual(await sensor.data.acount(), 2)
+
+        response = await self.async_client.get("/ingest/sensordata/")
+        self.assertEqual(response.status_code, 405)
+
+    async def test_coalescing_writer(self):
+        sensor = await sync_to_async(self.create_sensor)()
+        writer = CoalescingWriter(max_batch=3)
+        with mock.patch("sensors.async_views.save_readings", wraps=save_readings) as bulk_create:
+            readings = await asyncio.gather(*[writer.write(SensorData(sensor=sensor, data={"n": i})) for i in range(7)])
+        # All seven were posted before the first INSERT ran
+        self.assertEqual([len(c.args[0]) for c in bulk_create.call_args_list], [3, 3, 1])
+        self.assertTrue(all(r.id for r in readings))
+        self.assertEqual(await sensor.data.acount(), 7)
+
+    async def test_coalescing_writer_isolates_failed_reading(self):
+        sensor = await sync_to_async(self.create_sensor)()
+        writer = CoalescingWriter()
+
+        def save_valid(readings):
+            if any(r.data is None for r in readings):
+                raise IntegrityError("NOT NULL constraint failed: sensors_sensordata.data")
+            return save_readings(readings)
+
+        with mock.patch("sensors.async_views.save_readings", side_effect=save_valid):
+            with self.assertLogs("sensors.async_views", "WARNING"):
+                results = await asyncio.gather(
+                    *[writer.write(SensorData(sensor=sensor, data=data)) for data in ({"n": 0}, None, {"n": 2})],
+                    return_exceptions=True,
+                )
+        self.assertIsInstance(results[1], IntegrityError)
+        self.assertEqual([r.data for r in (results[0], results[2])], [{"n": 0}, {"n": 2}])
+        self.assertEqual(await sensor.data.acount(), 2)
+
+    @override_settings(SENSOR_LAST_SEEN_MAX_STALENESS=0)
+    async def test_coalescing_writer_flushes_last_seen(self):
+        sensor = await sync_to_async(self.create_sensor)()
+        writer = CoalescingWriter()
+        # Every touch is stale and flushes inline, which has to happen off the event loop
+        reading = await asyncio.wait_for(writer.write(SensorData(sensor=sensor, data={"n": 1})), timeout=5)
+        for _ in range(100):
+            await sensor.arefresh_from_db()
+            if sensor.last_seen is not None:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(sensor.last_seen, reading.timestamp)
+
+    def test_ingest_queue(self):
+        sensor = self.create_sensor()
+        journal = os.path.join(tempfile.mkdtemp(), "journal.ndjson")
+        ingest_queue = IngestQueue(max_size=2, batch_size=2, flush_interval=0, journal_path=journal)
+        results = [ingest_queue.put(SensorData(sensor_id=sensor.id, data={"n": i})) for i in range(3)]
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(ingest_queue.stats()["depth"], 2)
+        self.assertTrue(os.path.exists(journal))
+
+        self.assertEqual(ingest_queue.drain(), 2)
+        self.assertEqual(ingest_queue.replay_journal(), 1)
+        self.assertFalse(os.path.exists(journal))
+        self.assertEqual(sorted(r.data["n"] for r in sensor.data.all()), [0, 1, 2])
+        self.assertEqual(last_seen_tracker.pending()[sensor.id], sensor.data.latest("timestamp").timestamp)
+
+        stats = ingest_queue.stats()
+        self.assertEqual((stats["enqueued"], stats["spilled"], stats["replayed"], stats["written"]), (2, 1, 1, 3))
+        self.assertEqual(stats["batches"], 2)
+
+    def test_ingest_queue_failed_batch_is_journaled(self):
+        journal = os.path.join(tempfile.mkdtemp(), "journal.ndjson")
+        ingest_queue = IngestQueue(max_size=10, batch_size=10, flush_interval=0, journal_path=journal)
+        ingest_queue.put(SensorData(sensor_id=self.create_sensor().id, data={"n": 1}))
+        with mock.patch.object(SensorData.objects, "bulk_create", side_effect=Exception("database is locked")):
+            with self.assertLogs("sensors.write_queue", "ERROR"):
+                self.assertEqual(ingest_queue.drain(), 0)
+        self.assertEqual(ingest_queue.stats()["failed_batches"], 1)
+        self.assertEqual(ingest_queue.replay_journal(), 1)
+        self.assertEqual(SensorData.objects.count(), 1)
+
+    def test_ingest_queue_dead_letters_unwritable_readings(self):
+        sensor = self.create_sensor()
+        journal = os.path.join(tempfile.mkdtemp(), "journal.ndjson")
+        ingest_queue = IngestQueue(max_size=10, batch_size=10, flush_interval=0, journal_path=journal)
+        for n in range(3):
+            ingest_queue.put(SensorData(sensor_id=sensor.id, data={"n": n}))
+        ingest_queue.put(SensorData(sensor_id=sensor.id + 1, data={"n": 3}))
+        save_readings = write_queue.save_readings
+
+        # SQLite checks foreign keys at commit, which the test transaction never reaches
+        def save_existing(readings):
+            if any(r.sensor_id != sensor.id for r in readings):
+                raise IntegrityError("FOREIGN KEY constraint failed")
+            save_readings(readings)
+
+        with mock.patch("sensors.write_queue.save_readings", side_effect=save_existing):
+            with self.assertLogs("sensors.write_queue", "ERROR"):
+                self.assertEqual(ingest_queue.drain(), 3)
+        self.assertEqual(sorted(r.data["n"] for r in sensor.data.all()), [0, 1, 2])
+        self.assertFalse(os.path.exists(journal))
+        with open(journal + ".dead") as dead:
+            self.assertEqual([json.loads(line)["data"] for line in dead], [{"n": 3}])
+        stats = ingest_queue.stats()
+        self.assertEqual((stats["written"], stats["failed_batches"], stats["dead_lettered"]), (3, 1, 1))
+        self.assertEqual(stats["last_batch_size"], 3)
+
+    def test_ingest_queue_incomplete_replay_keeps_new_spills(self):
+        sensor = self.create_sensor()
+        journal = os.path.join(tempfile.mkdtemp(), "journal.ndjson")
+        ingest_queue = IngestQueue(max_size=1, batch_size=10, flush_interval=0, journal_path=journal)
+        ingest_queue.put(SensorData(sensor_id=sensor.id, data={"n": 0}))
+        ingest_queue.put(SensorData(sensor_id=sensor.id, data={"n": 1}))
+        with mock.patch.object(SensorData.objects, "bulk_create", side_effect=Exception("database is locked")):
+            with self.assertLogs("sensors.write_queue", "ERROR"):
+                with self.assertRaises(write_queue.JournalReplayError):
+                    ingest_queue.replay_journal()
+        self.assertTrue(os.path.exists(journal + ".replay"))
+
+        # Spilled while the replay was stuck, taken along by the next one
+        ingest_queue.put(SensorData(sensor_id=sensor.id, data={"n": 2}))
+        self.assertEqual(ingest_queue.replay_journal(), 2)
+        self.assertFalse(os.path.exists(journal + ".replay"))
+        self.assertFalse(os.path.exists(journal))
+        self.assertEqual(sorted(r.data["n"] for r in sensor.data.all()), [1, 2])
+
+        # Failed replays back off instead of retrying on every idle tick
+        with mock.patch.object(ingest_queue, "replay_journal", side_effect=write_queue.JournalReplayError("stuck")):
+            with self.assertLogs("sensors.write_queue", "WARNING"):
+                ingest_queue._replay_safely()
+                ingest_queue._replay_safely()
+        self.assertEqual(ingest_queue._replay_backoff, 2 * write_queue.REPLAY_BACKOFF)
+        self.assertGreater(ingest_queue._replay_after, time.monotonic())
+
+    def test_ingest_queue_shared_journal(self):
+        sensor = self.create_sensor()
+        journal = os.path.join(tempfile.mkdtemp(), "journal.ndjson")
+        first = IngestQueue(max_size=1, journal_path=journal)
+        second = IngestQueue(max_size=1, journal_path=journal)
+        for ingest_queue in (first, first, second, second):
+            ingest_queue.put(SensorData(sensor_id=sensor.id, data={"n": 1}))
+        # While one process replays, the others leave the journal alone
+        with write_queue._file_lock(journal + ".replay.lock"):
+            self.assertEqual(second.replay_journal(), 0)
+        self.assertEqual(SensorData.objects.count(), 0)
+        self.assertEqual(first.replay_journal(), 2)
+        self.assertEqual(second.replay_journal(), 0)
+        self.assertEqual(SensorData.objects.count(), 2)
+
+    def test_ingest_queue_writer_survives_errors(self):
+        sensor = self.create_sensor()
+        ingest_queue = IngestQueue(flush_interval=0, journal_path=os.path.join(tempfile.mkdtemp(), "journal.ndjson"))
+        ingest_queue.put(SensorData(sensor_id=sensor.id, data={"n": 1}))
+        with mock.patch.object(last_seen_tracker, "touch_many", side_effect=Exception("database is locked")):
+            with self.assertLogs("sensors.write_queue", "ERROR"):
+                self.assertEqual(ingest_queue.drain(), 1)
+        self.assertEqual(SensorData.objects.count(), 1)
+        self.assertFalse(os.path.exists(ingest_queue.journal_path))
+
+        # A batch that can be neither written nor journaled must not stop the writer thread
+        with mock.patch.object(ingest_queue, "_write", side_effect=OSError("No space left on device")):
+            with self.assertLogs("sensors.write_queue", "ERROR"):
+                ingest_queue.start()
+                for i in range(2):
+                    ingest_queue.put(SensorData(sensor_id=sensor.id, data={"n": i}))
+                    deadline = time.monotonic() + 5
+                    while ingest_queue.stats()["errors"] < i + 2 and time.monotonic() < deadline:
+                        time.sleep(0.01)
+            self.assertTrue(ingest_queue.running)
+            ingest_queue.stop(timeout=5)
+        self.assertEqual(ingest_queue.stats()["errors"], 3)
+
+    @override_settings(SENSOR_INGEST_QUEUE_ENABLED=True)
+    def test_api_create_sensor_data_queued(self):
+        sensor = self.create_sensor()
+        sensor.register("Test Sensor")
+        ingest_queue = IngestQueue(journal_path=os.path.join(tempfile.mkdtemp(), "journal.ndjson"))
+        with mock.patch("sensors.views.get_ingest_queue", return_value=ingest_queue):
+            response = self.client.post("/sensordata/", {"identifier": sensor.identifier, "data": {"temperature": 25}}, format="json")
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.data["status"], "queued")
+            self.assertEqual(SensorData.objects.count(), 0)
+            response = self.client.get("/sensordata/queue/")
+            self.assertEqual(response.data["depth"], 1)
+        ingest_queue.drain()
+        self.assertEqual(sensor.data.get().data, {"temperature": 25})
+
+    @override_settings(SENSOR_LIVE_MAX_DURATION=0.5, SENSOR_LIVE_KEEPALIVE=0.3)
+    async def test_live_stream(self):
+        in_room = await sync_to_async(self.create_sensor)()
+        other = await sync_to_async(self.create_sensor)()
+        for sensor in (in_room, other):
+            await sync_to_async(sensor.register)("Test Sensor")
+        await sync_to_async(in_room.add_to_room)(self.room)
+        post = sync_to_async(self.client.post)
+        await post("/sensordata/", {"identifier": in_room.identifier, "data": {"temperature": 1}}, format="json")
+
+        response = await self.async_client.get("/live/readings/", {"room": self.room.id})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(live_broker.subscriber_count, 1)
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 1000\n\n")
+
+        def parse(chunk):
+            fields = dict(line.split(": ", 1) for line in chunk.decode().strip().splitlines())
+            return fields["event"], json.loads(fields["data"])
+
+        # Replayed from before the subscription
+        event, data = parse(await anext(stream))
+        self.assertEqual(event, "reading")
+        self.assertEqual(data["data"], {"temperature": 1})
+
+        await post("/sensordata/", {"identifier": other.identifier, "data": {"temperature": 2}}, format="json")
+        await post("/sensordata/batch/", [{"identifier": in_room.identifier, "data": {"temperature": 3}}], format="json")
+        _, data = parse(await asyncio.wait_for(anext(stream), 1))
+        self.assertEqual((data["sensor"], data["room"], data["data"]), (in_room.id, self.room.id, {"temperature": 3}))
+
+        # The stream closes itself after SENSOR_LIVE_MAX_DURATION and unsubscribes
+        self.assertTrue(all(chunk == b": keepalive\n\n" for chunk in [chunk async for chunk in stream]))
+        self.assertEqual(live_broker.subscriber_count, 0)
+
+    async def test_live_stream_slow_subscriber(self):
+        sensor = await sync_to_async(self.create_sensor)()
+        cached = await sensor_cache.aget(sensor.identifier)
+        with override_settings(SENSOR_LIVE_QUEUE_SIZE=2):
+            subscription = live_broker.subscribe(sensor_types=["Test Type"])
+        live_broker.publish(cached, [SensorData(sensor=sensor, data={"n": i}) for i in range(3)])
+        await asyncio.sleep(0)
+        self.assertEqual([(await subscription.get(1))["data"]["n"] for _ in range(2)], [1, 2])
+        self.assertEqual(subscription.dropped, 1)
+        subscription.close()
@@ -0,0 +1,94 @@
+"""Typed storage of the numeric values of readings.
+
+With ``SENSOR_DATA_TYPED_STORAGE`` every numeric key of a reading is also written as a
+``SensorReading`` row (sensor, key, timestamp, value), so aggregates scan an index on plain
+columns instead of parsing JSON. ``SensorData.data`` is still written as before.
+"""
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from .aggregation import numeric_keys
+from .latest import update_latest
+from .models import DataKey, SensorData, SensorReading
+
+
+class KeyRegistry:
+    """In-process ``name -> DataKey.id`` map, creating keys the first time they are seen."""
+
+    def __init__(self):
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def intern(self, names):
+        with self._lock:
+            ids = {name: self._ids[name] for name in names if name in self._ids}
+        missing = set(names) - ids.keys()
+        if missing:
+            DataKey.objects.bulk_create([DataKey(name=name) for name in missing], ignore_conflicts=True)
+            found = dict(DataKey.objects.filter(name__in=missing).values_list("name", "id"))
+            ids.update(found)
+            # Keys created in a transaction that rolls back must not stay cached
+            transaction.on_commit(lambda: self._remember(found))
+        return ids
+
+    def _remember(self, ids):
+        with self._lock:
+            self._ids.update(ids)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+key_registry = KeyRegistry()
+
+
+def typed_values(readings):
+    """Unsaved ``SensorReading`` rows for the numeric keys of saved ``SensorData``."""
+    values = []
+    for reading in readings:
+        if isinstance(reading.data, dict):
+            values += [(reading, key, float(reading.data[key])) for key in numeric_keys(reading.data)]
+    key_ids = key_registry.intern({key for _, key, _ in values})
+    return [
+        SensorReading(
+            reading_id=reading.id,
+            sensor_id=reading.sensor_id,
+            key_id=key_ids[key],
+            timestamp=reading.timestamp,
+            value=value,
+        )
+        for reading, key, value in values
+    ]
+
+
+def store_typed(readings):
+    """Write the typed values of saved readings if typed storage is enabled."""
+    if not settings.SENSOR_DATA_TYPED_STORAGE:
+        return
+    SensorReading.objects.bulk_create(typed_values(readings), batch_size=500)
+
+
+def save_readings(readings):
+    """``bulk_create`` readings in one transaction with their latest values, and typed values if enabled."""
+    with transaction.atomic():
+        SensorData.objects.bulk_create(readings)
+        store_typed(readings)
+        update_latest(readings)
+    return readings
+
+
+def backfill_typed(after_id=0, batch_size=5000):
+    """Write typed values for the next ``batch_size`` readings with an id above ``after_id``.
+
+    Returns ``(processed, last_id)``. Values that already exist are skipped, so it is safe to
+    run while ingest writes typed values itself.
+    """
+    with transaction.atomic():
+        readings = list(SensorData.objects.filter(id__gt=after_id).order_by("id")[:batch_size])
+        if not readings:
+            return 0, after_id
+        SensorReading.objects.bulk_create(typed_values(readings), batch_size=500, ignore_conflicts=True)
+    return len(readings), readings[-1].id
@@ -0,0 +1,8 @@
+from rest_framework import routers
+from ..views import DashboardViewSet
+
+
+router = routers.SimpleRouter()
+router.register(r"", DashboardViewSet, basename="dashboard")
+
+urlpatterns = [] + router.urls
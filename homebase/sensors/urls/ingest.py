@@ -0,0 +1,11 @@
+from django.urls import path
+
+from .. import async_views
+
+
+urlpatterns = [
+    path("sensors/", async_views.identify, name="ingest-identify"),
+    path("sensors/batch/", async_views.identify_sensor_batch, name="ingest-identify-batch"),
+    path("sensordata/", async_views.create_sensor_data, name="ingest-sensordata"),
+    path("sensordata/batch/", async_views.create_sensor_data_batch, name="ingest-sensordata-batch"),
+]
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .. import async_views
+
+
+urlpatterns = [
+    path("readings/", async_views.stream_readings, name="live-readings"),
+]
@@ -1,8 +1,13 @@
+from django.urls import path
 from rest_framework import routers
+from .. import fast_ingest
 from ..views import SensorDataViewSet
 
 
 router = routers.SimpleRouter()
 router.register(r"", SensorDataViewSet, basename="sensordata")
 
-urlpatterns = [] + router.urls
\ No newline at end of file
+# Before the router, whose detail route would match "fast/"
+urlpatterns = [
+    path("fast/", fast_ingest.create, name="sensordata-fast"),
+] + router.urls
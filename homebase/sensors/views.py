@@ -1,28 +1,130 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
+from common.conditional import VersionedMixin
+from common.metrics import record_rows, stage
 from rooms.models import Room
-from .models import Sensor, SensorData
-from .serializers import SensorSerializer, SensorDataSerializer
+from rooms.serializers import RoomSerializer
+from .aggregation import AGGREGATES, BUCKETS, compare, downsample
+from .cache import sensor_cache
+from .chunks import chunk_readings, merge_readings
+from .identify import identify_batch, identify_sensors, parse_device
+from .ingest import BatchError, IngestStatus, ingest_batch
+from .last_seen import last_seen_tracker
+from .latest import update_latest
+from .live import live_broker
+from .metrics import record_ingested, record_rejected
+from .models import Sensor, SensorChunk, SensorData, SensorLatest
+from .pagination import SensorDataCursorPagination
+from .renderers import ColumnarRenderer, CSVRenderer, NDJSONRenderer
+from .serializers import (
+    SensorSerializer,
+    SensorDataSerializer,
+    SensorDataIngestSerializer,
+)
+from .typed import store_typed
+from .write_queue import get_ingest_queue
 
 
-class SensorViewSet(viewsets.ModelViewSet):
+# ``last`` is not meaningful across several sensors
+QUERY_AGGREGATES = [agg for agg in AGGREGATES if agg != "last"]
+QUERY_GROUPS = ["sensor", "room", "all"]
+
+
+def parse_range(params, names=("start", "end")):
+    """Parse the optional ``start``/``end`` (or other ``names``) query parameters into aware datetimes."""
+    bounds = []
+    for name in names:
+        value = params.get(name)
+        if value is None:
+            bounds.append(None)
+            continue
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"Invalid {name}: {value}")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        bounds.append(parsed)
+    return tuple(bounds)
+
+
+def _async_iterator(iterator):
+    """Iterate ``iterator`` from the event loop, one item per trip to the request's sync thread.
+
+    Django 4.2's ASGI handler reads a synchronous ``StreamingHttpResponse`` in full before
+    sending any of it.
+    """
+    next_item = sync_to_async(next)
+
+    async def items():
+        while (item := await next_item(iterator, None)) is not None:
+            yield item
+
+    return items()
+
+
+class SensorViewSet(VersionedMixin, viewsets.ModelViewSet):
+    """``?latest`` on the list and details embeds each sensor's latest values."""
     renderer_classes = [JSONRenderer]
     serializer_class = SensorSerializer
     queryset = Sensor.objects.all()
 
-    def create(self, request, *args, **kwargs):
-        sensor_ident = request.data.get("identifier")
-        sensor_type = request.data.get("sensor_type")
+    def embeds_latest(self):
+        return self.action in ("list", "retrieve") and "latest" in self.request.query_params
+
+    def get_queryset(self):
+        if self.embeds_latest():
+            return self.queryset.prefetch_related("latest")
+        return self.queryset
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), "latest": self.embeds_latest()}
+
+    def is_versioned(self, request):
+        # Latest values change with every reading, not with the registry version
+        return not self.embeds_latest()
 
-        sensor, created = Sensor.objects.get_or_create(identifier=sensor_ident, sensor_type=sensor_type)
+    def create(self, request, *args, **kwargs):
+        device = parse_device(request.data)
+        if device is None:
+            return Response(
+                {"error": "identifier and sensor_type are required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        with stage(request, "write"):
+            sensor, created = identify_sensors([device])[device[0]]
         return Response(
             self.serializer_class(sensor).data,
             status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
         )
-    
+
+    @action(
+        methods=["post"],
+        detail=False,
+        url_path="batch",
+        renderer_classes=[
+            JSONRenderer,
+        ],
+    )
+    def batch(self, request):
+        try:
+            with stage(request, "write"):
+                body = identify_batch(request.data)
+        except BatchError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(body, status=status.HTTP_200_OK)
+
     @action(
         methods=["post"],
         detail=True,
@@ -46,26 +148,119 @@ class SensorViewSet(viewsets.ModelViewSet):
             sensor.add_to_room(room_obj)
         return Response(self.serializer_class(sensor, context={"request": request}).data, status=status.HTTP_200_OK)
     
+    @action(
+        methods=["get"],
+        detail=False,
+        url_path="cache",
+        renderer_classes=[
+            JSONRenderer,
+        ],
+    )
+    def cache_stats(self, request):
+        return Response(sensor_cache.stats(), status=status.HTTP_200_OK)
+
+    @action(
+        methods=["get"],
+        detail=False,
+        url_path="latest",
+        renderer_classes=[
+            JSONRenderer,
+        ],
+    )
+    def latest(self, request):
+        """The newest value of each data key of each sensor.
+
+        Filter with ``sensor`` (repeatable), ``room``, ``sensor_type`` and ``key`` (repeatable).
+        """
+        params = request.query_params
+        try:
+            sensor_ids = [int(s) for s in params.getlist("sensor")]
+            room = params.get("room")
+            room = int(room) if room is not None else None
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = SensorLatest.objects.all()
+        if sensor_ids:
+            rows = rows.filter(sensor_id__in=sensor_ids)
+        if room is not None:
+            rows = rows.filter(sensor__room_id=room)
+        if "sensor_type" in params:
+            rows = rows.filter(sensor__sensor_type__in=params.getlist("sensor_type"))
+        if "key" in params:
+            rows = rows.filter(key__in=params.getlist("key"))
+        results = [
+            {"sensor": sensor_id, "room": room_id, "key": key, "value": value, "timestamp": timestamp}
+            for sensor_id, room_id, key, value, timestamp in rows.order_by("sensor_id", "key").values_list(
+                "sensor_id", "sensor__room_id", "key", "value", "timestamp"
+            )
+        ]
+        record_rows(request, len(results))
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
     @action(
         methods=["get"],
         detail=True,
         url_path="data",
         renderer_classes=[
             JSONRenderer,
+            ColumnarRenderer,
         ],
     )
     def get_data(self, request, pk=None):
         sensor = self.get_object()
+
+        if "bucket" in request.query_params:
+            bucket = request.query_params["bucket"]
+            agg = request.query_params.get("agg", "avg")
+            if bucket not in BUCKETS or agg not in AGGREGATES:
+                return Response(
+                    {"error": f"bucket must be one of {', '.join(BUCKETS)} and agg one of {', '.join(AGGREGATES)}"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            try:
+                start, end = parse_range(request.query_params)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            keys = request.query_params.get("keys")
+            keys = keys.split(",") if keys else None
+            with stage(request, "query"):
+                results = downsample(sensor, bucket, agg, keys, start, end)
+            record_rows(request, len(results))
+            return Response({"bucket": bucket, "agg": agg, "results": results}, status=status.HTTP_200_OK)
+
+        try:
+            start, end, since = parse_range(request.query_params, ("start", "end", "since"))
+            after_id = request.query_params.get("after_id")
+            after_id = int(after_id) if after_id is not None else None
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         filts = {}
-        if "start" in request.query_params:
-            filts["timestamp__gte"] = request.query_params["start"]
-        if "end" in request.query_params:
-            filts["timestamp__lte"] = request.query_params["end"]
+        if start is not None:
+            filts["timestamp__gte"] = start
+        if end is not None:
+            filts["timestamp__lte"] = end
+        # For clients that already hold everything up to a timestamp or a reading id
+        if since is not None:
+            filts["timestamp__gt"] = since
+        if after_id is not None:
+            filts["id__gt"] = after_id
         data = sensor.data.filter(**filts)
-        paginated_data = self.paginate_queryset(data)
-        if paginated_data is not None:
-            return self.get_paginated_response(SensorDataSerializer(paginated_data, many=True, context={"request": request}).data)
-        return Response(SensorDataSerializer(data, many=True).data)
+
+        def compacted(position):
+            rows = chunk_readings(
+                sensor.chunks.all(), start=start, end=end, since=since, after_id=after_id, after=position
+            )
+            return (SensorData(id=id_, sensor_id=sensor_id, timestamp=ts, data=values) for id_, sensor_id, ts, values in rows)
+
+        paginator = SensorDataCursorPagination()
+        with stage(request, "query"):
+            page = paginator.paginate_queryset(data, request, view=self, extra=compacted)
+        record_rows(request, len(page))
+        if request.accepted_renderer.format == ColumnarRenderer.format:
+            # The columnar format only carries ids, timestamps and values
+            return paginator.get_paginated_response([{"id": r.id, "timestamp": r.timestamp, "data": r.data} for r in page])
+        return paginator.get_paginated_response(SensorDataSerializer(page, many=True, context={"request": request}).data)
 
 
 class SensorDataViewSet(viewsets.ModelViewSet):
@@ -75,13 +270,224 @@ class SensorDataViewSet(viewsets.ModelViewSet):
 
     def create(self, request, *args, **kwargs):
         sensor_ident = request.data.get("identifier")
-        data = request.data.get("data")
-        sensor = Sensor.objects.get(identifier=sensor_ident)
+        with stage(request, "lookup"):
+            sensor = sensor_cache.get(sensor_ident)
+        if sensor is None:
+            record_rejected(IngestStatus.UNKNOWN)
+            return Response(
+                {"error": "Sensor does not exist"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
         if sensor.status != Sensor.SensorStatus.ACTIVE:
+            record_rejected(IngestStatus.INACTIVE, sensor.id)
             return Response(
                 {"error": "Sensor is not active"},
                 status=status.HTTP_403_FORBIDDEN,
             )
-        request.data["sensor"] = sensor.id
-        request.data["data"] = data
-        return super().create(request, *args, **kwargs)
+        serializer = SensorDataIngestSerializer(data={"data": request.data.get("data")})
+        with stage(request, "validate"):
+            if not serializer.is_valid():
+                record_rejected(IngestStatus.INVALID)
+                raise ValidationError(serializer.errors)
+        if settings.SENSOR_INGEST_QUEUE_ENABLED:
+            reading = SensorData(sensor_id=sensor.id, **serializer.validated_data)
+            with stage(request, "write"):
+                queued = get_ingest_queue().put(reading)
+            record_ingested([sensor.id])
+            live_broker.publish(sensor, [reading])
+            return Response(
+                {"sensor": sensor.id, "timestamp": reading.timestamp, "status": "queued" if queued else "journaled"},
+                status=status.HTTP_202_ACCEPTED,
+            )
+        with stage(request, "write"), transaction.atomic():
+            reading = serializer.save(sensor_id=sensor.id)
+            store_typed([reading])
+            update_latest([reading])
+        record_ingested([sensor.id])
+        last_seen_tracker.touch(sensor.id, reading.timestamp)
+        live_broker.publish(sensor, [reading])
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(
+        methods=["post"],
+        detail=False,
+        url_path="batch",
+        renderer_classes=[
+            JSONRenderer,
+        ],
+    )
+    def batch(self, request):
+        try:
+            body = ingest_batch(request.data)
+        except BatchError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(body, status=status.HTTP_200_OK)
+
+    @action(
+        methods=["get"],
+        detail=False,
+        url_path="export",
+        renderer_classes=[
+            NDJSONRenderer,
+            CSVRenderer,
+        ],
+    )
+    def export(self, request):
+        """Stream readings as NDJSON (default) or CSV, with ``?format=csv`` or an Accept header.
+
+        Filter with ``sensor`` (repeatable), ``room``, ``start`` and ``end``. Under ASGI the
+        rows are streamed through an async iterator.
+        """
+        try:
+            start, end = parse_range(request.query_params)
+            sensor_ids = [int(s) for s in request.query_params.getlist("sensor")]
+            room = request.query_params.get("room")
+            room = int(room) if room is not None else None
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        readings = SensorData.objects.all()
+        if sensor_ids:
+            readings = readings.filter(sensor_id__in=sensor_ids)
+        if room is not None:
+            readings = readings.filter(sensor__room_id=room)
+        if start is not None:
+            readings = readings.filter(timestamp__gte=start)
+        if end is not None:
+            readings = readings.filter(timestamp__lte=end)
+        chunks = SensorChunk.objects.all()
+        if sensor_ids:
+            chunks = chunks.filter(sensor_id__in=sensor_ids)
+        if room is not None:
+            chunks = chunks.filter(sensor__room_id=room)
+        readings = (
+            readings.order_by("sensor_id", "timestamp", "id")
+            .values_list("id", "sensor_id", "timestamp", "data")
+            .iterator(chunk_size=settings.SENSOR_DATA_EXPORT_CHUNK_SIZE)
+        )
+        rows = (
+            {"id": id_, "sensor": sensor_id, "timestamp": timestamp.isoformat(), "data": data}
+            for id_, sensor_id, timestamp, data in merge_readings(readings, chunks, start=start, end=end)
+        )
+
+        renderer = request.accepted_renderer
+        content = renderer.stream(rows)
+        if isinstance(request._request, ASGIRequest):
+            content = _async_iterator(content)
+        response = StreamingHttpResponse(content, content_type=renderer.media_type)
+        response["Content-Disposition"] = f'attachment; filename="sensordata.{renderer.format}"'
+        return response
+
+    @action(
+        methods=["get"],
+        detail=False,
+        url_path="query",
+        renderer_classes=[
+            JSONRenderer,
+            ColumnarRenderer,
+        ],
+    )
+    def query(self, request):
+        """Bucketed series of one data ``key`` across sensors, aligned on the same timestamps.
+
+        Select sensors with ``sensor`` (repeatable), ``room`` and/or ``sensor_type``; with none
+        of them every sensor is included. ``group=sensor`` (default) returns a series per sensor,
+        ``group=room`` one per room and ``group=all`` a single series, averaging over all the
+        readings in the group.
+        """
+        params = request.query_params
+        bucket = params.get("bucket")
+        agg = params.get("agg", "avg")
+        key = params.get("key")
+        group = params.get("group", "sensor")
+        if bucket not in BUCKETS or agg not in QUERY_AGGREGATES or not key or group not in QUERY_GROUPS:
+            return Response(
+                {
+                    "error": f"key is required, bucket must be one of {', '.join(BUCKETS)}, "
+                    f"agg one of {', '.join(QUERY_AGGREGATES)} and group one of {', '.join(QUERY_GROUPS)}"
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            start, end = parse_range(params)
+            sensor_ids = [int(s) for s in params.getlist("sensor")]
+            room = params.get("room")
+            room = int(room) if room is not None else None
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        sensors = Sensor.objects.all()
+        if sensor_ids:
+            sensors = sensors.filter(id__in=sensor_ids)
+        if room is not None:
+            sensors = sensors.filter(room_id=room)
+        if "sensor_type" in params:
+            sensors = sensors.filter(sensor_type__in=params.getlist("sensor_type"))
+        if group == "room":
+            sensors = sensors.filter(room__isnull=False)
+
+        groups, names = {}, {}
+        for id_, name, room_id, room_name in sensors.values_list("id", "name", "room_id", "room__name"):
+            if group == "sensor":
+                label, names[str(id_)] = str(id_), name
+            elif group == "room":
+                label, names[str(room_id)] = str(room_id), room_name
+            else:
+                label = "all"
+            groups[id_] = label
+        return Response(
+            {
+                "bucket": bucket,
+                "agg": agg,
+                "key": key,
+                "group": group,
+                "names": names,
+                "results": compare(groups, bucket, agg, key, start, end),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @action(
+        methods=["get"],
+        detail=False,
+        url_path="queue",
+        renderer_classes=[
+            JSONRenderer,
+        ],
+    )
+    def queue_stats(self, request):
+        return Response(get_ingest_queue().stats(), status=status.HTTP_200_OK)
+
+
+class DashboardViewSet(viewsets.ViewSet):
+    renderer_classes = [JSONRenderer]
+
+    @action(
+        methods=["get"],
+        detail=False,
+        url_path="summary",
+        renderer_classes=[
+            JSONRenderer,
+        ],
+    )
+    def summary(self, request):
+        """Everything the dashboard shows on load, in one response.
+
+        ``rooms`` lists the rooms and ``groups`` the sensors by room (null for none) and
+        status, each with its ``latest`` values. Only active sensors' values are included,
+        ``latest`` is null for the others.
+        """
+        latest = SensorLatest.objects.filter(sensor__status=Sensor.SensorStatus.ACTIVE)
+        sensors = Sensor.objects.order_by("id").prefetch_related(Prefetch("latest", queryset=latest))
+        groups = {}
+        for data in SensorSerializer(sensors, many=True, context={"latest": True}).data:
+            groups.setdefault((data["room"], data["status"]), []).append(data)
+
+        ordered = sorted(groups.items(), key=lambda item: (item[0][0] is None, item[0][0] or 0, item[0][1]))
+        return Response(
+            {
+                "rooms": RoomSerializer(Room.objects.order_by("id"), many=True).data,
+                "groups": [{"room": room, "status": label, "sensors": members} for (room, label), members in ordered],
+            },
+            status=status.HTTP_200_OK,
+        )
@@ -0,0 +1,339 @@
+import atexit, json, logging, os, queue, shutil, threading, time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import locks
+from django.db import DataError, IntegrityError, close_old_connections, connections, transaction
+from django.utils.dateparse import parse_datetime
+from rest_framework.utils.encoders import JSONEncoder
+
+from .last_seen import last_seen_tracker
+from .models import SensorData
+from .typed import save_readings
+
+
+logger = logging.getLogger(__name__)
+
+# Errors a retry cannot fix, the reading itself is bad (e.g. its sensor was deleted meanwhile)
+PERMANENT_ERRORS = (IntegrityError, DataError, ValueError, TypeError)
+
+# Seconds between replays of a journal that could not be written, doubling up to the maximum
+REPLAY_BACKOFF = 1
+REPLAY_MAX_BACKOFF = 60
+
+
+class JournalReplayError(Exception):
+    pass
+
+
+@contextmanager
+def _file_lock(path, blocking=True):
+    """Hold an exclusive lock on ``path`` across processes. Yields whether it was acquired."""
+    with open(path, "a") as lock_file:
+        acquired = locks.lock(lock_file, locks.LOCK_EX if blocking else locks.LOCK_EX | locks.LOCK_NB)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                locks.unlock(lock_file)
+
+
+class IngestQueue:
+    """Bounded in-memory queue of readings drained by a single writer thread.
+
+    The writer commits up to ``batch_size`` readings per transaction, waiting at most
+    ``flush_interval`` seconds to fill a batch. Readings that do not fit in the queue, or
+    whose batch fails to commit, are appended to an NDJSON journal which is replayed
+    when the writer starts and whenever it is idle. A batch that fails is retried one reading
+    at a time, and readings that fail on their own with one of ``PERMANENT_ERRORS`` are moved
+    to ``<journal>.dead`` so they never hold up the rest.
+
+    Every server process shares the journal. Appends and the rename that starts a replay hold
+    ``<journal>.lock``, and a replay holds ``<journal>.replay.lock`` throughout, so only one
+    process replays at a time and no reading is written twice.
+    """
+
+    def __init__(self, max_size=None, batch_size=None, flush_interval=None, journal_path=None):
+        self.max_size = max_size or settings.SENSOR_INGEST_QUEUE_MAX_SIZE
+        self.batch_size = batch_size or settings.SENSOR_INGEST_QUEUE_BATCH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else settings.SENSOR_INGEST_QUEUE_FLUSH_INTERVAL
+        self.journal_path = str(journal_path or settings.SENSOR_INGEST_QUEUE_JOURNAL)
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._journal_lock = threading.Lock()
+        self._journal_pending = os.path.exists(self.journal_path)
+        self._replay_backoff = 0
+        self._replay_after = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "spilled": 0,
+            "replayed": 0,
+            "written": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "dead_lettered": 0,
+            "errors": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+        }
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def put(self, reading):
+        """Queue an unsaved ``SensorData``. Returns False if it was spilled to the journal."""
+        try:
+            self._queue.put_nowait(reading)
+        except queue.Full:
+            self._spill([reading])
+            return False
+        self._count("enqueued", 1)
+        return True
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sensordata-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the writer and write out whatever is still queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.drain()
+
+    def drain(self):
+        """Write everything currently queued from the calling thread. Returns the number written."""
+        written = 0
+        while batch := self._take(block=False):
+            batch_written, unwritten = self._write(batch)
+            written += len(batch_written)
+            if unwritten:
+                self._spill(unwritten)
+        return written
+
+    def replay_journal(self):
+        """Write the readings in the journal to the database. Returns the number replayed.
+
+        Returns 0 without waiting if another process is replaying. Raises ``JournalReplayError``
+        if some readings could not be written, they are kept for the next replay.
+        """
+        with _file_lock(self.journal_path + ".replay.lock", blocking=False) as acquired:
+            if not acquired:
+                return 0
+            return self._replay()
+
+    def _replay(self):
+        replay_path = self.journal_path + ".replay"
+        with self._journal_lock, _file_lock(self.journal_path + ".lock"):
+            # Anything spilled from here on goes to a fresh journal
+            if os.path.exists(self.journal_path):
+                if os.path.exists(replay_path):
+                    # Left by a replay that stopped early, take what was spilled since along
+                    with open(self.journal_path) as journal, open(replay_path, "a") as replay:
+                        shutil.copyfileobj(journal, replay)
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, replay_path)
+            self._journal_pending = False
+        if not os.path.exists(replay_path):
+            return 0
+
+        with open(replay_path) as journal:
+            readings = self._parse_journal(journal)
+
+        replayed = 0
+        for i in range(0, len(readings), self.batch_size):
+            batch = readings[i:i + self.batch_size]
+            written, unwritten = self._write(batch)
+            replayed += len(written)
+            if unwritten:
+                # Keep only what has not been committed, so a retry does not duplicate readings
+                with open(replay_path, "w") as journal:
+                    journal.write(self._journal_lines(unwritten + readings[i + self.batch_size:]))
+                with self._journal_lock:
+                    self._journal_pending = True
+                self._count("replayed", replayed)
+                raise JournalReplayError(f"{len(readings) - replayed} journaled readings could not be written yet")
+        os.remove(replay_path)
+        with self._journal_lock:
+            self._journal_pending = os.path.exists(self.journal_path)
+        self._count("replayed", replayed)
+        return replayed
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                **self._stats,
+                "depth": self._queue.qsize(),
+                "max_size": self.max_size,
+                "batch_size": self.batch_size,
+                "running": self.running,
+            }
+
+    def _run(self):
+        try:
+            self._replay_safely()
+            while not self._stop.is_set():
+                try:
+                    batch = self._take(block=True)
+                    close_old_connections()
+                    if batch:
+                        _, unwritten = self._write(batch)
+                        if unwritten:
+                            self._spill(unwritten)
+                    elif self._journal_pending and time.monotonic() >= self._replay_after:
+                        self._replay_safely()
+                except Exception:
+                    # Ending the thread would leave every later reading queued or journaled, unwritten
+                    logger.exception("Ingest writer error")
+                    self._count("errors", 1)
+        finally:
+            connections.close_all()
+
+    def _take(self, block):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval) if block else self._queue.get_nowait()]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if block and remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """Commit ``batch``. Returns ``(written, unwritten)``, unwritten being left by a failure worth retrying."""
+        started = time.monotonic()
+        try:
+            with transaction.atomic():
+                save_readings(batch)
+            written, unwritten = batch, []
+        except Exception:
+            logger.exception("Failed to write %d queued readings", len(batch))
+            self._count("failed_batches", 1)
+            written, unwritten = self._write_each(batch)
+        if not written:
+            return written, unwritten
+        try:
+            last_seen_tracker.touch_many((r.sensor_id, r.timestamp) for r in written)
+        except Exception:
+            # The readings are committed, journaling them would write them twice
+            logger.exception("Failed to update last_seen of %d written readings", len(written))
+            self._count("errors", 1)
+
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._stats_lock:
+            self._stats["written"] += len(written)
+            self._stats["batches"] += 1
+            self._stats["last_batch_size"] = len(written)
+            self._stats["last_flush_ms"] = elapsed_ms
+            self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+        return written, unwritten
+
+    def _write_each(self, batch):
+        """Write a failed batch one reading at a time. Returns ``(written, unwritten)``."""
+        written, dead = [], []
+        for i, reading in enumerate(batch):
+            # Ids set by the failed bulk INSERT were rolled back with it
+            reading.id = None
+            try:
+                with transaction.atomic():
+                    save_readings([reading])
+            except PERMANENT_ERRORS:
+                dead.append(reading)
+            except Exception:
+                # Not the reading's fault, e.g. "database is locked": keep the rest for later
+                self._dead_letter(dead)
+                return written, batch[i:]
+            else:
+                written.append(reading)
+        self._dead_letter(dead)
+        return written, []
+
+    def _dead_letter(self, readings):
+        if not readings:
+            return
+        logger.error("Moving %d readings that cannot be written to %s.dead", len(readings), self.journal_path)
+        lines = self._journal_lines(readings)
+        with self._journal_lock, _file_lock(self.journal_path + ".lock"):
+            with open(self.journal_path + ".dead", "a") as dead:
+                dead.write(lines)
+        self._count("dead_lettered", len(readings))
+
+    def _parse_journal(self, journal):
+        readings = []
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning("Skipping corrupt ingest journal line: %r", line)
+                continue
+            readings.append(SensorData(
+                sensor_id=entry["sensor"],
+                data=entry["data"],
+                timestamp=parse_datetime(entry["timestamp"]),
+            ))
+        return readings
+
+    def _journal_lines(self, readings):
+        return "".join(
+            json.dumps({"sensor": r.sensor_id, "data": r.data, "timestamp": r.timestamp}, cls=JSONEncoder) + "\n"
+            for r in readings
+        )
+
+    def _spill(self, readings):
+        lines = self._journal_lines(readings)
+        with self._journal_lock, _file_lock(self.journal_path + ".lock"):
+            with open(self.journal_path, "a") as journal:
+                journal.write(lines)
+                journal.flush()
+                os.fsync(journal.fileno())
+            self._journal_pending = True
+        self._count("spilled", len(readings))
+
+    def _replay_safely(self):
+        try:
+            self.replay_journal()
+        except Exception as e:
+            if isinstance(e, JournalReplayError):
+                # The batch failure was logged by ``_write``
+                logger.warning("%s, retrying in %ss", e, self._replay_backoff or REPLAY_BACKOFF)
+            else:
+                logger.exception("Failed to replay the ingest journal")
+            self._replay_backoff = min(self._replay_backoff * 2 or REPLAY_BACKOFF, REPLAY_MAX_BACKOFF)
+            self._replay_after = time.monotonic() + self._replay_backoff
+        else:
+            self._replay_backoff = 0
+
+    def _count(self, name, n):
+        with self._stats_lock:
+            self._stats[name] += n
+
+
+_ingest_queue = None
+
+
+def get_ingest_queue():
+    """The process wide queue used by ``SensorDataViewSet.create`` when enabled."""
+    global _ingest_queue
+    if _ingest_queue is None:
+        _ingest_queue = IngestQueue()
+        atexit.register(_ingest_queue.stop, timeout=5)
+    return _ingest_queue
+
+
+def start_ingest_queue():
+    """Start the writer (replaying the journal first) if ``SENSOR_INGEST_QUEUE_ENABLED``."""
+    if settings.SENSOR_INGEST_QUEUE_ENABLED:
+        get_ingest_queue().start()
@@ -4,14 +4,15 @@ import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output, State
 import dash_bootstrap_components as dbc
-import pandas as pd
 import plotly.express as px
 
 from components.unregistered_table import unregistered_table
+from series_cache import SeriesCache
 
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 SERVER_URL = os.environ.get('SERVER_URL', 'http://localhost:8000')
+series_cache = SeriesCache(SERVER_URL)
 
 app.layout = html.Div([
     dcc.Interval(id='interval-component', interval=5*1000, n_intervals=0),
@@ -43,21 +44,15 @@ app.layout = html.Div([
 ])
 
 def get_sensors():
-    sen_response = requests.get(f'{SERVER_URL}/sensors/')
-    roo_response = requests.get(f'{SERVER_URL}/rooms/')
-    if sen_response.status_code == 200 and roo_response.status_code == 200:
-        return sen_response.json()["results"], roo_response.json()["results"]
-    else:
-        sen_response.raise_for_status()
-        roo_response.raise_for_status()
-        return None
+    # Rooms, sensors and their latest readings in one round trip
+    response = requests.get(f'{SERVER_URL}/dashboard/summary/')
+    response.raise_for_status()
+    summary = response.json()
+    sensors = [sensor for group in summary["groups"] for sensor in group["sensors"]]
+    return sensors, summary["rooms"]
     
 def get_sensor_data(id_):
-    response = requests.get(f'{SERVER_URL}/sensors/{id_}/data/')
-    if response.status_code == 200:
-        return response.json()["results"]
-    else:
-        return None
+    return series_cache.refresh(id_)
     
 @app.callback(
     Output('all-sensors', 'data'),
@@ -67,6 +62,13 @@ def load_data_on_start(_):
     data = get_sensors()
     return data
 
+def sensor_label(sensor):
+    latest = sensor.get("latest")
+    if not latest or not isinstance(latest["data"], dict):
+        return sensor['name']
+    values = ", ".join(f"{key}: {value}" for key, value in latest["data"].items())
+    return f"{sensor['name']} ({values})"
+
 @app.callback(
     [
         Output('sensor-select', 'options'),
@@ -78,7 +80,7 @@ def load_data_on_start(_):
 def update_dropdown_options(data):
     data, rooms = data
     if data:
-        options = [{'label': item['name'], 'value': item['id']} for item in data if item["status"] != "Unregistered"]
+        options = [{'label': sensor_label(item), 'value': item['id']} for item in data if item["status"] != "Unregistered"]
         room_opts = [{'label': item['name'], 'value': item['id']} for item in rooms]
         unreg_sensors = [
             {
@@ -99,22 +101,25 @@ def update_dropdown_options(data):
 def sensor_data_options(id_):
     # NOTE: have this both plot the first key and populate the dropdown
     # That will let me have an auto-refresh on the graph
-    data = get_sensor_data(id_)
-    if data is None:
-        return [], {}
-    df = pd.DataFrame([d["data"] for d in data])
-    options = [{'label': item, 'value': item} for item in df.columns]
-    df["timestamp"] = pd.to_datetime(pd.Series([d["timestamp"] for d in data]))
-    return options, df.to_json()
+    if id_ is None:
+        return [], None
+    df = get_sensor_data(id_)
+    if df is None:
+        return [], None
+    options = [{'label': item, 'value': item} for item in df.columns if item not in ("timestamp", "id")]
+    # The frame itself stays in series_cache, only new readings are fetched on each interval
+    return options, id_
 
 @app.callback(
     Output('sensor-graph', 'figure'),
     [Input('sensor-data', 'data'), Input('sensor-data-select', 'value'), Input('interval-component', 'n_intervals')],
 )
-def update_graph(data, value, _):
-    if data is None or len(data) == 0:
+def update_graph(id_, value, _):
+    if id_ is None or value is None:
+        return {}
+    data = get_sensor_data(id_)
+    if data is None or value not in data:
         return {}
-    data = pd.read_json(data)
     fig = px.line(data, x='timestamp', y=value)
     return fig
 
@@ -0,0 +1,25 @@
+import json, struct
+
+import numpy as np
+import pandas as pd
+
+
+MAGIC = b"HBCOL1\0\0"
+MEDIA_TYPE = "application/vnd.homebase.columnar"
+
+
+def read_frame(payload):
+    """Load a columnar response from the API into ``(meta, DataFrame)``.
+
+    Columns are read straight out of the payload with ``np.frombuffer``, there is no
+    per-row parsing. See ``homebase/sensors/columnar.py`` for the layout.
+    """
+    if payload[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a columnar payload")
+    (header_size,) = struct.unpack_from("<Q", payload, len(MAGIC))
+    header = json.loads(payload[len(MAGIC) + 8:len(MAGIC) + 8 + header_size])
+    columns = {
+        column["name"]: np.frombuffer(payload, dtype=column["dtype"], count=header["rows"], offset=column["offset"])
+        for column in header["columns"]
+    }
+    return header["meta"], pd.DataFrame(columns)
@@ -0,0 +1,75 @@
+import threading
+from datetime import timedelta
+
+import pandas as pd
+import requests
+
+from columnar import MEDIA_TYPE, read_frame
+
+
+class SeriesCache:
+    """Per-sensor history kept in the dashboard process and topped up incrementally.
+
+    The first refresh of a sensor loads the last ``window`` of readings. Later refreshes
+    only ask the API for readings stored after the newest one held (``after_id``) and
+    readings older than ``window`` are dropped. Readings are not stored in timestamp order
+    (batches carry device timestamps, the write queue and its journal write late), so the
+    lower bound is the start of the window rather than the newest cached timestamp, and the
+    frame is re-sorted after every refresh.
+    """
+
+    def __init__(self, server_url, window=timedelta(days=1), page_size=5000):
+        self.server_url = server_url
+        self.window = window
+        self.page_size = page_size
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def get(self, sensor_id):
+        with self._lock:
+            return self._frames.get(sensor_id)
+
+    def refresh(self, sensor_id):
+        """Fetch what is new for ``sensor_id`` and return the cached frame (or None)."""
+        cached = self.get(sensor_id)
+        if cached is None or cached.empty:
+            start = pd.Timestamp.now(tz="UTC") - self.window
+            params = {"start": start.isoformat()}
+        else:
+            params = {
+                "start": (cached["timestamp"].max() - self.window).tz_localize("UTC").isoformat(),
+                "after_id": int(cached["id"].max()),
+            }
+
+        new = self._fetch(sensor_id, params)
+        if new is None:
+            return cached
+        frame = new if cached is None else pd.concat([cached, new], ignore_index=True)
+        if not frame.empty:
+            frame = frame.drop_duplicates("id").sort_values(["timestamp", "id"])
+            cutoff = frame["timestamp"].iloc[-1] - self.window
+            frame = frame[frame["timestamp"] >= cutoff].reset_index(drop=True)
+        with self._lock:
+            self._frames[sensor_id] = frame
+        return frame
+
+    def clear(self, sensor_id=None):
+        with self._lock:
+            if sensor_id is None:
+                self._frames.clear()
+            else:
+                self._frames.pop(sensor_id, None)
+
+    def _fetch(self, sensor_id, params):
+        url = f"{self.server_url}/sensors/{sensor_id}/data/"
+        params = {**params, "limit": self.page_size}
+        frames = []
+        while url:
+            response = requests.get(url, params=params, headers={"Accept": MEDIA_TYPE})
+            if response.status_code != 200:
+                return None
+            meta, df = read_frame(response.content)
+            frames.append(df)
+            # The next link already carries the query parameters
+            url, params = meta.get("next"), None
+        return pd.concat(frames, ignore_index=True)
@@ -72,18 +72,22 @@ class Sensor:
         self._app.add_routes(self._routes)
     
     async def _post_data(self):
-        while True:
-            print("Sending fake data")
-            data = self.gen_data()
-            async with ClientSession() as session:
-                async with session.post(f"{self._dest}/sensordata/", json=data) as response:
-                    if response.status in [200, 201]:
-                        print("Data sent successfully")
-                    elif response.status == 403:
-                        print("Awaiting registration")
-                    else:
-                        print("Failed to send data")
-            await asyncio.sleep(self.data_interval)  # Simulating data
+        # One session for the sensor's lifetime, so the connection to the server is kept alive
+        async with ClientSession() as session:
+            while True:
+                print("Sending fake data")
+                data = self.gen_data()
+                try:
+                    async with session.post(f"{self._dest}/sensordata/", json=data) as response:
+                        if response.status in [200, 201, 202]:
+                            print("Data sent successfully")
+                        elif response.status == 403:
+                            print("Awaiting registration")
+                        else:
+                            print("Failed to send data")
+                except ClientConnectionError:
+                    print("Failed to connect to server")
+                await asyncio.sleep(self.data_interval)  # Simulating data
 
     # Abstract methods
     def gen_data(self):
@@ -0,0 +1,240 @@
+# Ingest and query benchmarks against the real Django app, run in-process with the test client
+# on a throwaway SQLite database. Results are written as JSON so runs can be compared:
+#
+#   python utils/benchmark.py --sensors 20 --rate 1 --duration 60 --sizes 10000 100000 -o bench.json
+#   python utils/benchmark.py --sensors 20 --rate 1 --duration 60 --sizes 10000 100000 --baseline bench.json
+import argparse, datetime, json, math, os, platform, random, statistics, subprocess, sys, tempfile, time
+
+from sensor_spawn import _gen_binary, _gen_brownian
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+generators = {
+    "temperature": (_gen_brownian, 20),
+    "door": (_gen_binary, 0),
+}
+
+
+def setup_django(db_path):
+    sys.path.insert(0, os.path.join(ROOT, "homebase"))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "homebase.settings")
+    from homebase import settings
+    settings.DATABASES["default"]["NAME"] = db_path
+    settings.SENSOR_INGEST_QUEUE_JOURNAL = db_path + ".journal"
+
+    import django
+    from django.core.management import call_command
+    from django.test.utils import setup_test_environment
+    django.setup()
+    setup_test_environment()
+    call_command("migrate", verbosity=0)
+
+
+class Fleet:
+    """``sensors`` simulated sensors, a ``door_ratio`` share of them doors, each reading ``rate`` times a second."""
+
+    def __init__(self, sensors, rate, door_ratio, seed):
+        # The generators use the random module, seed it for reproducible fleets
+        random.seed(seed)
+        self.rate = rate
+        self.elapsed = 0.0
+        self.members = []
+        for i in range(sensors):
+            sensor_type = "door" if i < sensors * door_ratio else "temperature"
+            self.members.append({"identifier": f"bench-{seed}-{i}", "sensor_type": sensor_type, "last": generators[sensor_type][1]})
+
+    def readings(self, seconds):
+        """The next ``seconds`` of readings in time order, as ``(member, offset, data)``."""
+        interval = 1 / self.rate
+        for step in range(int(seconds * self.rate)):
+            offset = self.elapsed + step * interval
+            for member in self.members:
+                gen, _ = generators[member["sensor_type"]]
+                data, member["last"] = gen(member["sensor_type"], member["last"])
+                yield member, offset, data
+        self.elapsed += int(seconds * self.rate) * interval
+
+
+def summarize(latencies, elapsed=None, count=None):
+    latencies = sorted(latencies)
+    result = {
+        "n": len(latencies),
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "max_ms": latencies[-1] * 1000,
+    }
+    if elapsed is not None:
+        result["per_second"] = (count or len(latencies)) / elapsed
+    return result
+
+
+def timed(client, method, path, **kwargs):
+    started = time.perf_counter()
+    response = getattr(client, method)(path, **kwargs)
+    if hasattr(response, "streaming_content"):
+        for _ in response.streaming_content:
+            pass
+    elapsed = time.perf_counter() - started
+    if response.status_code >= 400:
+        raise RuntimeError(f"{method.upper()} {path} returned {response.status_code}")
+    return elapsed
+
+
+def register(client, fleet):
+    from sensors.models import Sensor
+    for member in fleet.members:
+        client.post("/sensors/", {"identifier": member["identifier"], "sensor_type": member["sensor_type"]}, content_type="application/json")
+    sensors = {sensor.identifier: sensor for sensor in Sensor.objects.all()}
+    for member in fleet.members:
+        sensors[member["identifier"]].register(member["identifier"])
+        member["id"] = sensors[member["identifier"]].id
+
+
+def bench_ingest(client, fleet, duration, batch_size):
+    """Post ``duration`` seconds of the fleet's readings as fast as the app takes them."""
+    results = {}
+    readings = list(fleet.readings(duration))
+
+    latencies = []
+    started = time.perf_counter()
+    for member, _, data in readings:
+        latencies.append(timed(client, "post", "/sensordata/", data={"identifier": member["identifier"], "data": data}, content_type="application/json"))
+    results["single"] = summarize(latencies, time.perf_counter() - started)
+
+    latencies = []
+    started = time.perf_counter()
+    for member, _, data in readings:
+        latencies.append(timed(client, "post", "/sensordata/fast/", data={"identifier": member["identifier"], "data": data}, content_type="application/json"))
+    results["fast"] = summarize(latencies, time.perf_counter() - started)
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(0, len(readings), batch_size):
+        batch = [{"identifier": member["identifier"], "data": data} for member, _, data in readings[i:i + batch_size]]
+        latencies.append(timed(client, "post", "/sensordata/batch/", data=batch, content_type="application/json"))
+    results[f"batch_{batch_size}"] = summarize(latencies, time.perf_counter() - started, len(readings))
+    return results
+
+
+def load_history(fleet, size):
+    """Top the readings table up to ``size`` rows of fleet history, 1/rate seconds apart."""
+    from sensors.models import SensorData
+    from sensors.rollups import update_rollups
+
+    missing = size - SensorData.objects.count()
+    rows = []
+    for member, offset, data in fleet.readings(missing / len(fleet.members) / fleet.rate):
+        rows.append(SensorData(sensor_id=member["id"], data=data, timestamp=START + datetime.timedelta(seconds=offset)))
+        if len(rows) == 5000:
+            SensorData.objects.bulk_create(rows)
+            rows = []
+    SensorData.objects.bulk_create(rows)
+    while update_rollups(50000):
+        pass
+
+
+def bench_queries(client, fleet, repeat):
+    member = fleet.members[-1]
+    path = f"/sensors/{member['id']}/data/"
+    end = (START + datetime.timedelta(days=math.ceil(fleet.elapsed / 86400))).isoformat()
+    middle = (START + datetime.timedelta(seconds=fleet.elapsed / 2)).isoformat()
+    queries = {
+        "raw_first_page": (path, {"limit": 1000}),
+        "raw_deep_page": (path, {"limit": 1000, "start": middle}),
+        "raw_columnar": (path, {"limit": 1000, "start": middle, "format": "columnar"}),
+        "bucket_5m": (path, {"bucket": "5m"}),
+        "bucket_1h_rollups": (path, {"bucket": "1h", "start": START.isoformat(), "end": end}),
+        "query_all_1h": ("/sensordata/query/", {"key": member["sensor_type"], "bucket": "1h", "group": "all"}),
+    }
+    return {
+        name: summarize([timed(client, "get", path, data=params) for _ in range(repeat)])
+        for name, (path, params) in queries.items()
+    }
+
+
+def environment():
+    import django
+    import sqlite3
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def regressions(results, baseline, threshold, path=()):
+    """Latencies that grew by more than ``threshold`` times against the baseline."""
+    found = []
+    for key, value in results.items():
+        if key not in baseline:
+            continue
+        if isinstance(value, dict):
+            found += regressions(value, baseline[key], threshold, path + (key,))
+        elif key == "p50_ms" and value > baseline[key] * threshold:
+            found.append((".".join(path), baseline[key], value))
+    return found
+
+
+parser = argparse.ArgumentParser(description="Benchmark ingest and queries of the homebase app")
+parser.add_argument("--sensors", type=int, default=20, help="Sensors in the fleet")
+parser.add_argument("--rate", type=float, default=1.0, help="Readings per second per sensor")
+parser.add_argument("--door-ratio", type=float, default=0.25, help="Share of door sensors, the rest are temperature")
+parser.add_argument("--duration", type=float, default=10, help="Seconds of fleet readings to ingest")
+parser.add_argument("--batch-size", type=int, default=100, help="Readings per batch post")
+parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="Table sizes to benchmark queries at")
+parser.add_argument("--repeat", type=int, default=20, help="Runs per query")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("-o", "--output", type=str, help="Write results to this JSON file")
+parser.add_argument("--baseline", type=str, help="Compare against a previous results file")
+parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown factor reported as a regression")
+
+
+def main():
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(os.path.join(tmp, "bench.sqlite3"))
+        from django.test import Client
+        from sensors.last_seen import last_seen_tracker
+
+        client = Client()
+        fleet = Fleet(args.sensors, args.rate, args.door_ratio, args.seed)
+        register(client, fleet)
+        results = {
+            "environment": environment(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "threshold")},
+            "ingest": bench_ingest(client, fleet, args.duration, args.batch_size),
+            "queries": {},
+        }
+        for size in sorted(args.sizes):
+            load_history(fleet, size)
+            results["queries"][str(size)] = bench_queries(client, fleet, args.repeat)
+        last_seen_tracker.flush()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = regressions({k: results[k] for k in ("ingest", "queries")}, baseline, args.threshold)
+        for name, before, after in slower:
+            print(f"REGRESSION {name}: p50 {before:.2f} ms -> {after:.2f} ms", file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
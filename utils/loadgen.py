@@ -0,0 +1,243 @@
+# A load generator running thousands of simulated sensors in one event loop over a shared,
+# pooled HTTP session, e.g.
+#
+#   python utils/loadgen.py --url http://localhost:8000 --sensors 10000 --rate 0.2 --mode poisson --activate
+#   python utils/loadgen.py --url http://localhost:8000 --sensors 2000 --mode burst --batch 250
+import argparse, asyncio, json, random, time, uuid
+from array import array
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from aiohttp.client_exceptions import ClientError
+
+from sensor_spawn import _gen_binary, _gen_brownian
+
+generators = {
+    "temperature": (_gen_brownian, 20),
+    "door": (_gen_binary, 0),
+}
+
+
+class Stats:
+    """Request counts and latencies, overall and since the last report."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latencies = array("d")
+        self.statuses = {}
+        self.errors = {}
+        self.readings = 0
+        self._mark = (self.started, 0, 0)
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    def record(self, started, status=None, error=None, readings=1):
+        self.latencies.append(time.monotonic() - started)
+        if error is not None:
+            name = type(error).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+        else:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status < 300:
+                self.readings += readings
+
+    @property
+    def failed(self):
+        return sum(self.errors.values()) + sum(n for status, n in self.statuses.items() if status >= 300)
+
+    def interval(self):
+        """Rates and latency percentiles since the previous call."""
+        now = time.monotonic()
+        since, requests, readings = self._mark
+        self._mark = (now, self.requests, self.readings)
+        return self._summary(self.latencies[requests:], now - since, self.readings - readings)
+
+    def total(self):
+        summary = self._summary(self.latencies, time.monotonic() - self.started, self.readings)
+        summary.update({
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            "errors": self.errors,
+            "failed": self.failed,
+        })
+        return summary
+
+    @staticmethod
+    def _summary(latencies, elapsed, readings):
+        latencies = sorted(latencies)
+        pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000 if latencies else None
+        return {
+            "elapsed": elapsed,
+            "requests": len(latencies),
+            "requests_per_second": len(latencies) / elapsed if elapsed else 0.0,
+            "readings_per_second": readings / elapsed if elapsed else 0.0,
+            "p50_ms": pick(0.5),
+            "p99_ms": pick(0.99),
+        }
+
+
+class VirtualSensor:
+    def __init__(self, sensor_type):
+        self.identifier = str(uuid.uuid4())
+        self.sensor_type = sensor_type
+        self.last = generators[sensor_type][1]
+
+    def reading(self):
+        gen, _ = generators[self.sensor_type]
+        data, self.last = gen(self.sensor_type, self.last)
+        return {"identifier": self.identifier, "data": data}
+
+
+class LoadGenerator:
+    def __init__(self, url, session, sensors, rate, mode, batch, batch_interval, prefix):
+        self.url = url.rstrip("/")
+        self.session = session
+        self.sensors = sensors
+        self.rate = rate
+        self.mode = mode
+        self.batch = batch
+        self.batch_interval = batch_interval
+        self.prefix = prefix
+        self.stats = Stats()
+        self._pending = []
+
+    async def request(self, path, payload, readings=1):
+        started = time.monotonic()
+        try:
+            async with self.session.post(f"{self.url}{path}", json=payload) as response:
+                await response.read()
+                self.stats.record(started, status=response.status, readings=readings)
+                return response
+        except (ClientError, asyncio.TimeoutError) as e:
+            self.stats.record(started, error=e)
+            return None
+
+    async def setup(self, activate):
+        """Identify every sensor and, with ``activate``, register it so its readings are accepted."""
+        async def one(sensor):
+            response = await self.request(f"{self.prefix}/sensors/", {"identifier": sensor.identifier, "sensor_type": sensor.sensor_type})
+            if response is None or response.status >= 300:
+                return
+            if activate:
+                sensor_id = (await response.json())["id"]
+                await self.request(f"/sensors/{sensor_id}/register/", {"name": f"load-{sensor.identifier[:8]}"})
+
+        await asyncio.gather(*(one(sensor) for sensor in self.sensors))
+        self.stats = Stats()
+
+    def delays(self):
+        """Seconds to wait before each reading of one sensor."""
+        period = 1 / self.rate
+        if self.mode == "burst":
+            # Everyone fires together on the period boundaries
+            while True:
+                now = time.monotonic()
+                yield period - now % period
+        elif self.mode == "poisson":
+            while True:
+                yield random.expovariate(self.rate)
+        else:
+            # Steady, each sensor at a random phase and with a little jitter
+            yield random.uniform(0, period)
+            while True:
+                yield period * random.uniform(0.9, 1.1)
+
+    async def run_sensor(self, sensor, deadline):
+        for delay in self.delays():
+            if time.monotonic() + delay >= deadline:
+                return
+            await asyncio.sleep(delay)
+            if self.batch:
+                self._pending.append(sensor.reading())
+                if len(self._pending) >= self.batch:
+                    await self.flush()
+            else:
+                await self.request(f"{self.prefix}/sensordata/", sensor.reading())
+
+    async def flush(self):
+        batch, self._pending = self._pending[:self.batch], self._pending[self.batch:]
+        if batch:
+            await self.request(f"{self.prefix}/sensordata/batch/", batch, readings=len(batch))
+
+    async def run_flusher(self, deadline):
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.batch_interval)
+            await self.flush()
+
+    async def report(self, every, target):
+        while True:
+            await asyncio.sleep(every)
+            s = self.stats.interval()
+            p50 = f"{s['p50_ms']:.1f}" if s["p50_ms"] is not None else "-"
+            p99 = f"{s['p99_ms']:.1f}" if s["p99_ms"] is not None else "-"
+            print(
+                f"{time.monotonic() - self.stats.started:6.0f}s  {s['requests_per_second']:8.1f} req/s  "
+                f"{s['readings_per_second']:8.1f} readings/s (target {target:.1f})  "
+                f"p50 {p50} ms  p99 {p99} ms  failed {self.stats.failed}",
+                flush=True,
+            )
+
+    async def run(self, duration, report_every):
+        deadline = time.monotonic() + duration
+        reporter = asyncio.create_task(self.report(report_every, len(self.sensors) * self.rate))
+        tasks = [self.run_sensor(sensor, deadline) for sensor in self.sensors]
+        if self.batch:
+            tasks.append(self.run_flusher(deadline))
+        try:
+            await asyncio.gather(*tasks)
+            while self._pending:
+                await self.flush()
+        finally:
+            reporter.cancel()
+        return self.stats.total()
+
+
+parser = argparse.ArgumentParser(description="Simulate a fleet of sensors posting to the server")
+parser.add_argument("--url", type=str, default="http://localhost:8000", help="URL of the server")
+parser.add_argument("--sensors", type=int, default=1000, help="Number of simulated sensors")
+parser.add_argument("--door-ratio", type=float, default=0.25, help="Share of door sensors, the rest are temperature")
+parser.add_argument("--rate", type=float, default=0.5, help="Readings per second per sensor")
+parser.add_argument("--mode", choices=["steady", "poisson", "burst"], default="steady", help="How readings are scheduled")
+parser.add_argument("--duration", type=float, default=60, help="Seconds to run for")
+parser.add_argument("--batch", type=int, default=0, help="Post readings to the batch endpoint this many at a time")
+parser.add_argument("--batch-interval", type=float, default=1.0, help="Seconds after which a partial batch is posted")
+parser.add_argument("--connections", type=int, default=100, help="Size of the shared connection pool")
+parser.add_argument("--timeout", type=float, default=10, help="Seconds before a request is counted as failed")
+parser.add_argument("--async-ingest", action="store_true", help="Post to the /ingest/ endpoints (ASGI)")
+parser.add_argument("--activate", action="store_true", help="Register the sensors so their readings are accepted")
+parser.add_argument("--report", type=float, default=5, help="Seconds between progress lines")
+parser.add_argument("--seed", type=int, default=None)
+parser.add_argument("-o", "--output", type=str, help="Write the final stats to this JSON file")
+
+
+async def main():
+    args = parser.parse_args()
+    random.seed(args.seed)
+    sensors = [
+        VirtualSensor("door" if i < args.sensors * args.door_ratio else "temperature")
+        for i in range(args.sensors)
+    ]
+    connector = TCPConnector(limit=args.connections)
+    async with ClientSession(connector=connector, timeout=ClientTimeout(total=args.timeout)) as session:
+        loadgen = LoadGenerator(
+            args.url,
+            session,
+            sensors,
+            args.rate,
+            args.mode,
+            args.batch,
+            args.batch_interval,
+            "/ingest" if args.async_ingest else "",
+        )
+        print(f"Identifying {len(sensors)} sensors...", flush=True)
+        await loadgen.setup(args.activate)
+        stats = await loadgen.run(args.duration, args.report)
+
+    print(json.dumps(stats, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(stats, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())